@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""Compare the throughput of the ways of checksumming image files.
+
+Usage: tox -e venv -- python tools/checksum_benchmark.py [--dir DIR]
+       [--sizes 1,5,10] [FILE ...]
+
+Test files of the given sizes (in GiB) are written to DIR, which should be
+on the disk the images live on, unless existing files are given. Unless run
+as root with --drop-caches, files smaller than the free memory are likely to
+be read from the page cache, so results are best compared on files larger
+than the RAM of the machine.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import subprocess
+import tempfile
+import time
+
+from tripleoclient import utils
+
+GIB = 1024 ** 3
+
+
+def legacy_md5(path):
+    """md5 with 64 KiB reads, as file_checksum used to do."""
+    checksum = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            fragment = f.read(65536)
+            if not fragment:
+                break
+            checksum.update(fragment)
+    return checksum.hexdigest()
+
+
+def two_passes(path):
+    """md5 and sha256 computed one after another."""
+    return (utils.file_digests(path, ('md5',)),
+            utils.file_digests(path, ('sha256',)))
+
+
+METHODS = [
+    ('legacy md5 (64 KiB reads)', legacy_md5),
+    ('file_digests md5', lambda path: utils.file_digests(path)),
+    ('file_digests md5+sha256, one pass',
+     lambda path: utils.file_digests(path, ('md5', 'sha256'))),
+    ('file_digests md5, sha256, two passes', two_passes),
+]
+
+
+def make_file(directory, size):
+    fd, path = tempfile.mkstemp(dir=directory, prefix='checksum-bench-')
+    chunk = os.urandom(64 * 1024 * 1024)
+    with os.fdopen(fd, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(chunk[:size - written])
+            written += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+def drop_caches():
+    subprocess.check_call(['sync'])
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*',
+                        help='Existing files to checksum instead of '
+                             'generated ones.')
+    parser.add_argument('--dir', default=tempfile.gettempdir(),
+                        help='Where to write the generated files.')
+    parser.add_argument('--sizes', default='1,5,10',
+                        help='Comma separated sizes of the generated '
+                             'files, in GiB.')
+    parser.add_argument('--drop-caches', action='store_true',
+                        help='Drop the page cache before each run '
+                             '(needs root).')
+    args = parser.parse_args()
+
+    generated = []
+    files = args.files
+    if not files:
+        for size in args.sizes.split(','):
+            print('Writing a %s GiB test file...' % size)
+            generated.append(make_file(args.dir, int(float(size) * GIB)))
+        files = generated
+
+    try:
+        for path in files:
+            size = os.path.getsize(path)
+            print('\n%s (%.1f GiB)' % (path, float(size) / GIB))
+            for name, method in METHODS:
+                if args.drop_caches:
+                    drop_caches()
+                started = time.time()
+                method(path)
+                elapsed = time.time() - started
+                print('  %-40s %8.2fs %10.1f MiB/s'
+                      % (name, elapsed, size / 1024.0 ** 2 / elapsed))
+    finally:
+        for path in generated:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -68,3 +68,7 @@ class PasswordFileNotFound(Exception):
 
 class RootDeviceDetectionError(Exception):
     """Failed to detect the root device"""
+
+
+class DownloadError(Exception):
+    """Failed to download a file"""
@@ -15,7 +15,10 @@
 
 """OpenStackClient Plugin interface"""
 
+import atexit
+import importlib
 import logging
+import os
 
 from openstackclient.common import utils
 
@@ -32,10 +35,44 @@ API_VERSIONS = {
 }
 
 
+# Sessions whose requests are recorded when API call statistics are asked for
+_INSTRUMENTED_SESSIONS = ('keystoneauth1.session', 'keystoneclient.session')
+_api_call_recorder = None
+
+
 def make_client(instance):
     return ClientWrapper(instance)
 
 
+def _session_classes():
+    for module_name in _INSTRUMENTED_SESSIONS:
+        try:
+            yield importlib.import_module(module_name).Session
+        except ImportError:
+            pass
+
+
+def instrument_api_calls(target):
+    """Record the API calls of all the clients until the process exits
+
+    The statistics are then written to the file `target` as JSON, or printed
+    as a table on stderr if `target` is '-'.
+    """
+    global _api_call_recorder
+    if _api_call_recorder is not None:
+        return _api_call_recorder
+
+    # imported here so that other OSC commands do not pay for it
+    from tripleoclient import utils as tripleo_utils
+
+    recorder = tripleo_utils.ApiCallRecorder()
+    for session_class in _session_classes():
+        recorder.install_class(session_class)
+    atexit.register(recorder.emit, target)
+    _api_call_recorder = recorder
+    return recorder
+
+
 # Required by the OSC plugin interface
 def build_option_parser(parser):
     """Hook to add global options
@@ -56,6 +93,13 @@ def build_option_parser(parser):
         help='TripleO Client API version, default=' +
              DEFAULT_TRIPLEOCLIENT_API_VERSION +
              ' (Env: OS_TRIPLEOCLIENT_API_VERSION)')
+
+    # This is the only hook run before every command, the statistics have to
+    # be asked for through the environment.
+    api_stats = os.environ.get('TRIPLEOCLIENT_API_STATS')
+    if api_stats:
+        LOG.debug("Recording API calls to %s", api_stats)
+        instrument_api_calls(api_stats)
     return parser
 
 
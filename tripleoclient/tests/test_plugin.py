@@ -30,3 +30,28 @@ class TestPlugin(base.TestCase):
 
         # And the functions should only be called when the client is created:
         self.assertEqual(clientmgr.auth.get_token.call_count, 0)
+
+    @mock.patch('atexit.register')
+    @mock.patch.object(plugin, '_api_call_recorder', None)
+    @mock.patch.object(plugin, '_session_classes')
+    def test_instrument_api_calls(self, mock_session_classes, mock_register):
+
+        class Session(object):
+            def request(self, url, method, **kwargs):
+                return mock.Mock(status_code=200,
+                                 headers={'Content-Length': '42'})
+
+        mock_session_classes.return_value = [Session]
+        parser = mock.Mock()
+        with mock.patch.dict('os.environ',
+                             {'TRIPLEOCLIENT_API_STATS': '/tmp/stats'}):
+            plugin.build_option_parser(parser)
+            plugin.build_option_parser(parser)
+
+        recorder = plugin._api_call_recorder
+        mock_register.assert_called_once_with(recorder.emit, '/tmp/stats')
+        self.addCleanup(recorder.uninstall)
+
+        Session().request('http://ironic/v1/nodes', 'GET',
+                          endpoint_filter={'service_type': 'baremetal'})
+        self.assertEqual({'baremetal': 1}, recorder.calls)
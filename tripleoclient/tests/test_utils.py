@@ -15,9 +15,24 @@
 
 from uuid import uuid4
 
+from concurrent import futures
+import gzip
+import hashlib
+from heatclient.common import template_utils
+import ironic_inspector_client
+from ironicclient import exc as ironic_exc
+import json
 import mock
+import os
 import os.path
+import shutil
+import six
+from six.moves import BaseHTTPServer
+from six.moves import urllib
+import sys
 import tempfile
+import threading
+import time
 from unittest import TestCase
 
 from tripleoclient import exceptions
@@ -220,7 +235,204 @@ class TestWaitForStackUtil(TestCase):
 
         utils.wait_for_stack_ready(self.mock_orchestration, 'stack')
 
-        self.assertEqual(2, sleep_mock.call_count)
+        self.assertEqual([mock.call(utils.StackEventWaiter.status_interval)
+                          ] * 2, sleep_mock.call_args_list)
+        # events are only fetched when they are printed
+        mock_el.assert_not_called()
+
+    def mock_resource(self, resource_name, nested_id=None,
+                      physical_resource_id='id'):
+        links = []
+        if nested_id:
+            links.append({'rel': 'nested',
+                          'href': 'http://heat/stacks/%s' % nested_id})
+        return mock.Mock(resource_name=resource_name, links=links,
+                         physical_resource_id=physical_resource_id)
+
+    @mock.patch("heatclient.common.event_utils.get_events")
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_stack_verbose_nested(self, sleep_mock, mock_el):
+        resources = {
+            'stack': [[self.mock_resource('Nested', 'stack-Nested/1234'),
+                       self.mock_resource('Quick', 'stack-Quick/5678')]],
+            'stack-Nested/1234': [[self.mock_resource('server')]],
+            'stack-Quick/5678': [[self.mock_resource('config')]],
+        }
+        self.mock_orchestration.resources.list.side_effect = (
+            lambda stack_id: resources[stack_id].pop(0))
+
+        events = {
+            'stack': [[
+                self.mock_event('Nested', 'aaa', 'state changed',
+                                'CREATE_IN_PROGRESS', '2015-10-14T02:25:21Z'),
+                # started and finished between two polls
+                self.mock_event('Quick', 'bbb', 'state changed',
+                                'CREATE_IN_PROGRESS', '2015-10-14T02:25:22Z'),
+                self.mock_event('Quick', 'ccc', 'state changed',
+                                'CREATE_COMPLETE', '2015-10-14T02:25:25Z'),
+            ], [], [
+                self.mock_event('Nested', 'ddd', 'state changed',
+                                'CREATE_COMPLETE', '2015-10-14T02:25:42Z'),
+                self.mock_event('stack', 'eee',
+                                'Stack CREATE completed successfully',
+                                'CREATE_COMPLETE', '2015-10-14T02:25:43Z'),
+            ]],
+            'stack-Nested/1234': [[
+                # history of an earlier action
+                self.mock_event('server', 'old', 'earlier action',
+                                'CREATE_COMPLETE', '2015-10-13T02:25:30Z'),
+                self.mock_event('server', 'fff', 'state changed',
+                                'CREATE_IN_PROGRESS', '2015-10-14T02:25:30Z'),
+            ], [], [
+                self.mock_event('server', 'ggg', 'state changed',
+                                'CREATE_COMPLETE', '2015-10-14T02:25:41Z'),
+            ]],
+            'stack-Quick/5678': [[
+                self.mock_event('config', 'hhh', 'quick config done',
+                                'CREATE_COMPLETE', '2015-10-14T02:25:24Z'),
+            ]],
+        }
+
+        def get_events(client, stack_id, event_args):
+            return events[stack_id].pop(0)
+        mock_el.side_effect = get_events
+
+        in_progress = mock.Mock(stack_name='stack',
+                                stack_status='CREATE_IN_PROGRESS')
+        complete = mock.Mock(stack_name='stack',
+                             stack_status='CREATE_COMPLETE')
+        self.mock_orchestration.stacks.get.side_effect = [
+            in_progress, in_progress, in_progress, in_progress, complete]
+
+        with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+            self.assertTrue(utils.wait_for_stack_ready(
+                self.mock_orchestration, 'stack', marker='xyz',
+                verbose=True))
+
+        self.assertEqual([
+            mock.call(self.mock_orchestration, stack_id='stack',
+                      event_args={'sort_dir': 'asc', 'marker': 'xyz'}),
+            mock.call(self.mock_orchestration, stack_id='stack-Nested/1234',
+                      event_args={'sort_dir': 'asc', 'marker': None}),
+            mock.call(self.mock_orchestration, stack_id='stack-Quick/5678',
+                      event_args={'sort_dir': 'asc', 'marker': None}),
+            # the sweep backs off while nothing happens
+            mock.call(self.mock_orchestration, stack_id='stack',
+                      event_args={'sort_dir': 'asc', 'marker': 'ccc'}),
+            mock.call(self.mock_orchestration, stack_id='stack-Nested/1234',
+                      event_args={'sort_dir': 'asc', 'marker': 'fff'}),
+            # the finished stack, the quick nested stack is not followed
+            mock.call(self.mock_orchestration, stack_id='stack',
+                      event_args={'sort_dir': 'asc', 'marker': 'ccc'}),
+            mock.call(self.mock_orchestration, stack_id='stack-Nested/1234',
+                      event_args={'sort_dir': 'asc', 'marker': 'fff'}),
+        ], mock_el.call_args_list)
+        # resources are only listed to find the stacks of new resources
+        self.assertEqual([mock.call('stack'),
+                          mock.call('stack-Nested/1234'),
+                          mock.call('stack-Quick/5678')],
+                         self.mock_orchestration.resources.list.mock_calls)
+        # the status is checked at a fixed interval
+        self.assertEqual([mock.call(utils.StackEventWaiter.status_interval)
+                          ] * 3, sleep_mock.call_args_list)
+
+        output = stdout.getvalue()
+        self.assertIn('quick config done', output)
+        self.assertNotIn('earlier action', output)
+        self.assertLess(output.index('[server]: CREATE_COMPLETE'),
+                        output.index('completed successfully'))
+
+    @mock.patch("heatclient.common.event_utils.get_events")
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_stack_verbose_nested_failed(self, sleep_mock, mock_el):
+        resources = {
+            'stack': [
+                [self.mock_resource('Nested', 'stack-Nested/1234'),
+                 # not created yet
+                 self.mock_resource('Other', physical_resource_id='')],
+                [self.mock_resource('Nested', 'stack-Nested/1234'),
+                 self.mock_resource('Other', 'stack-Other/5678')],
+            ],
+            'stack-Nested/1234': [[self.mock_resource('server')]],
+            'stack-Other/5678': [[self.mock_resource('volume')]],
+        }
+        self.mock_orchestration.resources.list.side_effect = (
+            lambda stack_id: resources[stack_id].pop(0))
+
+        events = {
+            'stack': [[
+                self.mock_event('Nested', 'aaa', 'state changed',
+                                'CREATE_IN_PROGRESS', '2015-10-14T02:25:21Z'),
+            ], [
+                self.mock_event('Other', 'bbb', 'state changed',
+                                'CREATE_IN_PROGRESS', '2015-10-14T02:25:30Z'),
+                self.mock_event('Other', 'ccc', 'Resource CREATE failed',
+                                'CREATE_FAILED', '2015-10-14T02:25:41Z'),
+                self.mock_event('Nested', 'ddd', 'Resource CREATE failed',
+                                'CREATE_FAILED', '2015-10-14T02:25:41Z'),
+                self.mock_event('stack', 'fff', 'Stack CREATE failed',
+                                'CREATE_FAILED', '2015-10-14T02:25:42Z'),
+            ]],
+            'stack-Nested/1234': [[], [
+                self.mock_event('server', 'ggg', 'Quota exceeded',
+                                'CREATE_FAILED', '2015-10-14T02:25:40Z'),
+            ]],
+            'stack-Other/5678': [[
+                self.mock_event('volume', 'hhh', 'No space left',
+                                'CREATE_FAILED', '2015-10-14T02:25:40Z'),
+            ]],
+        }
+
+        def get_events(client, stack_id, event_args):
+            return events[stack_id].pop(0)
+        mock_el.side_effect = get_events
+
+        in_progress = mock.Mock(stack_name='stack',
+                                stack_status='CREATE_IN_PROGRESS')
+        failed = mock.Mock(stack_name='stack',
+                           stack_status='CREATE_FAILED')
+        self.mock_orchestration.stacks.get.side_effect = [
+            in_progress, in_progress, failed]
+
+        with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+            self.assertFalse(utils.wait_for_stack_ready(
+                self.mock_orchestration, 'stack', marker='xyz',
+                verbose=True))
+
+        # the events of the nested stacks since the last poll are printed
+        output = stdout.getvalue()
+        self.assertIn('Quota exceeded', output)
+        self.assertIn('No space left', output)
+        self.assertLess(output.index('Quota exceeded'),
+                        output.index('Stack CREATE failed'))
+
+    @mock.patch("heatclient.common.event_utils.get_events")
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_stack_verbose_idle(self, sleep_mock, mock_el):
+        mock_el.return_value = []
+        in_progress = mock.Mock(stack_name='stack',
+                                stack_status='CREATE_IN_PROGRESS')
+        complete = mock.Mock(stack_name='stack',
+                             stack_status='CREATE_COMPLETE')
+        self.mock_orchestration.stacks.get.side_effect = (
+            [in_progress] * 11 + [complete])
+
+        self.assertTrue(utils.wait_for_stack_ready(
+            self.mock_orchestration, 'stack', verbose=True))
+
+        # the status is checked on every loop, events less and less often
+        self.assertEqual(10, sleep_mock.call_count)
+        self.assertEqual(5, mock_el.call_count)
+        self.assertFalse(self.mock_orchestration.resources.list.called)
+
+    def test_stack_waiter_backoff(self):
+        stack = mock.Mock(stack_name='stack')
+        waiter = utils.StackEventWaiter(self.mock_orchestration, stack)
+
+        delays = [waiter._next_delay(False) for _i in range(10)]
+        self.assertEqual(waiter.max_delay, delays[-1])
+        self.assertEqual(sorted(delays), delays)
+        self.assertEqual(waiter.min_delay, waiter._next_delay(True))
 
     def test_create_environment_file(self):
 
@@ -259,6 +471,42 @@ class TestWaitForStackUtil(TestCase):
 
         self.assertEqual(uuids, ['IJKLMNOP', ])
 
+    @mock.patch('tripleoclient.utils.wait_for_provision_state')
+    def test_set_nodes_state_concurrent(self, wait_for_state_mock):
+        bm_client = mock.Mock()
+        nodes = [mock.Mock(uuid=str(i), provision_state="manageable")
+                 for i in range(10)]
+
+        pollers = set()
+
+        def wait(client, uuid, state, poller):
+            # every transition is requested before the first wait
+            self.assertEqual(10, client.node.set_provision_state.call_count)
+            pollers.add(poller)
+            if uuid == '3':
+                raise exceptions.StateTransitionFailed('on fire')
+            if uuid == '4':
+                raise exceptions.Timeout('too slow')
+        wait_for_state_mock.side_effect = wait
+
+        uuids = list(utils.set_nodes_state(bm_client, nodes, 'provide',
+                                           'available', concurrency=3))
+
+        bm_client.node.set_provision_state.assert_has_calls([
+            mock.call(node.uuid, 'provide') for node in nodes])
+        self.assertEqual(sorted(node.uuid for node in nodes), sorted(uuids))
+        self.assertEqual(10, wait_for_state_mock.call_count)
+        # all the waits share the same node listings
+        self.assertEqual(1, len(pollers))
+
+    def test_set_nodes_state_nothing_to_do(self):
+        bm_client = mock.Mock()
+        nodes = [mock.Mock(uuid="ABCDEFGH", provision_state="active")]
+
+        self.assertEqual([], list(utils.set_nodes_state(
+            bm_client, nodes, 'provide', 'available', ('active',))))
+        self.assertFalse(bm_client.node.set_provision_state.called)
+
     @mock.patch("subprocess.Popen")
     def test_get_hiera_key(self, mock_popen):
 
@@ -331,6 +579,158 @@ class TestWaitForStackUtil(TestCase):
             utils.wait_for_provision_state(baremetal_client, 'UUID',
                                            "available", loops=1, sleep=0.01)
 
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_provision_state_poller(self, sleep_mock):
+        baremetal_client = mock.Mock()
+        baremetal_client.http_client.os_ironic_api_version = '1.11'
+        baremetal_client.node.list.side_effect = [
+            [mock.Mock(uuid='UUID', provision_state='manageable',
+                       last_error=None)],
+            [mock.Mock(uuid='UUID', provision_state='available',
+                       last_error=None)],
+        ]
+        poller = utils.NodeStatePoller(baremetal_client)
+
+        utils.wait_for_provision_state(baremetal_client, 'UUID', "available",
+                                       poller=poller)
+
+        self.assertFalse(baremetal_client.node.get.called)
+        baremetal_client.node.list.assert_called_with(
+            fields=['uuid', 'provision_state', 'last_error'], limit=0)
+        self.assertEqual(2, baremetal_client.node.list.call_count)
+
+    def test_wait_for_provision_state_poller_errors(self):
+        baremetal_client = mock.Mock()
+        baremetal_client.node.list.return_value = [
+            mock.Mock(uuid='UUID1', provision_state='enroll',
+                      last_error='node on fire'),
+            mock.Mock(uuid='UUID2', provision_state='enroll',
+                      last_error=None),
+        ]
+        poller = utils.NodeStatePoller(baremetal_client)
+
+        with self.assertRaises(exceptions.StateTransitionFailed):
+            utils.wait_for_provision_state(baremetal_client, 'UUID1',
+                                           "available", loops=1, sleep=0.01,
+                                           poller=poller)
+        with self.assertRaises(exceptions.Timeout):
+            utils.wait_for_provision_state(baremetal_client, 'UUID2',
+                                           "available", loops=1, sleep=0.01,
+                                           poller=poller)
+        # the node is gone from ironic
+        baremetal_client.node.get.side_effect = ironic_exc.NotFound()
+        utils.wait_for_provision_state(baremetal_client, 'UUID3',
+                                       "available", loops=1, sleep=0.01,
+                                       poller=poller)
+        baremetal_client.node.get.assert_called_once_with('UUID3')
+        # no fields support in the default API version
+        baremetal_client.node.list.assert_called_with(detail=True, limit=0)
+
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_provision_state_poller_not_listed(self, sleep_mock):
+        baremetal_client = mock.Mock()
+        baremetal_client.node.list.return_value = [
+            mock.Mock(uuid='UUID1', provision_state='available',
+                      last_error=None),
+        ]
+        baremetal_client.node.get.side_effect = [
+            mock.Mock(uuid='UUID2', provision_state='manageable',
+                      last_error=None),
+            mock.Mock(uuid='UUID2', provision_state='available',
+                      last_error=None),
+        ]
+        poller = utils.NodeStatePoller(baremetal_client)
+
+        # a node in flight missing from the listing is not taken as gone
+        utils.wait_for_provision_state(baremetal_client, 'UUID2',
+                                       "available", poller=poller)
+
+        self.assertEqual(2, baremetal_client.node.get.call_count)
+        self.assertEqual(1, sleep_mock.call_count)
+
+    @mock.patch('time.sleep', return_value=None)
+    def test_wait_for_provision_state_poller_generation(self, sleep_mock):
+        baremetal_client = mock.Mock()
+        baremetal_client.node.list.side_effect = [
+            # taken before the transition, with an error from earlier
+            [mock.Mock(uuid='UUID', provision_state='manageable',
+                       last_error='old error')],
+            [mock.Mock(uuid='UUID', provision_state='available',
+                       last_error=None)],
+        ]
+        poller = utils.NodeStatePoller(baremetal_client)
+        poller.get('UUID')
+
+        generation = poller.generation
+        self.assertEqual(1, generation)
+        utils.wait_for_provision_state(baremetal_client, 'UUID', "available",
+                                       poller=poller, generation=generation)
+
+        self.assertEqual(2, baremetal_client.node.list.call_count)
+        sleep_mock.assert_not_called()
+
+    def test_node_state_poller_generation_refreshing(self):
+        baremetal_client = mock.Mock()
+        poller = utils.NodeStatePoller(baremetal_client)
+
+        def list_nodes(**kwargs):
+            # a listing in progress may predate what happens meanwhile
+            self.assertEqual(1, poller.generation)
+            return [mock.Mock(uuid='UUID')]
+        baremetal_client.node.list.side_effect = list_nodes
+
+        self.assertEqual(0, poller.generation)
+        poller.get('UUID')
+        self.assertEqual(1, poller.generation)
+
+    def test_concurrent_map(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def square(value):
+            with lock:
+                running.append(value)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(value)
+            return value * value
+
+        self.assertEqual([v * v for v in range(10)],
+                         utils.concurrent_map(square, range(10), 3))
+        self.assertLessEqual(max(peak), 3)
+        self.assertEqual([], utils.concurrent_map(square, []))
+
+    def test_thread_pool_size(self):
+        with mock.patch('concurrent.futures.ThreadPoolExecutor') as pool:
+            utils.thread_pool(3)
+            pool.assert_called_once_with(max_workers=3)
+            pool.reset_mock()
+            utils.thread_pool(100)
+            pool.assert_called_once_with(
+                max_workers=utils.DEFAULT_CONCURRENCY)
+            pool.reset_mock()
+            utils.thread_pool(0, 5)
+            pool.assert_called_once_with(max_workers=1)
+
+    def test_node_state_poller_shared(self):
+        baremetal_client = mock.Mock()
+        baremetal_client.node.list.return_value = [
+            mock.Mock(uuid='UUID1'), mock.Mock(uuid='UUID2')]
+        poller = utils.NodeStatePoller(baremetal_client)
+
+        node1, generation1 = poller.get('UUID1')
+        node2, generation2 = poller.get('UUID2', 0)
+        self.assertEqual('UUID1', node1.uuid)
+        self.assertEqual('UUID2', node2.uuid)
+        self.assertEqual(1, generation2)
+        self.assertEqual(1, baremetal_client.node.list.call_count)
+
+        # a waiter which saw the last listing gets a new one
+        poller.get('UUID1', generation1)
+        self.assertEqual(2, baremetal_client.node.list.call_count)
+
     @mock.patch('subprocess.check_call')
     @mock.patch('os.path.exists')
     def test_remove_known_hosts(self, mock_exists, mock_check_call):
@@ -372,6 +772,544 @@ class TestWaitForStackUtil(TestCase):
         self.assertRaises(ValueError, utils.file_checksum, '/dev/random')
         self.assertRaises(ValueError, utils.file_checksum, '/dev/zero')
 
+    def test_checksum_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        image = os.path.join(tmpdir, 'image')
+        with open(image, 'wb') as f:
+            f.write(b'foo')
+        os.utime(image, (1000000000, 1000000000))
+        cache_path = os.path.join(tmpdir, 'cache', 'checksums')
+
+        cache = utils.ChecksumCache(cache_path)
+        self.assertIsNone(cache.get(image))
+        self.assertEqual('acbd18db4cc2f85cedef654fccc4a4d8',
+                         utils.file_checksum(image, cache=cache))
+
+        # a new cache finds the checksum without reading the file
+        cache = utils.ChecksumCache(cache_path)
+        with mock.patch.object(utils, 'file_digests') as mock_digests:
+            self.assertEqual('acbd18db4cc2f85cedef654fccc4a4d8',
+                             utils.file_checksum(image, cache=cache))
+            self.assertFalse(mock_digests.called)
+
+        # modifying the file invalidates the entry
+        with open(image, 'wb') as f:
+            f.write(b'bar')
+        os.utime(image, (1000000001, 1000000001))
+        self.assertIsNone(cache.get(image))
+        self.assertEqual('37b51d194a7513e45b56f6524f2d51f2',
+                         utils.file_checksum(image, cache=cache))
+
+    def test_checksum_cache_recent_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        image = os.path.join(tmpdir, 'image')
+        with open(image, 'wb') as f:
+            f.write(b'foo')
+
+        cache = utils.ChecksumCache(os.path.join(tmpdir, 'checksums'))
+        self.assertEqual('acbd18db4cc2f85cedef654fccc4a4d8',
+                         cache.checksum(image))
+        # the file may still change within the same mtime tick
+        self.assertIsNone(cache.get(image))
+        self.assertFalse(os.path.exists(cache.path))
+
+    def test_file_digests(self):
+        with tempfile.NamedTemporaryFile() as temp_file:
+            temp_file.write(b'foo' * 5)
+            temp_file.flush()
+
+            # small reads to go through the buffer several times
+            self.assertEqual(
+                {'md5': hashlib.md5(b'foo' * 5).hexdigest(),
+                 'sha256': hashlib.sha256(b'foo' * 5).hexdigest()},
+                utils.file_digests(temp_file.name, ('md5', 'sha256'),
+                                   chunk_size=4))
+            self.assertEqual(hashlib.md5(b'foo' * 5).hexdigest(),
+                             utils.file_checksum(temp_file.name))
+
+    def test_file_digests_special_files(self):
+        self.assertRaises(ValueError, utils.file_digests, '/dev/zero')
+
+    def test_atomic_copy_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, 'src')
+        dest = os.path.join(tmpdir, 'dest')
+        with open(src, 'wb') as f:
+            f.write(b'foo' * 100000)
+        os.chmod(src, 0o644)
+        os.utime(src, (1000000000, 1000000000))
+        with open(dest, 'wb') as f:
+            f.write(b'old')
+
+        utils.atomic_copy_file(src, dest)
+
+        with open(dest, 'rb') as f:
+            self.assertEqual(b'foo' * 100000, f.read())
+        self.assertEqual(0o644, os.stat(dest).st_mode & 0o777)
+        self.assertEqual(1000000000, int(os.stat(dest).st_mtime))
+        self.assertEqual(['dest', 'src'], sorted(os.listdir(tmpdir)))
+
+    @mock.patch('os.sendfile', create=True, return_value=0)
+    @mock.patch('os.copy_file_range', create=True)
+    def test_atomic_copy_file_short_copy(self, copy_mock, sendfile_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, 'src')
+        dest = os.path.join(tmpdir, 'dest')
+        with open(src, 'wb') as f:
+            f.write(b'foo' * 100000)
+
+        def copy_file_range(fsrc, fdst, count, offset):
+            # stops at the middle of the file, as if it was truncated
+            if offset >= 150000:
+                return 0
+            os.lseek(fdst, offset, os.SEEK_SET)
+            return os.write(fdst, os.pread(fsrc, 150000 - offset, offset))
+        copy_mock.side_effect = copy_file_range
+
+        utils.atomic_copy_file(src, dest)
+
+        # the rest of the file is copied in user space
+        with open(dest, 'rb') as f:
+            self.assertEqual(b'foo' * 100000, f.read())
+
+    @mock.patch('os.sendfile', create=True, return_value=0)
+    @mock.patch('os.copy_file_range', create=True, return_value=0)
+    @mock.patch('os.fstat')
+    def test_atomic_copy_file_truncated(self, fstat_mock, copy_mock,
+                                        sendfile_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, 'src')
+        dest = os.path.join(tmpdir, 'dest')
+        with open(src, 'wb') as f:
+            f.write(b'foo')
+        with open(dest, 'wb') as f:
+            f.write(b'old')
+        # the source shrinks while it is copied
+        fstat_mock.return_value = mock.Mock(st_size=10)
+
+        self.assertRaises(IOError, utils.atomic_copy_file, src, dest)
+        with open(dest, 'rb') as f:
+            self.assertEqual(b'old', f.read())
+        self.assertEqual(['dest', 'src'], sorted(os.listdir(tmpdir)))
+
+    def test_atomic_copy_file_error(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'dest')
+
+        self.assertRaises(IOError, utils.atomic_copy_file,
+                          os.path.join(tmpdir, 'missing'), dest)
+        self.assertEqual([], os.listdir(tmpdir))
+
+    def test_atomic_write_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'cache', 'entries')
+
+        # every thread writes its own temporary file
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda i: utils.atomic_write_file(path, b'%d' % i * 1000),
+                range(32)))
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertIn(data, [b'%d' % i * 1000 for i in range(32)])
+        self.assertEqual(['entries'], os.listdir(os.path.dirname(path)))
+
+    @mock.patch('os.rename', side_effect=OSError('rename failed'))
+    def test_atomic_write_file_error(self, mock_rename):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        self.assertRaises(OSError, utils.atomic_write_file,
+                          os.path.join(tmpdir, 'entries'), b'data')
+        self.assertEqual([], os.listdir(tmpdir))
+
+    def test_file_stat_key(self):
+        st = mock.Mock(spec=['st_dev', 'st_ino', 'st_size', 'st_mtime'],
+                       st_dev=1, st_ino=2, st_size=3, st_mtime=4.5)
+
+        self.assertEqual([1, 2, 3, 4500000000], utils.file_stat_key(st))
+        st = mock.Mock(st_dev=1, st_ino=2, st_size=3, st_mtime=4.5,
+                       st_mtime_ns=4500000001)
+        self.assertEqual([1, 2, 3, 4500000001], utils.file_stat_key(st))
+
+    def test_is_racy(self):
+        now = time.time()
+        self.assertTrue(utils.is_racy(mock.Mock(st_mtime=now)))
+        self.assertFalse(utils.is_racy(mock.Mock(st_mtime=now - 10)))
+
+    def test_checksum_file(self):
+        with tempfile.TemporaryFile() as temp_file:
+            temp_file.write(b'foo')
+            temp_file.seek(0, os.SEEK_END)
+            data = utils.ChecksumFile(temp_file)
+            data.seek(0)
+
+            self.assertEqual(b'f', data.read(1))
+            self.assertEqual(b'oo', data.read())
+            self.assertEqual(3, data.tell())
+            self.assertEqual('acbd18db4cc2f85cedef654fccc4a4d8',
+                             data.hexdigest())
+
+
+class _RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves `server.data`, honouring simple Range headers"""
+
+    def do_GET(self):
+        data = self.server.data
+        self.server.requests.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range') and self.server.ranges:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(data):
+                self.send_response(416)
+                if self.server.content_range:
+                    self.send_header('Content-Range', 'bytes */%d' % len(data))
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def do_HEAD(self):
+        self.server.requests.append('HEAD')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.data)))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadFile(TestCase):
+
+    def setUp(self):
+        super(TestDownloadFile, self).setUp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                _RangeRequestHandler)
+        self.server.data = b'0123456789' * 1000
+        self.server.ranges = True
+        self.server.content_range = True
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/image.qcow2' % (
+            self.server.server_address[1])
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'image.qcow2')
+        self.checksum = hashlib.sha256(self.server.data).hexdigest()
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        utils.download_file(self.url, self.path, checksum=self.checksum,
+                            chunk_size=1000)
+        self.assertEqual(self.server.data, self._read())
+        self.assertEqual([None], self.server.requests)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_resume(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.server.data[:1234])
+
+        utils.download_file(self.url, self.path, checksum=self.checksum)
+        self.assertEqual(self.server.data, self._read())
+        self.assertEqual(['bytes=1234-'], self.server.requests)
+
+    def test_resume_complete(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.server.data)
+
+        utils.download_file(self.url, self.path, checksum=self.checksum)
+        self.assertEqual(self.server.data, self._read())
+
+    def test_resume_complete_no_checksum(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.server.data)
+
+        utils.download_file(self.url, self.path)
+        self.assertEqual(self.server.data, self._read())
+        self.assertEqual(['bytes=10000-'], self.server.requests)
+
+    def test_resume_complete_no_content_range(self):
+        self.server.content_range = False
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.server.data)
+
+        utils.download_file(self.url, self.path)
+        self.assertEqual(self.server.data, self._read())
+        self.assertEqual(['bytes=10000-', 'HEAD'], self.server.requests)
+
+    def test_resume_too_long(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.server.data + b'garbage')
+
+        self.assertRaises(exceptions.DownloadError, utils.download_file,
+                          self.url, self.path)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_resume_not_supported(self):
+        self.server.ranges = False
+        with open(self.path + '.part', 'wb') as f:
+            f.write(b'garbage')
+
+        utils.download_file(self.url, self.path, checksum=self.checksum)
+        self.assertEqual(self.server.data, self._read())
+
+    def test_bad_checksum(self):
+        self.assertRaises(exceptions.DownloadError, utils.download_file,
+                          self.url, self.path, checksum='0' * 64)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_not_found(self):
+        self.server.data = b''
+        self.assertRaises(exceptions.DownloadError, utils.download_file,
+                          'http://127.0.0.1:1/missing', self.path)
+
+
+class TestTemplateCache(TestCase):
+
+    def setUp(self):
+        super(TestTemplateCache, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.template = self._write(
+            'overcloud.yaml',
+            'heat_template_version: 2015-04-30\n'
+            'resources:\n'
+            '  config:\n'
+            '    type: OS::Heat::SoftwareConfig\n'
+            '    properties:\n'
+            '      config: {get_file: script.sh}\n')
+        self.script = self._write('script.sh', 'echo one\n')
+        self.env = self._write(
+            'env.yaml',
+            'resource_registry:\n'
+            '  OS::TripleO::Config: script.yaml\n'
+            'parameter_defaults:\n'
+            '  Foo: bar\n')
+        self._write('script.yaml', 'heat_template_version: 2015-04-30\n')
+
+    def _write(self, name, content, age=60):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    @mock.patch('heatclient.common.template_utils.get_template_contents',
+                wraps=template_utils.get_template_contents)
+    def test_get_template_contents(self, mock_get_template_contents):
+        expected = template_utils.get_template_contents(self.template)
+        mock_get_template_contents.reset_mock()
+
+        self.assertEqual(expected, utils.TemplateCache(
+            self.cache_dir).get_template_contents(self.template))
+        # a new cache, as in a later run, reads the entry from disk
+        self.assertEqual(expected, utils.TemplateCache(
+            self.cache_dir).get_template_contents(self.template))
+        self.assertEqual(1, mock_get_template_contents.call_count)
+
+        # only touched, the content is still the same
+        self._write('script.sh', 'echo one\n', age=30)
+        utils.TemplateCache(self.cache_dir).get_template_contents(
+            self.template)
+        self.assertEqual(1, mock_get_template_contents.call_count)
+
+        self._write('script.sh', 'echo two\n', age=30)
+        self.assertNotEqual(expected, utils.TemplateCache(
+            self.cache_dir).get_template_contents(self.template))
+        self.assertEqual(2, mock_get_template_contents.call_count)
+
+    def test_process_environments_non_string_keys(self):
+        env = self._write(
+            'keys.yaml',
+            'parameter_defaults:\n'
+            '  Mapping: {1: one, 2: two}\n'
+            '  Flags: {true: enabled}\n')
+        expected = template_utils.process_multiple_environments_and_files(
+            [env])
+        self.assertEqual({'Mapping': {1: 'one', 2: 'two'},
+                          'Flags': {True: 'enabled'}},
+                         expected[1]['parameter_defaults'])
+
+        self.assertEqual(expected, utils.TemplateCache(
+            self.cache_dir).process_environments([env]))
+        # a later run gets the same keys, not their JSON strings
+        self.assertEqual(expected, utils.TemplateCache(
+            self.cache_dir).process_environments([env]))
+
+    @mock.patch('heatclient.common.template_utils.'
+                'process_multiple_environments_and_files',
+                wraps=template_utils.process_multiple_environments_and_files)
+    def test_process_environments(self, mock_process_env):
+        recent = self._write('parameters.yaml',
+                             'parameter_defaults:\n  Foo: baz\n', age=0)
+        expected = template_utils.process_multiple_environments_and_files(
+            [self.env, recent])
+        mock_process_env.reset_mock()
+
+        cache = utils.TemplateCache(self.cache_dir)
+        self.assertEqual(expected,
+                         cache.process_environments([self.env, recent]))
+        self.assertEqual(expected,
+                         cache.process_environments([self.env, recent]))
+        self.assertEqual(2, mock_process_env.call_count)
+
+        # the recently modified environment was not saved
+        cache = utils.TemplateCache(self.cache_dir)
+        self.assertEqual(expected,
+                         cache.process_environments([self.env, recent]))
+        self.assertEqual([mock.call([self.env]), mock.call([recent]),
+                          mock.call([recent])],
+                         mock_process_env.call_args_list)
+
+    def test_cached_copy(self):
+        cache = utils.TemplateCache(self.cache_dir)
+        files, env = cache.process_environments([self.env])
+        env['parameter_defaults']['Foo'] = 'changed'
+        files, env = cache.process_environments([self.env])
+        self.assertEqual('bar', env['parameter_defaults']['Foo'])
+
+    def test_missing_template(self):
+        self.assertRaises(urllib.error.URLError,
+                          utils.TemplateCache(self.cache_dir)
+                          .get_template_contents,
+                          os.path.join(self.tmpdir, 'missing.yaml'))
+
+
+class TestApiCallRecorder(TestCase):
+
+    def setUp(self):
+        super(TestApiCallRecorder, self).setUp()
+        self.recorder = utils.ApiCallRecorder()
+        self.response = mock.Mock(status_code=200,
+                                  headers={'Content-Length': '100'})
+        self.error = None
+
+        class FakeSession(object):
+            def request(session, url, method, **kwargs):
+                if self.error:
+                    raise self.error
+                return self.response
+
+        self.session = FakeSession()
+        self.recorder.install(self.session)
+        self.addCleanup(self.recorder.uninstall)
+
+    def test_endpoint(self):
+        self.assertEqual(
+            '/v1/nodes/{id}/states/power',
+            self.recorder.endpoint('http://192.0.2.1:6385/v1/nodes/'
+                                   '1be26c0b-03f2-4d2e-ae87-c02d7f33c123/'
+                                   'states/power'))
+        self.assertEqual('/v2/{id}/servers/detail',
+                         self.recorder.endpoint('/v2/42/servers/detail'))
+
+    @mock.patch('time.time')
+    def test_record(self, mock_time):
+        mock_time.side_effect = [0, 0.01, 0, 3]
+        node = '/v1/nodes/1be26c0b-03f2-4d2e-ae87-c02d7f33c123'
+        self.session.request(node, 'GET',
+                             endpoint_filter={'service_type': 'baremetal'})
+        self.session.request(node, 'PATCH', json=[{'op': 'add'}],
+                             endpoint_filter={'service_type': 'baremetal'})
+
+        self.assertEqual({'baremetal': 2}, self.recorder.calls)
+        stats = self.recorder.to_dict()['endpoints']
+        self.assertEqual(['baremetal GET /v1/nodes/{id}',
+                          'baremetal PATCH /v1/nodes/{id}'],
+                         sorted(stats))
+        get = stats['baremetal GET /v1/nodes/{id}']
+        self.assertEqual(1, get['histogram']['<=0.05'])
+        self.assertEqual(100, get['response_bytes'])
+        patch = stats['baremetal PATCH /v1/nodes/{id}']
+        self.assertEqual(1, patch['histogram']['<=5'])
+        self.assertEqual(len('[{"op": "add"}]'), patch['request_bytes'])
+        self.assertIn('baremetal PATCH /v1/nodes/{id}',
+                      self.recorder.report())
+
+    def test_record_error(self):
+        self.error = ironic_exc.NotFound()
+        self.assertRaises(ironic_exc.NotFound, self.session.request,
+                          '/v1/nodes/foo', 'GET')
+        stats = self.recorder.to_dict()['endpoints']['other GET /v1/nodes/foo']
+        self.assertEqual(1, stats['errors'])
+
+    def test_emit(self):
+        self.session.request('/v1/nodes', 'GET')
+        path = os.path.join(tempfile.mkdtemp(), 'stats.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.recorder.emit(path)
+        with open(path) as f:
+            self.assertEqual({'other': 1}, json.load(f)['calls'])
+
+    def test_uninstall(self):
+        self.recorder.uninstall()
+        self.assertNotIn('request', vars(self.session))
+
+
+class TestPhaseTimer(TestCase):
+
+    @mock.patch('time.time')
+    def test_phases(self, mock_time):
+        mock_time.side_effect = [0, 2, 2, 3, 10, 11]
+        profiler = mock.Mock()
+        timer = utils.PhaseTimer(profiler)
+        with timer.phase('one'):
+            pass
+        with timer.phase('two', profile=False):
+            pass
+        with timer.phase('one'):
+            pass
+
+        self.assertEqual([('one', 3), ('two', 1)], list(timer.phases.items()))
+        self.assertEqual(2, profiler.enable.call_count)
+        self.assertEqual(2, profiler.disable.call_count)
+
+        yaml_loads = [('answers.yaml', 0.25, False)]
+        report = json.loads(timer.report('json', {'baremetal': 4},
+                                         yaml_loads))
+        self.assertEqual(4, report['total_seconds'])
+        self.assertEqual({'baremetal': 4}, report['api_calls'])
+        self.assertEqual([{'path': 'answers.yaml', 'seconds': 0.25,
+                           'cached': False}], report['yaml_files'])
+        table = timer.report('table', {'baremetal': 4}, yaml_loads)
+        self.assertIn('two', table)
+        self.assertIn('baremetal', table)
+        self.assertIn('answers.yaml', table)
+
+    def test_phase_error(self):
+        timer = utils.PhaseTimer()
+
+        def fail():
+            with timer.phase('failing'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(['failing'], list(timer.phases))
+
 
 class TestCheckNodesCount(TestCase):
 
@@ -418,6 +1356,26 @@ class TestCheckNodesCount(TestCase):
                          utils.check_nodes_count(self.baremetal, self.stack,
                                                  user_params, self.defaults))
 
+    def test_check_nodes_count_inventory(self):
+        self.baremetal.node.list.side_effect = None
+        self.baremetal.node.list.return_value = [
+            mock.Mock(uuid='1', instance_uuid='i1', maintenance=False),
+            mock.Mock(uuid='2', instance_uuid='i2', maintenance=True),
+            mock.Mock(uuid='3', instance_uuid=None, maintenance=False),
+            mock.Mock(uuid='4', instance_uuid=None, maintenance=True),
+        ]
+        for node in self.baremetal.node.list.return_value:
+            node.properties = {}
+        inventory = utils.NodeInventory(self.baremetal)
+
+        user_params = {'ControllerCount': 2}
+        self.assertEqual((True, 3, 3),
+                         utils.check_nodes_count(self.baremetal, None,
+                                                 user_params, self.defaults,
+                                                 inventory=inventory))
+        self.baremetal.node.list.assert_called_once_with(detail=True,
+                                                         limit=0)
+
     def test_check_default_param_not_in_stack(self):
         missing_param = 'CephStorageCount'
         self.stack.parameters = self.defaults.copy()
@@ -533,6 +1491,162 @@ class TestNodeAddCapabilities(TestCase):
         self.assertEqual({'x': 'y'}, new_caps)
 
 
+class TestRunCommand(TestCase):
+
+    def test_output(self):
+        self.assertEqual(
+            (3, 'out\nerr\n'),
+            utils.run_command([sys.executable, '-c',
+                               'import sys; print("out"); sys.stdout.flush(); '
+                               'sys.stderr.write("err\\n"); sys.exit(3)']))
+
+    def test_env(self):
+        self.assertEqual(
+            (0, 'value\n'),
+            utils.run_command([sys.executable, '-c',
+                               'import os; print(os.environ["FOO"])'],
+                              env=dict(os.environ, FOO='value')))
+
+    def test_timeout(self):
+        started = time.time()
+        self.assertRaises(exceptions.Timeout, utils.run_command,
+                          [sys.executable, '-c', 'import time; '
+                           'time.sleep(30)'], timeout=0.5)
+        self.assertLess(time.time() - started, 10)
+
+
+class TestListNodes(TestCase):
+    def test_fields(self):
+        bm_client = mock.Mock()
+        result = utils.list_nodes(bm_client, ['uuid', 'properties'],
+                                  maintenance=False)
+        self.assertIs(bm_client.node.list.return_value, result)
+        bm_client.node.list.assert_called_once_with(
+            fields=['uuid', 'properties'], maintenance=False)
+
+    def test_fields_not_supported(self):
+        bm_client = mock.Mock()
+        nodes = [mock.Mock(uuid='uuid1')]
+        bm_client.node.list.side_effect = [
+            ironic_exc.NotAcceptable(), nodes]
+        self.assertEqual(nodes, utils.list_nodes(bm_client, ['uuid'],
+                                                 maintenance=False))
+        self.assertEqual([
+            mock.call(fields=['uuid'], maintenance=False),
+            mock.call(detail=True, maintenance=False),
+        ], bm_client.node.list.mock_calls)
+
+    def test_get_nodes(self):
+        bm_client = mock.Mock()
+        bm_client.node.get.side_effect = lambda uuid: 'node-%s' % uuid
+        self.assertEqual({'a': 'node-a', 'b': 'node-b'},
+                         utils.get_nodes(bm_client, ['a', 'b']))
+        self.assertEqual({}, utils.get_nodes(bm_client, []))
+
+
+class TestIntrospectionDataCache(TestCase):
+
+    def setUp(self):
+        super(TestIntrospectionDataCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.inspector_client = mock.Mock(spec=['get_status', 'get_data'])
+        self.inspector_client.get_status.return_value = {
+            'finished': True, 'error': None, 'finished_at': 'T1'}
+        self.inspector_client.get_data.return_value = {'inventory': 'new'}
+
+    def _write_blob(self, node_uuid, content):
+        path = os.path.join(self.cache_dir, '%s.json.gz' % node_uuid)
+        with gzip.open(path, 'wb') as f:
+            f.write(content)
+
+    def _cache(self, offline=False):
+        return utils.IntrospectionDataCache(self.inspector_client,
+                                            self.cache_dir, offline)
+
+    def test_offline(self):
+        self._write_blob('uuid1', json.dumps(
+            {'finished_at': 'T0', 'data': {'inventory': 'cached'}}).encode())
+        cache = self._cache(offline=True)
+
+        self.assertEqual({'inventory': 'cached'}, cache.get_data('uuid1'))
+        self.assertRaises(exceptions.NotFound, cache.get_data, 'uuid2')
+        self.assertFalse(self.inspector_client.get_status.called)
+        self.assertFalse(self.inspector_client.get_data.called)
+
+    def test_offline_corrupted(self):
+        self._write_blob('uuid1', b'{"finished_at": "T0", "da')
+        self.assertRaises(exceptions.NotFound,
+                          self._cache(offline=True).get_data, 'uuid1')
+
+    def test_current(self):
+        self._write_blob('uuid1', json.dumps(
+            {'finished_at': 'T1', 'data': {'inventory': 'cached'}}).encode())
+
+        self.assertEqual({'inventory': 'cached'},
+                         self._cache().get_data('uuid1'))
+        self.inspector_client.get_status.assert_called_once_with('uuid1')
+        self.assertFalse(self.inspector_client.get_data.called)
+
+    def test_introspected_again(self):
+        self._write_blob('uuid1', json.dumps(
+            {'finished_at': 'T0', 'data': {'inventory': 'cached'}}).encode())
+
+        self.assertEqual({'inventory': 'new'},
+                         self._cache().get_data('uuid1'))
+        self.assertEqual({'inventory': 'new'},
+                         self._cache(offline=True).get_data('uuid1'))
+        self.inspector_client.get_data.assert_called_once_with('uuid1')
+
+    def test_no_finish_time(self):
+        self.inspector_client.get_status.return_value = {
+            'finished': True, 'error': None}
+        cache = self._cache()
+
+        self.assertEqual({'inventory': 'new'}, cache.get_data('uuid1'))
+        self.assertEqual({'inventory': 'new'}, cache.get_data('uuid1'))
+        self.assertEqual(2, self.inspector_client.get_data.call_count)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_prefetch_no_bulk_statuses(self):
+        cache = self._cache()
+        cache.prefetch(['uuid1', 'uuid2'])
+        cache.get_data('uuid1')
+        cache.get_data('uuid2')
+
+        # one status call per node, shared by prefetch() and get_data()
+        self.assertEqual(['uuid1', 'uuid2'], sorted(
+            c[0][0] for c in self.inspector_client.get_status.call_args_list))
+        self.assertEqual(2, self.inspector_client.get_data.call_count)
+
+    def test_prefetch(self):
+        self.inspector_client = mock.Mock(
+            spec=['get_status', 'get_data', 'list_statuses'])
+        self.inspector_client.list_statuses.side_effect = [
+            [{'uuid': 'uuid1', 'finished_at': 'T1'},
+             {'uuid': 'uuid2', 'finished_at': 'T1'}],
+            [],
+        ]
+
+        def get_data(node_uuid):
+            if node_uuid == 'uuid2':
+                raise ironic_inspector_client.ClientError(mock.Mock())
+            return {'inventory': node_uuid}
+        self.inspector_client.get_data.side_effect = get_data
+
+        cache = self._cache()
+        cache.prefetch(['uuid1', 'uuid2'])
+        self.assertEqual({'inventory': 'uuid1'}, cache.get_data('uuid1'))
+
+        self.assertFalse(self.inspector_client.get_status.called)
+        self.inspector_client.get_data.assert_has_calls(
+            [mock.call('uuid1'), mock.call('uuid2')], any_order=True)
+        self.assertEqual(2, self.inspector_client.get_data.call_count)
+        self.assertEqual(['uuid1.json.gz'], os.listdir(self.cache_dir))
+        self.assertEqual({'inventory': 'uuid1'},
+                         self._cache(offline=True).get_data('uuid1'))
+
+
 class FakeFlavor(object):
     def __init__(self, name, profile=''):
         self.name = name
@@ -702,3 +1816,95 @@ class TestAssignVerifyProfiles(TestCase):
         self.nodes[:] = [self._get_fake_node(profile=None)]
         self.flavors = {'baremetal': (FakeFlavor('baremetal', None), 1)}
         self._test(0, 0)
+
+    @mock.patch('time.sleep')
+    def test_assign_profiles_conflict(self, mock_sleep):
+        self.nodes[:] = [self._get_fake_node(possible_profiles=['compute']),
+                         self._get_fake_node(possible_profiles=['control'])]
+        attempts = []
+
+        def _update(uuid, patch):
+            attempts.append(uuid)
+            if uuid == self.nodes[0].uuid and attempts.count(uuid) == 1:
+                raise ironic_exc.Conflict()
+            if uuid == self.nodes[1].uuid:
+                raise ironic_exc.BadRequest()
+
+        self.bm_client.node.update.side_effect = _update
+
+        # the node failing with a non-conflict error is reported
+        self._test(1, 0, assign_profiles=True)
+        self.assertEqual(3, self.bm_client.node.update.call_count)
+        mock_sleep.assert_called_once_with(2)
+
+        actual_profiles = [utils.node_get_capabilities(node).get('profile')
+                           for node in self.nodes]
+        self.assertEqual(['compute', None], actual_profiles)
+
+    def test_assign_profiles_deterministic(self):
+        self.nodes[:] = [self._get_fake_node(possible_profiles=['compute',
+                                                                'control'])
+                         for _ in range(4)]
+        self.flavors = {name: (FakeFlavor(name), 2)
+                        for name in ('control', 'compute')}
+
+        errors, warnings = utils.assign_and_verify_profiles(
+            self.bm_client, self.flavors, assign_profiles=True,
+            deterministic=True)
+        self.assertEqual((0, 0), (errors, warnings))
+
+        # flavors are processed by name and nodes by UUID
+        by_uuid = sorted(self.nodes, key=lambda node: node.uuid)
+        actual_profiles = [utils.node_get_capabilities(node).get('profile')
+                           for node in by_uuid]
+        self.assertEqual(['compute', 'compute', 'control', 'control'],
+                         actual_profiles)
+
+    def test_inventory(self):
+        self.nodes[:] = [self._get_fake_node(profile='compute'),
+                         self._get_fake_node(profile='control')]
+        for node in self.nodes:
+            node.maintenance = False
+            node.instance_uuid = None
+        inventory = utils.NodeInventory(self.bm_client)
+        self.bm_client.node.list.reset_mock()
+
+        self._test(0, 0)
+        errors, warnings = utils.assign_and_verify_profiles(
+            self.bm_client, self.flavors, inventory=inventory)
+        self.assertEqual((0, 0), (errors, warnings))
+        self.bm_client.node.list.assert_called_once_with(maintenance=False,
+                                                         detail=True)
+
+
+class TestProfileIndex(TestCase):
+
+    def _node(self, uuid, caps, provision_state='available'):
+        return mock.Mock(uuid=uuid,
+                         properties={'capabilities': caps},
+                         provision_state=provision_state)
+
+    def test_index(self):
+        index = utils.ProfileIndex([
+            self._node('4', 'profile:compute'),
+            self._node('3', 'compute_profile:1,control_profile:true'),
+            self._node('2', 'compute_profile:0'),
+            self._node('1', 'compute_profile:1', provision_state='active'),
+        ])
+
+        self.assertEqual(['4'], index.with_profile('compute'))
+        self.assertEqual(['3'], index.candidates('compute', 5))
+        self.assertEqual(['3'], index.candidates('control', 1))
+        self.assertEqual([], index.candidates('control', 0))
+        self.assertEqual(['3', '2', '1'], index.without_profile())
+
+        self.assertEqual({'compute_profile': '1', 'control_profile': 'true'},
+                         index.take('3'))
+        self.assertEqual([], index.candidates('control', 1))
+        self.assertEqual(['2', '1'], index.without_profile())
+
+    def test_sort_nodes(self):
+        index = utils.ProfileIndex([self._node('b', ''),
+                                    self._node('a', '')],
+                                   sort_nodes=True)
+        self.assertEqual(['a', 'b'], index.without_profile())
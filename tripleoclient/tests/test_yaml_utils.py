@@ -0,0 +1,78 @@
+#   Copyright 2016 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import yaml
+
+from tripleoclient import yaml_utils
+
+
+class TestYamlUtils(TestCase):
+
+    def setUp(self):
+        super(TestYamlUtils, self).setUp()
+        yaml_utils.clear_cache()
+        self.addCleanup(yaml_utils.clear_cache)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _write(self, content, age=60):
+        path = os.path.join(self.tmpdir, 'file.yaml')
+        with open(path, 'w') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_load(self):
+        self.assertEqual({'a': [1, 2]}, yaml_utils.load('a: [1, 2]'))
+
+    def test_load_unsafe(self):
+        self.assertRaises(yaml.constructor.ConstructorError,
+                          yaml_utils.load,
+                          '!!python/object/apply:os.getcwd []')
+
+    def test_load_file_memoized(self):
+        path = self._write('a: 1\n')
+        document = yaml_utils.load_file(path)
+        self.assertEqual({'a': 1}, document)
+        document['a'] = 2
+
+        self.assertEqual({'a': 1}, yaml_utils.load_file(path))
+        self.assertEqual([(path, False), (path, True)],
+                         [(p, cached) for p, _, cached
+                          in yaml_utils.load_timings()])
+
+    def test_load_file_changed(self):
+        path = self._write('a: 1\n')
+        yaml_utils.load_file(path)
+        self._write('a: 22\n', age=30)
+        self.assertEqual({'a': 22}, yaml_utils.load_file(path))
+
+    def test_load_file_recent(self):
+        path = self._write('a: 1\n', age=0)
+        yaml_utils.load_file(path)
+        yaml_utils.load_file(path)
+        self.assertEqual([False, False], [
+            cached for _, _, cached in yaml_utils.load_timings()])
+
+    def test_load_file_missing(self):
+        self.assertRaises(IOError, yaml_utils.load_file,
+                          os.path.join(self.tmpdir, 'missing.yaml'))
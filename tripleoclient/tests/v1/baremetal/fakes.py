@@ -13,6 +13,8 @@
 #   under the License.
 #
 
+import threading
+
 import ironic_inspector_client
 import mock
 from openstackclient.tests import utils
@@ -49,9 +51,9 @@ class FakeBaremetalNodeClient(object):
         self.last_errors[node_uuid] = self.transition_errors.get(key, None)
         self.updates.append(key)
 
-    def _get(self, uuid, detail=False, **kwargs):
+    def _get(self, uuid, detail=False, fields=None, **kwargs):
         mock_node = mock.Mock(uuid=uuid, provision_state=self.states[uuid])
-        if detail:
+        if detail or (fields and 'last_error' in fields):
             mock_node.last_error = self.last_errors.get(uuid, None)
         else:
             mock_node.mock_add_spec(
@@ -68,6 +70,51 @@ class FakeBaremetalNodeClient(object):
                 for uuid in (sorted(self.states.keys()))]
 
 
+class FakeDracNodeClient(object):
+    def __init__(self, commit_required=(), job_polls=None):
+        """Create a test double for the DRAC calls of "baremetal node".
+
+        :param commit_required: uuids of the nodes whose BIOS settings are
+                                changed by set_bios_config.
+        :param job_polls: dictionary of how many times the config job of a
+                          node is listed as unfinished once the node was
+                          rebooted, eg {"ABC": 3}. Jobs of nodes which are
+                          not rebooted never finish.
+        """
+        self.commit_required = set(commit_required)
+        self.job_polls = dict(job_polls or {})
+        self.bios_settings = {}
+        self.jobs = {}
+        self.power_states = {}
+        self.calls = []  # inspect this to see which calls were made
+        self._lock = threading.Lock()
+
+    def vendor_passthru(self, node_uuid, method, http_method, args=None):
+        with self._lock:
+            self.calls.append((node_uuid, method))
+            if method == 'set_bios_config':
+                self.bios_settings[node_uuid] = args
+                return mock.Mock(
+                    commit_required=node_uuid in self.commit_required)
+            elif method == 'commit_bios_config':
+                self.jobs[node_uuid] = self.job_polls.get(node_uuid, 0) + 1
+                return mock.Mock()
+            elif method == 'list_unfinished_jobs':
+                remaining = self.jobs.get(node_uuid, 0)
+                if self.power_states.get(node_uuid) == 'reboot':
+                    remaining = self.jobs[node_uuid] = max(0, remaining - 1)
+                jobs = [{'id': 'JID_%s' % node_uuid,
+                         'name': 'ConfigBIOS:BIOS.Setup.1-1',
+                         'percent_complete': '34'}] if remaining else []
+                return mock.Mock(unfinished_jobs=jobs)
+        raise ValueError('Unexpected vendor passthru method %s' % method)
+
+    def set_power_state(self, node_uuid, state):
+        with self._lock:
+            self.calls.append((node_uuid, state))
+            self.power_states[node_uuid] = state
+
+
 class FakeInspectorClient(object):
     def __init__(self, states=None, data=None):
         self.states = states or {}
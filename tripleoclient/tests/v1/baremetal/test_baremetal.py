@@ -19,7 +19,9 @@ import os
 import tempfile
 
 import fixtures
+import ironic_inspector_client
 import mock
+from openstackclient.tests import utils as osc_test_utils
 from oslo_utils import units
 import yaml
 
@@ -46,6 +48,13 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
         super(TestValidateInstackEnv, self).tearDown()
         os.unlink(self.instack_json.name)
 
+    def test_invalid_bmc_timeout(self):
+        for value in ('0', '-1'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(osc_test_utils.ParserException,
+                                  self.check_parser, self.cmd,
+                                  ['--bmc-timeout', value], [])
+
     def test_success(self):
         self.mock_instackenv_json({
             "nodes": [{
@@ -200,9 +209,9 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(1, self.cmd.error_count)
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_ipmitool_success(self, mock_run_shell):
-        mock_run_shell.return_value = 0
+    @mock.patch('tripleoclient.utils.run_command')
+    def test_ipmitool_success(self, mock_run_command):
+        mock_run_command.return_value = (0, 'System Power : on\n')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -220,10 +229,17 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
         self.cmd.take_action(parsed_args)
 
         self.assertEqual(0, self.cmd.error_count)
+        mock_run_command.assert_called_once_with(
+            ['ipmitool', '-R', '1', '-I', 'lanplus', '-H', '192.168.122.1',
+             '-U', 'stack', '-E', 'chassis', 'status'],
+            timeout=30, env=mock.ANY)
+        self.assertEqual(
+            'KEY1', mock_run_command.call_args[1]['env']['IPMI_PASSWORD'])
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_ipmitool_failure(self, mock_run_shell):
-        mock_run_shell.return_value = 1
+    @mock.patch('tripleoclient.utils.run_command')
+    def test_ipmitool_failure(self, mock_run_command):
+        mock_run_command.return_value = (
+            1, 'Error: Unable to establish IPMI v2 / RMCP+ session\n')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -242,9 +258,57 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(1, self.cmd.error_count)
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_duplicated_baremetal_ip(self, mock_run_shell):
-        mock_run_shell.return_value = 0
+    @mock.patch('tripleoclient.utils.run_command')
+    def test_ipmitool_timeout(self, mock_run_command):
+        def run_command(args, timeout, env):
+            if args[6] == '192.168.122.2':
+                raise exceptions.Timeout()
+            return 0, ''
+        mock_run_command.side_effect = run_command
+        self.mock_instackenv_json({
+            "nodes": [{
+                "pm_user": "stack",
+                "pm_addr": "192.168.122.%d" % i,
+                "pm_password": "KEY%d" % i,
+                "pm_type": "pxe_ipmitool",
+                "mac": [
+                    "00:0b:d0:69:7e:5%d" % i
+                ],
+            } for i in range(1, 4)]
+        })
+
+        arglist = ['-f', self.instack_json.name, '--concurrency', '2',
+                   '--bmc-timeout', '5']
+        verifylist = [('concurrency', 2), ('bmc_timeout', 5)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd.take_action(parsed_args)
+
+        self.assertEqual(1, self.cmd.error_count)
+        self.assertEqual(3, mock_run_command.call_count)
+
+    @mock.patch('tripleoclient.utils.run_command')
+    def test_ipmitool_no_password(self, mock_run_command):
+        self.mock_instackenv_json({
+            "nodes": [{
+                "pm_user": "stack",
+                "pm_addr": "192.168.122.1",
+                "pm_type": "pxe_ipmitool",
+                "mac": [
+                    "00:0b:d0:69:7e:59"
+                ],
+            }]
+        })
+
+        arglist = ['-f', self.instack_json.name]
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+        self.cmd.take_action(parsed_args)
+
+        self.assertEqual(1, self.cmd.error_count)
+        self.assertFalse(mock_run_command.called)
+
+    @mock.patch('tripleoclient.utils.run_command')
+    def test_duplicated_baremetal_ip(self, mock_run_command):
+        mock_run_command.return_value = (0, '')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -719,6 +783,47 @@ class TestStartBaremetalIntrospectionBulk(fakes.TestBaremetal):
         self.assertEqual(['ABC', 'DEF', 'GHI'],
                          sorted(inspector_client.on_introspection))
 
+    def test_introspect_bulk_pipelined(self):
+        client = self.app.client_manager.baremetal
+        client.node = fakes.FakeBaremetalNodeClient(
+            states={"ABC": "available", "DEF": "manageable",
+                    "GHI": "manageable"},
+            transitions={
+                ("ABC", "manage"): "manageable",
+                ("ABC", "provide"): "available",
+                ("DEF", "provide"): "available",
+            }
+        )
+        inspector_client = self.app.client_manager.baremetal_introspection
+        inspector_client.states['ABC'] = {'finished': True, 'error': None}
+        inspector_client.states['DEF'] = {'finished': True, 'error': None}
+        inspector_client.states['GHI'] = {'finished': True,
+                                          'error': 'fake error'}
+
+        arglist = ['--concurrency', '2']
+        verifylist = [('concurrency', 2)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.assertRaisesRegexp(exceptions.IntrospectionError,
+                                'GHI: fake error',
+                                self.cmd.take_action, parsed_args)
+
+        # Each node is made available on its own; the failed one stays
+        # manageable.
+        self.assertEqual({'ABC': 'available', 'DEF': 'available',
+                          'GHI': 'manageable'}, client.node.states)
+        self.assertEqual(['ABC', 'DEF', 'GHI'],
+                         sorted(inspector_client.on_introspection))
+        self.assertEqual([('ABC', 'manage')], client.node.updates[:1])
+        self.assertEqual([('ABC', 'provide'), ('DEF', 'provide')],
+                         sorted(client.node.updates[1:]))
+
+    def test_introspect_bulk_invalid_concurrency(self):
+        for value in ('0', '-1', 'many'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(osc_test_utils.ParserException,
+                                  self.check_parser, self.cmd,
+                                  ['--concurrency', value], [])
+
     def test_introspect_bulk_timeout(self):
         client = self.app.client_manager.baremetal
         client.node = fakes.FakeBaremetalNodeClient(
@@ -826,6 +931,106 @@ class TestStatusBaremetalIntrospectionBulk(fakes.TestBaremetal):
             ]
         ))
 
+    def test_status_bulk_list_statuses(self):
+        client = self.app.client_manager.baremetal
+        client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH"),
+            mock.Mock(uuid="IJKLMNOP"),
+        ]
+        inspector_client = self.app.client_manager.baremetal_introspection
+        inspector_client.states['IJKLMNOP'] = {'finished': False,
+                                               'error': None}
+        inspector_client.list_statuses = mock.Mock(side_effect=[
+            [{'uuid': 'ABCDEFGH', 'finished': True, 'error': 'boom'}],
+            [],
+        ])
+
+        parsed_args = self.check_parser(self.cmd, [], [])
+        result = self.cmd.take_action(parsed_args)
+
+        self.assertEqual(result, (
+            ('Node UUID', 'Finished', 'Error'),
+            [('ABCDEFGH', True, 'boom'),
+             ('IJKLMNOP', False, None)]))
+        inspector_client.list_statuses.assert_has_calls([
+            mock.call(marker=None), mock.call(marker='ABCDEFGH')])
+
+    def test_status_bulk_list_statuses_unsupported(self):
+        client = self.app.client_manager.baremetal
+        client.node.list.return_value = [mock.Mock(uuid="ABCDEFGH")]
+        inspector_client = self.app.client_manager.baremetal_introspection
+        inspector_client.states['ABCDEFGH'] = {'finished': True,
+                                               'error': None}
+        inspector_client.list_statuses = mock.Mock(
+            side_effect=ironic_inspector_client.VersionNotSupported(
+                '1.8', '1.0'))
+
+        parsed_args = self.check_parser(self.cmd, [], [])
+        result = self.cmd.take_action(parsed_args)
+
+        self.assertEqual(result, (
+            ('Node UUID', 'Finished', 'Error'),
+            [('ABCDEFGH', True, None)]))
+
+    @mock.patch('time.sleep')
+    def test_status_bulk_watch(self, mock_sleep):
+        client = self.app.client_manager.baremetal
+        client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH"),
+            mock.Mock(uuid="IJKLMNOP"),
+        ]
+        inspector_client = self.app.client_manager.baremetal_introspection
+        finished = iter([False, True])
+        inspector_client.get_status = mock.Mock(
+            side_effect=lambda uuid: {
+                'finished': uuid == 'IJKLMNOP' or next(finished),
+                'error': None})
+
+        parsed_args = self.check_parser(self.cmd, ['--watch'],
+                                        [('watch', True)])
+        with mock.patch('six.moves.builtins.print') as mock_print:
+            result = self.cmd.take_action(parsed_args)
+
+        self.assertEqual(result, (
+            ('Node UUID', 'Finished', 'Error'),
+            [('ABCDEFGH', True, None),
+             ('IJKLMNOP', True, None)]))
+        mock_sleep.assert_called_once_with(self.cmd.watch_interval)
+        # Only the first refresh is printed, the last one is the table
+        self.assertEqual([mock.call('ABCDEFGH: finished=False, error=None'),
+                          mock.call('IJKLMNOP: finished=True, error=None')],
+                         mock_print.call_args_list)
+
+    @mock.patch('time.sleep')
+    def test_status_bulk_watch_changes(self, mock_sleep):
+        client = self.app.client_manager.baremetal
+        client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH"),
+            mock.Mock(uuid="IJKLMNOP"),
+        ]
+        inspector_client = self.app.client_manager.baremetal_introspection
+        statuses = {'ABCDEFGH': iter([False, False, True]),
+                    'IJKLMNOP': iter([False, True, True])}
+        inspector_client.get_status = mock.Mock(
+            side_effect=lambda uuid: {'finished': next(statuses[uuid]),
+                                      'error': None})
+
+        parsed_args = self.check_parser(self.cmd, ['--watch'],
+                                        [('watch', True)])
+        with mock.patch('six.moves.builtins.print') as mock_print:
+            result = self.cmd.take_action(parsed_args)
+
+        self.assertEqual(result, (
+            ('Node UUID', 'Finished', 'Error'),
+            [('ABCDEFGH', True, None),
+             ('IJKLMNOP', True, None)]))
+        self.assertEqual(2, mock_sleep.call_count)
+        # The second refresh only reports the node whose status changed
+        self.assertEqual([mock.call('ABCDEFGH: finished=False, error=None'),
+                          mock.call('IJKLMNOP: finished=False, error=None'),
+                          mock.call('IJKLMNOP: finished=True, error=None')],
+                         mock_print.call_args_list)
+
 
 class TestConfigureReadyState(fakes.TestBaremetal):
 
@@ -892,6 +1097,71 @@ class TestConfigureReadyState(fakes.TestBaremetal):
             mock.call(set([nodes[0]]))])
         mock_change_power_state.assert_called_once_with(drac_nodes, 'off')
 
+    def _drac_nodes(self, job_polls):
+        nodes = [
+            mock.Mock(uuid='foo', driver='pxe_drac',
+                      properties={'capabilities': 'profile:compute'}),
+            mock.Mock(uuid='bar', driver='pxe_drac',
+                      properties={'capabilities': 'profile:storage'}),
+            mock.Mock(uuid='baz', driver='pxe_drac',
+                      properties={'capabilities': 'profile:compute'}),
+            mock.Mock(uuid='qux', driver='pxe_ilo',
+                      properties={'capabilities': 'profile:compute'}),
+        ]
+        drac = fakes.FakeDracNodeClient(commit_required=['foo', 'bar'],
+                                        job_polls=job_polls)
+        drac.list = mock.Mock(return_value=nodes)
+        self.app.client_manager.baremetal.node = drac
+        return drac
+
+    def _take_action(self):
+        parsed_args = self.check_parser(self.cmd, ['ready-state.json'],
+                                        [('file', 'ready-state.json')])
+        with mock.patch('six.moves.builtins.open',
+                        mock.mock_open(read_data=self.ready_state_data)):
+            self.cmd.take_action(parsed_args)
+
+    @mock.patch('time.sleep')
+    def test_configure_ready_state_drac(self, mock_sleep):
+        drac = self._drac_nodes({'foo': 3, 'bar': 3})
+
+        self._take_action()
+
+        self.assertEqual({'foo': {'ProcVirtualization': 'Enabled'},
+                          'bar': {'ProcVirtualization': 'Disabled'},
+                          'baz': {'ProcVirtualization': 'Enabled'}},
+                         drac.bios_settings)
+        self.assertEqual(['bar', 'foo'], sorted(
+            uuid for uuid, call in drac.calls if call == 'reboot'))
+        self.assertEqual({'foo': 'off', 'bar': 'off', 'baz': 'off'},
+                         drac.power_states)
+        self.assertEqual([], [uuid for uuid, call in drac.calls
+                              if uuid == 'baz' and
+                              call == 'list_unfinished_jobs'])
+        # the jobs of both nodes are waited for at the same time: one sleep
+        # after committing the BIOS config, then one per polling round
+        self.assertEqual(4, mock_sleep.call_count)
+        self.assertEqual({'foo': 'power off requested',
+                          'bar': 'power off requested',
+                          'baz': 'power off requested'},
+                         dict(self.cmd._progress))
+
+    @mock.patch('time.sleep')
+    @mock.patch.object(baremetal.ConfigureReadyState, 'loops',
+                       new_callable=mock.PropertyMock,
+                       return_value=3)
+    def test_configure_ready_state_drac_timeout(self, mock_loops,
+                                                mock_sleep):
+        drac = self._drac_nodes({'bar': 5})
+
+        self.assertRaisesRegexp(exceptions.Timeout, 'on nodes bar$',
+                                self._take_action)
+
+        self.assertEqual('config jobs finished', self.cmd._progress['foo'])
+        self.assertEqual('timed out', self.cmd._progress['bar'])
+        self.assertEqual({'foo': 'reboot', 'bar': 'reboot'},
+                         drac.power_states)
+
     @mock.patch.object(baremetal.ConfigureReadyState, 'sleep_time',
                        new_callable=mock.PropertyMock,
                        return_value=0)
@@ -985,11 +1255,6 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
         bm_client = self.app.client_manager.baremetal
         bm_client.node.list.return_value = [
-            mock.Mock(uuid="ABCDEFGH"),
-            mock.Mock(uuid="IJKLMNOP"),
-        ]
-
-        bm_client.node.get.side_effect = [
             mock.Mock(uuid="ABCDEFGH", properties={}),
             mock.Mock(uuid="IJKLMNOP", properties={}),
         ]
@@ -1002,9 +1267,11 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
             mock.call(mock.ANY, 'bm-deploy-kernel'),
             mock.call(mock.ANY, 'bm-deploy-ramdisk')
         ])
+        # the listed nodes are used as they are
+        self.assertFalse(bm_client.node.get.called)
 
         self.assertEqual(bm_client.node.update.call_count, 2)
-        self.assertEqual(bm_client.node.update.mock_calls, [
+        bm_client.node.update.assert_has_calls([
             mock.call('ABCDEFGH', [{
                 'op': 'add', 'value': 'boot_option:local',
                 'path': '/properties/capabilities'
@@ -1025,7 +1292,7 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
                 'op': 'add', 'value': 'IDIDID',
                 'path': '/driver_info/deploy_kernel'
             }])
-        ])
+        ], any_order=True)
 
     @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
     def test_configure_boot_with_suffix(self, find_resource_mock):
@@ -1033,11 +1300,6 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
         bm_client = self.app.client_manager.baremetal
         bm_client.node.list.return_value = [
-            mock.Mock(uuid="ABCDEFGH"),
-            mock.Mock(uuid="IJKLMNOP"),
-        ]
-
-        bm_client.node.get.side_effect = [
             mock.Mock(uuid="ABCDEFGH", properties={}),
             mock.Mock(uuid="IJKLMNOP", properties={}),
         ]
@@ -1057,7 +1319,7 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
         ])
 
         self.assertEqual(bm_client.node.update.call_count, 2)
-        self.assertEqual(bm_client.node.update.mock_calls, [
+        bm_client.node.update.assert_has_calls([
             mock.call('ABCDEFGH', [{
                 'op': 'add', 'value': 'boot_option:local',
                 'path': '/properties/capabilities'
@@ -1078,7 +1340,7 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
                 'op': 'add', 'value': 'IDIDID',
                 'path': '/driver_info/deploy_kernel'
             }])
-        ])
+        ], any_order=True)
 
     @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
     @mock.patch.object(baremetal.ConfigureBaremetalBoot, 'sleep_time',
@@ -1130,22 +1392,70 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
                           parsed_args)
 
     @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
-    def test_configure_boot_skip_maintenance(self, find_resource_mock):
+    @mock.patch.object(baremetal.ConfigureBaremetalBoot, 'sleep_time',
+                       new_callable=mock.PropertyMock,
+                       return_value=0)
+    def test_configure_boot_timeout_other_nodes(self, _, find_resource_mock):
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
 
+        bm_client = self.app.client_manager.baremetal
+        bm_client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH", power_state=None),
+            mock.Mock(uuid="IJKLMNOP", power_state='power on',
+                      properties={}),
+        ]
+        bm_client.node.get.return_value = mock.Mock(uuid="ABCDEFGH",
+                                                    power_state=None)
+        parsed_args = self.check_parser(self.cmd, [], [])
+        self.assertRaisesRegexp(exceptions.Timeout, 'ABCDEFGH',
+                                self.cmd.take_action, parsed_args)
+
+        # the node in transition did not keep the other one from being
+        # configured, and only the former was fetched again
+        bm_client.node.update.assert_called_once_with('IJKLMNOP', mock.ANY)
+        self.assertEqual({'ABCDEFGH'},
+                         set(c[0][0] for c in
+                             bm_client.node.get.call_args_list))
+
+    @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
+    def test_configure_boot_failure_other_nodes(self, find_resource_mock):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
+
         bm_client = self.app.client_manager.baremetal
         bm_client.node.list.return_value = [
-            mock.Mock(uuid="ABCDEFGH", maintenance=False),
+            mock.Mock(uuid="ABCDEFGH", properties={}),
+            mock.Mock(uuid="IJKLMNOP", properties={}),
+            mock.Mock(uuid="QRSTUVWX", properties={}),
         ]
 
-        bm_client.node.get.return_value = mock.Mock(uuid="ABCDEFGH",
-                                                    maintenance=False,
-                                                    properties={})
+        def update(uuid, patch):
+            if uuid == 'IJKLMNOP':
+                raise RuntimeError('BMC unreachable')
+        bm_client.node.update.side_effect = update
+
+        parsed_args = self.check_parser(self.cmd, ['--concurrency', '2'],
+                                        [('concurrency', 2)])
+        self.assertRaisesRegexp(RuntimeError, 'BMC unreachable',
+                                self.cmd.take_action, parsed_args)
+
+        self.assertEqual(['ABCDEFGH', 'IJKLMNOP', 'QRSTUVWX'],
+                         sorted(c[0][0] for c in
+                                bm_client.node.update.call_args_list))
+
+    @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
+    def test_configure_boot_skip_maintenance(self, find_resource_mock):
+
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
+        bm_client = self.app.client_manager.baremetal
+        bm_client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH", maintenance=False, properties={}),
+        ]
 
         parsed_args = self.check_parser(self.cmd, [], [])
         self.cmd.take_action(parsed_args)
 
         self.assertEqual(bm_client.node.list.mock_calls, [mock.call(
+            fields=['uuid', 'power_state', 'properties'],
             maintenance=False)])
 
     @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
@@ -1154,13 +1464,6 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
         bm_client = self.app.client_manager.baremetal
         bm_client.node.list.return_value = [
-            mock.Mock(uuid="ABCDEFGH"),
-            mock.Mock(uuid="IJKLMNOP"),
-            mock.Mock(uuid="QRSTUVWX"),
-            mock.Mock(uuid="YZABCDEF"),
-        ]
-
-        bm_client.node.get.side_effect = [
             mock.Mock(uuid="ABCDEFGH", properties={
                 'capabilities': 'existing:cap'
             }),
@@ -1179,7 +1482,7 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
         self.assertEqual(find_resource_mock.call_count, 2)
 
         self.assertEqual(bm_client.node.update.call_count, 4)
-        self.assertEqual(bm_client.node.update.mock_calls, [
+        bm_client.node.update.assert_has_calls([
             mock.call('ABCDEFGH', [{
                 'op': 'add', 'value': 'boot_option:local,existing:cap',
                 'path': '/properties/capabilities'
@@ -1220,7 +1523,7 @@ class TestConfigureBaremetalBoot(fakes.TestBaremetal):
                 'op': 'add', 'value': 'IDIDID',
                 'path': '/driver_info/deploy_kernel'
             }]),
-        ])
+        ], any_order=True)
 
 
 @mock.patch('openstackclient.common.utils.find_resource', autospec=True)
@@ -1243,18 +1546,19 @@ class TestConfigureBaremetalBootRootDeviceDetection(fakes.TestBaremetal):
             disk['wwn'] = 'wwn%d' % i
             disk['serial'] = 'serial%d' % i
 
+        self.useFixture(fixtures.TempHomeDir())
         self.inspector_client = self.app.client_manager.baremetal_introspection
+        self.inspector_client.states['ABCDEFGH'] = {
+            'finished': True, 'error': None,
+            'finished_at': '2016-02-01T10:00:00'
+        }
         self.inspector_client.data['ABCDEFGH'] = {
             'inventory': {'disks': self.disks}
         }
 
         self.bm_client = self.app.client_manager.baremetal
-        self.bm_client.node.list.return_value = [
-            mock.Mock(uuid="ABCDEFGH"),
-        ]
-
         self.node = mock.Mock(uuid="ABCDEFGH", properties={})
-        self.bm_client.node.get.return_value = self.node
+        self.bm_client.node.list.return_value = [self.node]
 
     def test_smallest(self, find_resource_mock):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
@@ -1422,6 +1726,80 @@ class TestConfigureBaremetalBootRootDeviceDetection(fakes.TestBaremetal):
         self.assertEqual(mock.call('ABCDEFGH', expected_patch),
                          root_device_args)
 
+    def test_cached_data(self, find_resource_mock):
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
+        arglist = ['--root-device', 'smallest']
+        verifylist = [('root_device', 'smallest')]
+
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd.take_action(parsed_args)
+
+        with mock.patch.object(self.inspector_client, 'get_data') as get_data:
+            self.cmd.take_action(parsed_args)
+            self.assertFalse(get_data.called)
+
+        self.inspector_client.states['ABCDEFGH']['finished_at'] = (
+            '2016-02-02T10:00:00')
+        self.inspector_client.data['ABCDEFGH'] = {
+            'inventory': {'disks': self.disks[:1]}
+        }
+        self.bm_client.node.update.reset_mock()
+        self.cmd.take_action(parsed_args)
+
+        root_device_args = self.bm_client.node.update.call_args_list[1]
+        self.assertEqual({'wwn': 'wwn0'}, root_device_args[0][1][0]['value'])
+
+    def test_prefetched_statuses(self, find_resource_mock):
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
+        status = dict(self.inspector_client.states['ABCDEFGH'],
+                      uuid='ABCDEFGH')
+        self.inspector_client.list_statuses = mock.Mock(
+            side_effect=[[status], []])
+
+        arglist = ['--root-device', 'smallest']
+        verifylist = [('root_device', 'smallest')]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        with mock.patch.object(self.inspector_client, 'get_status',
+                               autospec=True) as get_status:
+            self.cmd.take_action(parsed_args)
+            self.assertFalse(get_status.called)
+
+        self.assertEqual(self.bm_client.node.update.call_count, 2)
+
+    def test_no_introspection_cache(self, find_resource_mock):
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
+        arglist = ['--root-device', 'smallest', '--no-introspection-cache']
+        verifylist = [('root_device', 'smallest'),
+                      ('no_introspection_cache', True)]
+
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd.take_action(parsed_args)
+
+        self.assertEqual(self.bm_client.node.update.call_count, 2)
+        self.assertFalse(os.path.exists(os.path.expanduser(
+            '~/.cache/tripleoclient/introspection')))
+
+    def test_offline(self, find_resource_mock):
+        find_resource_mock.return_value = mock.Mock(id="IDIDID")
+        arglist = ['--root-device', 'smallest',
+                   '--offline-introspection-data']
+        verifylist = [('root_device', 'smallest'),
+                      ('offline_introspection_data', True)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.assertRaisesRegexp(exceptions.RootDeviceDetectionError,
+                                "No introspection data",
+                                self.cmd.take_action, parsed_args)
+
+        self.cmd.take_action(self.check_parser(
+            self.cmd, ['--root-device', 'smallest'], []))
+        self.bm_client.node.update.reset_mock()
+        self.app.client_manager.baremetal_introspection = mock.Mock(
+            spec=[])
+        self.cmd.take_action(parsed_args)
+
+        self.assertEqual(self.bm_client.node.update.call_count, 2)
+
     def test_device_list_not_found(self, find_resource_mock):
         find_resource_mock.return_value = mock.Mock(id="IDIDID")
 
@@ -1449,13 +1827,12 @@ class TestShowNodeCapabilities(fakes.TestBaremetal):
         bm_client = self.app.client_manager.baremetal
 
         bm_client.node.list.return_value = [
-            mock.Mock(uuid='UUID1'),
-            mock.Mock(uuid='UUID2'),
+            mock.Mock(uuid='UUID1',
+                      properties={'capabilities': 'boot_option:local'}),
+            mock.Mock(uuid='UUID2',
+                      properties={'capabilities': 'boot_option:local'}),
         ]
 
-        bm_client.node.get.return_value = mock.Mock(
-            properties={'capabilities': 'boot_option:local'})
-
         arglist = []
         parsed_args = self.check_parser(self.cmd, arglist, [])
         result = self.cmd.take_action(parsed_args)
@@ -1464,3 +1841,6 @@ class TestShowNodeCapabilities(fakes.TestBaremetal):
             ('Node UUID', 'Node Capabilities'),
             [('UUID1', 'boot_option:local'), ('UUID2', 'boot_option:local')]
         ), result)
+        bm_client.node.list.assert_called_once_with(
+            fields=['uuid', 'properties'])
+        self.assertFalse(bm_client.node.get.called)
@@ -377,10 +377,13 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
             constants.OVERCLOUD_YAML_NAMES[0])
 
         mock_create_tempest_deployer_input.assert_called_with()
-        mock_process_multiple_env.assert_called_with(
-            ['/usr/share/openstack-tripleo-heat-templates/overcloud-resource-'
-             'registry-puppet.yaml', '/fake/path',
-             self.parameter_defaults_env_file])
+        # environments are processed, and cached, one by one
+        self.assertEqual(
+            [mock.call(['/usr/share/openstack-tripleo-heat-templates/'
+                        'overcloud-resource-registry-puppet.yaml']),
+             mock.call(['/fake/path']),
+             mock.call([self.parameter_defaults_env_file])],
+            mock_process_multiple_env.call_args_list)
 
         mock_validate_args.assert_called_once_with(parsed_args)
 
@@ -510,6 +513,75 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                           parsed_args)
         self.assertFalse(mock_deploy_tht.called)
 
+    @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
+                autospec=True)
+    @mock.patch('tripleoclient.utils.create_overcloudrc', autospec=True)
+    @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
+    @mock.patch('tripleoclient.utils.check_nodes_count', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_postconfig', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_update_parameters', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_heat_deploy', autospec=True)
+    def test_timing_report(self, mock_deploy_heat,
+                           mock_update_parameters, mock_post_config,
+                           mock_utils_check_nodes, mock_utils_endpoint,
+                           mock_utils_createrc, mock_utils_tempest):
+
+        mock_update_parameters.return_value = {}
+        mock_utils_endpoint.return_value = 'foo.bar'
+
+        class FakeSession(object):
+            requests = []
+
+            def request(self, url, method, **kwargs):
+                self.requests.append((method, url))
+
+        session = self.app.client_manager.session = FakeSession()
+
+        def _fake_heat_deploy(self, stack, stack_name, template_path,
+                              parameters, environments, timeout):
+            session.request('/stacks', 'POST', endpoint_filter={
+                'service_type': 'orchestration'})
+
+        mock_deploy_heat.side_effect = _fake_heat_deploy
+
+        profile = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                               'deploy.prof')
+        arglist = ['--templates', '--timing-report', 'json',
+                   '--profile', profile]
+        verifylist = [
+            ('templates', '/usr/share/openstack-tripleo-heat-templates/'),
+            ('timing_report', 'json'),
+            ('profile', profile),
+        ]
+
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        earlier_load = ('earlier.yaml', 0.5, False)
+        answers_load = ('answers.yaml', 0.25, False)
+        with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+            with mock.patch('tripleoclient.yaml_utils.load_timings',
+                            side_effect=[[earlier_load],
+                                         [earlier_load, answers_load]]):
+                self.cmd.take_action(parsed_args)
+
+        output = stdout.getvalue()
+        report = json.loads(output[output.index('\n{') + 1:])
+        # files loaded before the deployment started are not reported
+        self.assertEqual([{'path': 'answers.yaml', 'seconds': 0.25,
+                           'cached': False}], report['yaml_files'])
+        self.assertEqual(
+            ['argument validation', 'parameter generation',
+             'pre-deploy verification', 'environment files',
+             'overcloudrc generation'],
+            [phase['name'] for phase in report['phases']])
+        self.assertEqual({'orchestration': 1}, report['api_calls'])
+        self.assertTrue(os.path.isfile(profile))
+        self.assertEqual([('POST', '/stacks')], session.requests)
+        # the session is left as it was found
+        self.assertNotIn('request', vars(session))
+
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_overcloudrc', autospec=True)
@@ -712,15 +784,16 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
 
         self.cmd.take_action(parsed_args)
 
-        args, kwargs = mock_process_multiple_env.call_args
+        env_paths = [args[0][0] for args, kwargs in
+                     mock_process_multiple_env.call_args_list]
         self.assertIn(
             '/usr/share/openstack-tripleo-heat-templates/extraconfig/pre_dep'
             'loy/rhel-registration/rhel-registration-resource-registry.yaml',
-            args[0])
+            env_paths)
         self.assertIn(
             '/usr/share/openstack-tripleo-heat-templates/extraconfig/pre_dep'
             'loy/rhel-registration/environment-rhel-registration.yaml',
-            args[0])
+            env_paths)
 
     def test_validate_args_correct(self):
         arglist = ['--templates',
@@ -850,23 +923,22 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
             '/fake/path/' + constants.OVERCLOUD_YAML_NAMES[0], {},
             ['~/overcloud-env.json'], 1)
 
+    @mock.patch('os.path.isfile')
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_heat_deploy')
     def test_try_overcloud_deploy_w_only_second_template_existing(
-            self, mock_heat_deploy_func):
-        mock_heat_deploy_func.side_effect = [
-            six.moves.urllib.error.URLError('error'), None]
+            self, mock_heat_deploy_func, mock_isfile):
+        mock_isfile.side_effect = lambda path: path.endswith(
+            constants.OVERCLOUD_YAML_NAMES[1])
         result = self.cmd._try_overcloud_deploy_with_compat_yaml(
             '/fake/path', {}, 'overcloud', {}, ['~/overcloud-env.json'], 1)
         # If it returns None it succeeded
         self.assertIsNone(result)
-        mock_heat_deploy_func.assert_has_calls(
-            [mock.call({}, 'overcloud',
-                       '/fake/path/' + constants.OVERCLOUD_YAML_NAMES[0], {},
-                       ['~/overcloud-env.json'], 1),
-             mock.call({}, 'overcloud',
-                       '/fake/path/' + constants.OVERCLOUD_YAML_NAMES[1], {},
-                       ['~/overcloud-env.json'], 1)])
+        # the environments are only processed for the existing template
+        mock_heat_deploy_func.assert_called_once_with(
+            {}, 'overcloud',
+            '/fake/path/' + constants.OVERCLOUD_YAML_NAMES[1], {},
+            ['~/overcloud-env.json'], 1)
 
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_heat_deploy', autospec=True)
@@ -1061,9 +1133,20 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         parsed_args = mock.Mock()
         mock_assign_and_verify_profiles.return_value = (0, 0)
         mock_check_nodes_count.return_value = (True, 0, 0)
+        bm_client = self.app.client_manager.baremetal
+        bm_client.node.list.return_value = []
 
         # A None return value here indicates an error
         mock_check_hypervisor_stats.return_value = None
         self.cmd._predeploy_verify_capabilities(
             stack, parameters, parsed_args)
         self.assertEqual(1, self.cmd.predeploy_errors)
+
+        # ironic nodes are listed once and shared by all the checks
+        bm_client.node.list.assert_called_once_with(detail=True, limit=0)
+        inventory = mock_check_ironic_boot_configuration.call_args[0][1]
+        self.assertEqual(
+            inventory,
+            mock_assign_and_verify_profiles.call_args[1]['inventory'])
+        self.assertEqual(inventory,
+                         mock_check_nodes_count.call_args[1]['inventory'])
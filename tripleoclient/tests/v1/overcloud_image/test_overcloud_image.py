@@ -13,11 +13,17 @@
 #   under the License.
 #
 
+import fixtures
 import mock
 import os
+import shutil
+import six
+import subprocess
+import tempfile
 
 from openstackclient.common import exceptions
 from tripleoclient.tests.v1.test_plugin import TestPluginV1
+from tripleoclient import utils as plugin_utils
 from tripleoclient.v1 import overcloud_image
 
 
@@ -54,45 +60,118 @@ class TestOvercloudImageBuild(TestPluginV1):
         self.assertEqual(2, self.mock_disk_image_create.call_count)
 
     @mock.patch('platform.linux_distribution')
-    @mock.patch('subprocess.call', autospec=True)
+    @mock.patch('shutil.copy2', autospec=True)
+    @mock.patch('os.path.isdir', autospec=True)
     @mock.patch('os.path.isfile', autospec=True)
     @mock.patch('os.chmod')
-    @mock.patch('requests.get', autospec=True)
+    @mock.patch('tripleoclient.utils.download_file', autospec=True)
     def test_overcloud_image_build_fedora_user_no_cache(
             self,
-            mock_requests_get,
+            mock_download_file,
             mock_os_chmod,
             mock_os_path_isfile,
-            mock_subprocess_call,
+            mock_os_path_isdir,
+            mock_copy2,
             mock_linux_distribution):
         arglist = ['--type', 'fedora-user']
         verifylist = [('image_types', ['fedora-user'])]
+        cached_image = os.path.expanduser(
+            '~/.cache/image-create/fedora-21.x86_64.qcow2')
 
         def os_path_isfile_side_effect(arg):
             return {
                 'fedora-user.qcow2': False,
-                '~/.cache/image-create/fedora-21.x86_64.qcow2': False,
+                cached_image: False,
             }[arg]
 
         mock_os_path_isfile.side_effect = os_path_isfile_side_effect
-        requests_get_response = mock.Mock(spec="content")
-        requests_get_response.content = "FEDORAIMAGE".encode('utf-8')
-        mock_requests_get.return_value = requests_get_response
+        mock_os_path_isdir.return_value = True
 
         parsed_args = self.check_parser(self.cmd, arglist, verifylist)
-        mock_open_context = mock.mock_open()
         mock_linux_distribution.return_value = [
             'Red Hat Enterprise Linux Server 7.1']
 
-        with mock.patch('six.moves.builtins.open', mock_open_context):
-            self.cmd.take_action(parsed_args)
+        self.cmd.take_action(parsed_args)
 
-        mock_requests_get.assert_called_once_with(
-            'http://cloud.fedoraproject.org/fedora-21.x86_64.qcow2')
+        mock_download_file.assert_called_once_with(
+            'http://cloud.fedoraproject.org/fedora-21.x86_64.qcow2',
+            cached_image, checksum=None)
+        mock_copy2.assert_called_once_with(cached_image, 'fedora-user.qcow2')
         self.assertEqual(2, mock_os_path_isfile.call_count)
         self.assertEqual(1, mock_os_chmod.call_count)
-        mock_open_context.assert_has_calls(
-            [mock.call('fedora-user.qcow2', 'wb')])
+
+    @mock.patch('platform.linux_distribution')
+    @mock.patch('shutil.copy2', autospec=True)
+    @mock.patch('os.path.isfile', autospec=True)
+    @mock.patch('os.chmod')
+    @mock.patch('tripleoclient.utils.download_file', autospec=True)
+    def test_overcloud_image_build_fedora_user_cached(
+            self,
+            mock_download_file,
+            mock_os_chmod,
+            mock_os_path_isfile,
+            mock_copy2,
+            mock_linux_distribution):
+        arglist = ['--type', 'fedora-user']
+        cached_image = os.path.expanduser(
+            '~/.cache/image-create/fedora-21.x86_64.qcow2')
+
+        mock_os_path_isfile.side_effect = lambda arg: arg == cached_image
+
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+        mock_linux_distribution.return_value = [
+            'Red Hat Enterprise Linux Server 7.1']
+
+        self.cmd.take_action(parsed_args)
+
+        self.assertFalse(mock_download_file.called)
+        mock_copy2.assert_called_once_with(cached_image, 'fedora-user.qcow2')
+
+    @mock.patch('platform.linux_distribution')
+    @mock.patch('shutil.copy2', autospec=True)
+    @mock.patch('os.path.isdir', autospec=True)
+    @mock.patch('os.path.isfile', autospec=True)
+    @mock.patch('os.unlink')
+    @mock.patch('os.chmod')
+    @mock.patch('tripleoclient.utils.file_digests', autospec=True)
+    @mock.patch('tripleoclient.utils.download_file', autospec=True)
+    def test_overcloud_image_build_fedora_user_cached_bad_checksum(
+            self,
+            mock_download_file,
+            mock_file_digests,
+            mock_os_chmod,
+            mock_os_unlink,
+            mock_os_path_isfile,
+            mock_os_path_isdir,
+            mock_copy2,
+            mock_linux_distribution):
+        arglist = ['--type', 'fedora-user',
+                   '--fedora-user-checksum', 'ABCD']
+        cached_image = os.path.expanduser(
+            '~/.cache/image-create/fedora-21.x86_64.qcow2')
+        cached = [True]
+
+        def os_unlink_side_effect(arg):
+            cached[0] = False
+        mock_os_unlink.side_effect = os_unlink_side_effect
+        mock_os_path_isfile.side_effect = lambda arg: (
+            arg == cached_image and cached[0])
+        mock_os_path_isdir.return_value = True
+        mock_file_digests.return_value = {'sha256': 'dcba'}
+
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+        mock_linux_distribution.return_value = [
+            'Red Hat Enterprise Linux Server 7.1']
+
+        self.cmd.take_action(parsed_args)
+
+        # the cached image is not trusted and downloaded again
+        mock_file_digests.assert_called_once_with(cached_image, ('sha256',))
+        mock_os_unlink.assert_called_once_with(cached_image)
+        mock_download_file.assert_called_once_with(
+            'http://cloud.fedoraproject.org/fedora-21.x86_64.qcow2',
+            cached_image, checksum='ABCD')
+        mock_copy2.assert_called_once_with(cached_image, 'fedora-user.qcow2')
 
     @mock.patch('platform.linux_distribution')
     @mock.patch('os.path.isfile', autospec=True)
@@ -245,6 +324,171 @@ class TestOvercloudImageBuild(TestPluginV1):
             "-p python-hardware-detect --min-tmpfs 5 "
             "2>&1 | tee dib-agent-ramdisk.log")
 
+    @mock.patch('platform.linux_distribution')
+    def test_overcloud_image_build_parallel(self, mock_linux_distribution):
+        # run the real builder against a stub disk-image-create
+        self.cmd._create_builder = lambda dummy: (
+            overcloud_image.DibImageBuilder())
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        stub = os.path.join(tmpdir, 'disk-image-create')
+        with open(stub, 'w') as f:
+            f.write('#!/bin/sh\necho "building $*"\n')
+        os.chmod(stub, 0o755)
+        self.useFixture(fixtures.EnvironmentVariable(
+            'PATH', tmpdir + os.pathsep + os.environ['PATH']))
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        self.addCleanup(os.chdir, cwd)
+
+        arglist = ['--all', '--max-parallel-builds', '2']
+        verifylist = [('all', True), ('max_parallel_builds', 2)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        mock_linux_distribution.return_value = ['CentOS Fake Release']
+
+        with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+            self.cmd.take_action(parsed_args)
+
+        output = stdout.getvalue()
+        self.assertIn('[agent-ramdisk] building -a amd64 -o '
+                      'ironic-python-agent', output)
+        self.assertIn('[overcloud-full] building -a amd64 -o '
+                      'overcloud-full.qcow2', output)
+        self.assertEqual(2, output.count('built'))
+        for log in ('dib-agent-ramdisk.log', 'dib-overcloud-full.log'):
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, log)))
+
+    @mock.patch('platform.linux_distribution')
+    def test_overcloud_image_build_cache(self, mock_linux_distribution):
+        self.useFixture(fixtures.TempHomeDir())
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        elements = os.path.join(tmpdir, 'elements')
+        os.makedirs(os.path.join(elements, 'ironic-agent'))
+        element_file = os.path.join(elements, 'ironic-agent', 'install')
+        with open(element_file, 'w') as f:
+            f.write('v1')
+        self.useFixture(fixtures.EnvironmentVariable('ELEMENTS_PATH',
+                                                     elements))
+        self.useFixture(fixtures.MonkeyPatch(
+            'tripleoclient.v1.overcloud_image.BuildOvercloudImage.'
+            'BUILD_CACHE_DIR', os.path.join(tmpdir, 'cache')))
+        workdir = os.path.join(tmpdir, 'work')
+        os.makedirs(workdir)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        self.addCleanup(os.chdir, cwd)
+        mock_linux_distribution.return_value = ['CentOS Fake Release']
+
+        def create(args):
+            for ext in ('initramfs', 'kernel'):
+                with open('ironic-python-agent.%s' % ext, 'w') as f:
+                    f.write(ext)
+        mock_create = mock.Mock(side_effect=create)
+
+        def _builder(dummy):
+            builder = overcloud_image.DibImageBuilder()
+            builder._disk_image_create = mock_create
+            return builder
+        self.cmd._create_builder = _builder
+
+        def build(*extra_args):
+            mock_create.reset_mock()
+            parsed_args = self.check_parser(
+                self.cmd, ['--type', 'agent-ramdisk'] + list(extra_args), [])
+            with mock.patch('sys.stdout', new_callable=six.StringIO):
+                self.cmd.take_action(parsed_args)
+            return mock_create.call_count
+
+        # the first build creates the files, which are cached
+        self.assertEqual(1, build())
+        self.assertEqual(1, len(os.listdir(os.path.join(tmpdir, 'cache'))))
+
+        # nothing changed
+        self.assertEqual(0, build())
+
+        # missing files are restored from the cache
+        os.unlink('ironic-python-agent.kernel')
+        self.assertEqual(0, build())
+        with open('ironic-python-agent.kernel') as f:
+            self.assertEqual('kernel', f.read())
+
+        # files changed in place are left alone unless asked for
+        with open('ironic-python-agent.kernel', 'w') as f:
+            f.write('customised')
+        self.assertEqual(0, build())
+        with open('ironic-python-agent.kernel') as f:
+            self.assertEqual('customised', f.read())
+        self.assertEqual(0, build('--replace-stale-images'))
+        with open('ironic-python-agent.kernel') as f:
+            self.assertEqual('kernel', f.read())
+
+        # a cached build missing files is rebuilt
+        os.unlink('ironic-python-agent.kernel')
+        cache_key = os.listdir(os.path.join(tmpdir, 'cache'))[0]
+        os.unlink(os.path.join(tmpdir, 'cache', cache_key,
+                               'ironic-python-agent.kernel'))
+        self.assertEqual(1, build())
+        self.assertEqual(0, build())
+
+        # changed elements make the existing files stale, they are only
+        # rebuilt when asked for
+        with open(element_file, 'w') as f:
+            f.write('v2')
+        self.assertEqual(0, build())
+        self.assertEqual(1, build('--replace-stale-images'))
+        self.assertEqual(2, len(os.listdir(os.path.join(tmpdir, 'cache'))))
+
+        # so do inherited DIB_* variables and the files they point to
+        local_image = os.path.join(tmpdir, 'local.qcow2')
+        with open(local_image, 'w') as f:
+            f.write('base v1')
+        self.useFixture(fixtures.EnvironmentVariable('DIB_LOCAL_IMAGE',
+                                                     local_image))
+        # one checksum cache is shared by the builds of a run
+        with mock.patch('tripleoclient.utils.ChecksumCache',
+                        wraps=plugin_utils.ChecksumCache) as mock_cache:
+            self.assertEqual(1, build('--replace-stale-images'))
+        mock_cache.assert_called_once_with()
+        self.assertEqual(0, build('--replace-stale-images'))
+        with open(local_image, 'w') as f:
+            f.write('base v2')
+        os.utime(local_image, (1, 1))
+        self.assertEqual(1, build('--replace-stale-images'))
+
+    def test_max_parallel_builds_invalid(self):
+        for value in ('0', '-2'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, self.check_parser, self.cmd,
+                                  ['--all', '--max-parallel-builds', value],
+                                  [])
+
+    def test_run_builds_failure(self):
+        parsed_args = mock.Mock(max_parallel_builds=2)
+        build_ok = mock.Mock()
+        build_fail = mock.Mock(
+            side_effect=subprocess.CalledProcessError(1, 'disk-image-create'))
+
+        with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+            self.assertRaises(subprocess.CalledProcessError,
+                              self.cmd._run_builds, parsed_args,
+                              [('agent-ramdisk', build_fail),
+                               ('overcloud-full', build_ok)])
+
+        build_ok.assert_called_once_with(parsed_args)
+        self.assertIn('failed', stdout.getvalue())
+
+    def test_build_concurrency(self):
+        parsed_args = mock.Mock(max_parallel_builds=None)
+        with mock.patch('multiprocessing.cpu_count', return_value=16):
+            with mock.patch.object(overcloud_image, '_available_memory_gib',
+                                   return_value=12):
+                # limited by the memory for two 5 GiB tmpfs
+                self.assertEqual(2, self.cmd._build_concurrency(
+                    parsed_args, 4))
+            with mock.patch.object(overcloud_image, '_available_memory_gib',
+                                   return_value=None):
+                self.assertEqual(3, self.cmd._build_concurrency(
+                    parsed_args, 3))
+
     @mock.patch('platform.linux_distribution')
     def test_unsupported_distro(self, mock_linux_distribution):
         mock_linux_distribution.return_value = [
@@ -310,6 +554,46 @@ class TestUploadOvercloudImage(TestPluginV1):
             update_mock.call_count
         )
 
+    def test_upload_image_checksum(self):
+        image = self.app.client_manager.image.images.create.return_value
+        image.checksum = 'acbd18db4cc2f85cedef654fccc4a4d8'
+
+        def create(**kwargs):
+            self.assertEqual(b'foo', kwargs['data'].read())
+            return image
+        self.app.client_manager.image.images.create.side_effect = create
+
+        self.cmd._upload_image(name='name', data=six.BytesIO(b'foo'))
+        self.assertFalse(self.app.client_manager.image.images.delete.called)
+
+        image.checksum = 'bad'
+        self.assertRaisesRegexp(exceptions.CommandError,
+                                'does not match the local file',
+                                self.cmd._upload_image,
+                                name='name', data=six.BytesIO(b'foo'))
+        self.app.client_manager.image.images.delete.assert_called_once_with(
+            image.id)
+
+    @mock.patch('subprocess.check_call', autospec=True)
+    def test_copy_file_writable(self, mock_subprocess_call):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, 'src')
+        dest = os.path.join(tmpdir, 'dest')
+        with open(src, 'wb') as f:
+            f.write(b'foo')
+        self.cmd._checksum_cache = mock.Mock()
+        self.cmd._checksum_cache.get.return_value = 'checksum'
+
+        self.cmd._copy_file(src, dest)
+
+        self.assertFalse(mock_subprocess_call.called)
+        with open(dest, 'rb') as f:
+            self.assertEqual(b'foo', f.read())
+        self.cmd._checksum_cache.get.assert_called_once_with(src)
+        self.cmd._checksum_cache.set.assert_called_once_with(
+            dest, 'checksum', mock.ANY)
+
     def test_file_try_update_need_update(self):
         os.path.isfile = mock.Mock(return_value=True)
         self.cmd._files_changed = mock.Mock(return_value=True)
@@ -371,16 +655,29 @@ class TestUploadOvercloudImage(TestPluginV1):
                        name='bm-deploy-ramdisk',
                        disk_format='ari',
                        is_public=True)
-             ], self.app.client_manager.image.images.create.call_args_list
+             ], sorted(self.app.client_manager.image.images.create
+                       .call_args_list,
+                       key=lambda call: ['overcloud-full-vmlinuz',
+                                         'overcloud-full-initrd',
+                                         'overcloud-full',
+                                         'bm-deploy-kernel',
+                                         'bm-deploy-ramdisk'].index(
+                           call[1]['name']))
         )
 
-        self.assertEqual(mock_subprocess_call.call_count, 2)
+        self.assertEqual(mock_subprocess_call.call_count, 4)
         self.assertEqual(
             mock_subprocess_call.call_args_list, [
-                mock.call('sudo cp -f "./ironic-python-agent.kernel" '
-                          '"/httpboot/agent.kernel"', shell=True),
-                mock.call('sudo cp -f "./ironic-python-agent.initramfs" '
-                          '"/httpboot/agent.ramdisk"', shell=True)
+                mock.call(['sudo', 'cp', '-f', '--preserve=mode,timestamps',
+                           './ironic-python-agent.kernel',
+                           '/httpboot/.agent.kernel.tmp']),
+                mock.call(['sudo', 'mv', '-f', '/httpboot/.agent.kernel.tmp',
+                           '/httpboot/agent.kernel']),
+                mock.call(['sudo', 'cp', '-f', '--preserve=mode,timestamps',
+                           './ironic-python-agent.initramfs',
+                           '/httpboot/.agent.ramdisk.tmp']),
+                mock.call(['sudo', 'mv', '-f', '/httpboot/.agent.ramdisk.tmp',
+                           '/httpboot/agent.ramdisk'])
             ])
 
     @mock.patch('subprocess.check_call', autospec=True)
@@ -440,4 +737,4 @@ class TestUploadOvercloudImage(TestPluginV1):
             5,
             self.app.client_manager.image.images.update.call_count
         )
-        self.assertEqual(mock_subprocess_call.call_count, 2)
+        self.assertEqual(mock_subprocess_call.call_count, 4)
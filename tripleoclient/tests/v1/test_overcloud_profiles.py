@@ -53,7 +53,8 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=False)
+            assign_profiles=True, dry_run=False,
+            deterministic=False)
 
     def test_failed(self, mock_assign):
         mock_assign.return_value = (2, 0)
@@ -73,7 +74,8 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=False)
+            assign_profiles=True, dry_run=False,
+            deterministic=False)
 
     def test_dry_run(self, mock_assign):
         mock_assign.return_value = (0, 0)
@@ -93,7 +95,29 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=True)
+            assign_profiles=True, dry_run=True,
+            deterministic=False)
+
+    def test_deterministic(self, mock_assign):
+        mock_assign.return_value = (0, 0)
+
+        arglist = [
+            '--compute-flavor', 'compute',
+            '--compute-scale', '3',
+            '--control-flavor', 'control',
+            '--control-scale', '1',
+            '--deterministic'
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+
+        self.cmd.take_action(parsed_args)
+
+        mock_assign.assert_called_once_with(
+            self.app.client_manager.baremetal,
+            {'compute': (self.flavors[0], 3),
+             'control': (self.flavors[1], 1)},
+            assign_profiles=True, dry_run=False,
+            deterministic=True)
 
 
 class TestListProfiles(test_plugin.TestPluginV1):
@@ -14,22 +14,42 @@
 #
 
 from __future__ import print_function
+import argparse
 import base64
+import collections
+import contextlib
+import copy
+import functools
+import gzip
 import hashlib
+import io
 import json
 import logging
 import os
 import os.path
 import passlib.utils as passutils
+import re
+import requests
+import shutil
 import six
 import socket
 import struct
 import subprocess
+import sys
+import tempfile
+import threading
 import time
+import zlib
 
+from concurrent import futures
 from heatclient.common import event_utils
+from heatclient.common import template_utils
+from heatclient.common import utils as heat_utils
 from heatclient.exc import HTTPNotFound
+import ironic_inspector_client
+from ironicclient import exc as ironic_exc
 from openstackclient.i18n import _
+from prettytable import PrettyTable
 from six.moves import configparser
 from six.moves import urllib
 
@@ -61,6 +81,13 @@ _PASSWORD_NAMES = (
     "OVERCLOUD_TROVE_PASSWORD",
     "NEUTRON_METADATA_PROXY_SHARED_SECRET"
 )
+# Files are checksummed in reads of this size, a multiple of the page size
+_CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+# How many nodes, or API calls, are handled at the same time by default
+DEFAULT_CONCURRENCY = 20
+# Files modified less than this many seconds ago are not cached, as a later
+# change might not update their modification time
+RACY_INTERVAL = 2
 
 
 def generate_overcloud_passwords(output_file="tripleo-overcloud-passwords",
@@ -211,8 +238,181 @@ def check_hypervisor_stats(compute_client, nodes=1, memory=0, vcpu=0):
         return None
 
 
+class StackEventWaiter(object):
+    """Wait for an orchestration stack action to finish
+
+    The top-level stack status is checked every `status_interval` seconds, so
+    a terminal status is reported as soon as Heat flips it. When events are
+    requested, they are fetched by a separate sweep which backs off while
+    nothing happens and is reset as soon as new events arrive. Each stack
+    keeps its own event marker, and nested stacks are found from the new
+    events of their parent, so a nested stack which started and finished
+    between two sweeps still has its events printed. Resources are only
+    listed to map a resource seen in the events to its nested stack.
+
+    Subclasses can override `_poll_events` or `_next_delay` to change how
+    progress is tracked.
+    """
+
+    status_interval = 5
+    min_delay = 5
+    max_delay = 20
+    backoff_factor = 1.5
+
+    def __init__(self, orchestration_client, stack, marker=None,
+                 action='CREATE', verbose=False, nested_depth=2):
+        self.client = orchestration_client
+        self.stack_name = stack.stack_name
+        self.action = action
+        self.verbose = verbose
+        self.nested_depth = nested_depth
+        self.delay = self.min_delay
+        # stack identifier -> nesting depth of the stacks followed
+        self.stacks = {self.stack_name: 0}
+        # stack identifier -> UUID of the last event seen in that stack
+        self.markers = {self.stack_name: marker}
+        # nested stack identifier -> time its resource started, used to
+        # skip the history of nested stacks until they have a marker
+        self.since = {}
+        # stack identifier -> {resource name: nested stack or None}
+        self.resources = {}
+        # stack identifier -> {resource name: start time} of the resources
+        # in progress whose nested stack, if any, is not known yet
+        self.pending = {}
+
+    def _stack_events(self, stack_id):
+        marker = self.markers.get(stack_id)
+        events = event_utils.get_events(
+            self.client, stack_id=stack_id,
+            event_args={'sort_dir': 'asc', 'marker': marker})
+        since = self.since.get(stack_id) if marker is None else None
+        if since:
+            events = [e for e in events
+                      if getattr(e, 'event_time', '') >= since]
+        if events:
+            self.markers[stack_id] = getattr(events[-1], 'id', None)
+            self.since.pop(stack_id, None)
+        return events
+
+    def _nested_changes(self, stack_id, events):
+        """Nested stacks of the resources which changed in `events`
+
+        :returns: list of (nested stack identifier, in progress) tuples
+        """
+        own_name = stack_id.split('/')[0]
+        # resource name -> [in progress, time the resource started]
+        changed = collections.OrderedDict(
+            (name, [True, started])
+            for name, started in self.pending.pop(stack_id, {}).items())
+        for event in events:
+            name = getattr(event, 'resource_name', None)
+            if not name or name == own_name:
+                continue
+            in_progress = getattr(event, 'resource_status',
+                                  '').endswith('IN_PROGRESS')
+            started = changed.get(name, [None, event.event_time])[1]
+            changed[name] = [in_progress, started]
+        if not changed:
+            return []
+
+        known = self.resources.setdefault(stack_id, {})
+        if any(name not in known for name in changed):
+            for resource in self.client.resources.list(stack_id):
+                nested_id = heat_utils.resource_nested_identifier(resource)
+                # without a physical resource, a nested stack may still
+                # be on its way
+                if nested_id or getattr(resource, 'physical_resource_id',
+                                        None):
+                    known[resource.resource_name] = nested_id
+
+        nested = []
+        for name, (in_progress, started) in changed.items():
+            if name not in known:
+                if in_progress:
+                    self.pending.setdefault(stack_id, {})[name] = started
+                continue
+            nested_id = known[name]
+            if nested_id:
+                if nested_id not in self.markers:
+                    self.since.setdefault(nested_id, started)
+                nested.append((nested_id, in_progress))
+        return nested
+
+    def _poll_events(self):
+        """Return the new events of every stack that changed"""
+        events = []
+        fetched = set()
+        queue = sorted(self.stacks.items(), key=lambda item: item[1])
+        while queue:
+            stack_id, depth = queue.pop(0)
+            if stack_id in fetched:
+                continue
+            fetched.add(stack_id)
+            stack_events = self._stack_events(stack_id)
+            events.extend(stack_events)
+            if depth >= self.nested_depth:
+                continue
+            for nested_id, in_progress in self._nested_changes(
+                    stack_id, stack_events):
+                # a finished nested stack has its last events fetched
+                # below, and is not followed any more
+                if in_progress:
+                    self.stacks[nested_id] = depth + 1
+                else:
+                    self.stacks.pop(nested_id, None)
+                queue.append((nested_id, depth + 1))
+        events.sort(key=lambda e: getattr(e, 'event_time', ''))
+        return events
+
+    def _next_delay(self, active):
+        """Seconds until the next event sweep"""
+        if active:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.delay * self.backoff_factor,
+                             self.max_delay)
+        return self.delay
+
+    def _print_events(self, events):
+        if events:
+            print(event_log_formatter(events))
+
+    def wait(self):
+        """Block until the action completes or fails
+
+        :returns: True if the action completed, False otherwise
+        """
+        last_status = None
+        until_sweep = 0
+        while True:
+            stack = get_stack(self.client, self.stack_name)
+            stack_status = stack.stack_status
+            if stack_status in ('%s_COMPLETE' % self.action,
+                                '%s_FAILED' % self.action):
+                if self.verbose:
+                    # the events since the last sweep, including the nested
+                    # failure explaining a failed stack
+                    self._print_events(self._poll_events())
+                print("Stack %(name)s %(status)s" % dict(
+                    name=self.stack_name, status=stack_status))
+                return stack_status == '%s_COMPLETE' % self.action
+
+            if self.verbose:
+                if stack_status != last_status:
+                    until_sweep = 0
+                if until_sweep <= 0:
+                    events = self._poll_events()
+                    self._print_events(events)
+                    until_sweep = self._next_delay(bool(events))
+            last_status = stack_status
+
+            time.sleep(self.status_interval)
+            until_sweep -= self.status_interval
+
+
 def wait_for_stack_ready(orchestration_client, stack_name, marker=None,
-                         action='CREATE', verbose=False):
+                         action='CREATE', verbose=False,
+                         waiter_class=StackEventWaiter):
     """Check the status of an orchestration stack
 
     Get the status of an orchestration stack and check whether it is complete
@@ -232,39 +432,17 @@ def wait_for_stack_ready(orchestration_client, stack_name, marker=None,
 
     :param verbose: Whether to print events
     :type verbose: boolean
+
+    :param waiter_class: Class implementing the wait, see StackEventWaiter
+    :type waiter_class: type
     """
     stack = get_stack(orchestration_client, stack_name)
     if not stack:
         return False
-    stack_name = stack.stack_name
-
-    while True:
-
-        events = event_utils.get_events(orchestration_client,
-                                        stack_id=stack_name, nested_depth=2,
-                                        event_args={'sort_dir': 'asc',
-                                                    'marker': marker})
-
-        if len(events) >= 1:
-            # set marker to last event that was received.
-            marker = getattr(events[-1], 'id', None)
-
-            if verbose:
-                events_log = event_log_formatter(events)
-                print(events_log)
-
-        stack = get_stack(orchestration_client, stack_name)
-        stack_status = stack.stack_status
-        if stack_status == '%s_COMPLETE' % action:
-            print("Stack %(name)s %(status)s" % dict(
-                name=stack_name, status=stack_status))
-            return True
-        elif stack_status == '%s_FAILED' % action:
-            print("Stack %(name)s %(status)s" % dict(
-                name=stack_name, status=stack_status))
-            return False
 
-        time.sleep(5)
+    waiter = waiter_class(orchestration_client, stack, marker=marker,
+                          action=action, verbose=verbose)
+    return waiter.wait()
 
 
 def event_log_formatter(events):
@@ -285,14 +463,342 @@ def event_log_formatter(events):
     return "\n".join(event_log)
 
 
+class ApiCallRecorder(object):
+    """Records the requests sent through keystoneauth sessions
+
+    Every client created from an instrumented session, as the ones of the
+    OSC client manager are, is covered. Requests are grouped by service and
+    endpoint, with the numeric and UUID parts of the path replaced by {id},
+    and their count, errors, latency histogram and payload sizes are kept.
+    Requests that are not made on behalf of a service, such as
+    authentication, are recorded under 'other'.
+    """
+
+    # upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    _ID_RE = re.compile(r'^([0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?'
+                        r'[0-9a-f]{4}-?[0-9a-f]{12}|[0-9]+)$', re.I)
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._installed = []
+
+    @classmethod
+    def endpoint(cls, url):
+        """Path of the URL with its identifiers replaced by {id}."""
+        path = urllib.parse.urlparse(url).path
+        return '/'.join('{id}' if cls._ID_RE.match(part) else part
+                        for part in path.split('/'))
+
+    @staticmethod
+    def _request_size(kwargs):
+        data = kwargs.get('data')
+        if kwargs.get('json') is not None:
+            data = json.dumps(kwargs['json'])
+        if isinstance(data, (six.binary_type, six.text_type)):
+            return len(data)
+        return 0
+
+    @staticmethod
+    def _response_size(response, kwargs):
+        length = getattr(response, 'headers', {}).get('Content-Length')
+        if length is not None:
+            return int(length)
+        if response is not None and not kwargs.get('stream'):
+            return len(response.content or b'')
+        return 0
+
+    def _record(self, url, method, kwargs, elapsed, response, error):
+        endpoint_filter = kwargs.get('endpoint_filter') or {}
+        service = endpoint_filter.get('service_type') or 'other'
+        key = '%s %s %s' % (service, method.upper(), self.endpoint(url))
+        try:
+            response_size = self._response_size(response, kwargs)
+        except Exception:
+            response_size = 0
+        with self._lock:
+            self.calls[service] += 1
+            stats = self.endpoints.setdefault(key, {
+                'count': 0, 'errors': 0, 'seconds': 0.0,
+                'max_seconds': 0.0,
+                'histogram': [0] * (len(self.BUCKETS) + 1),
+                'request_bytes': 0, 'response_bytes': 0})
+            stats['count'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['histogram'][sum(1 for bound in self.BUCKETS
+                                   if elapsed > bound)] += 1
+            stats['request_bytes'] += self._request_size(kwargs)
+            stats['response_bytes'] += response_size
+
+    def _call(self, request, url, method, kwargs):
+        response = None
+        started = time.time()
+        try:
+            response = request(url, method, **kwargs)
+            return response
+        finally:
+            error = response is None or getattr(
+                response, 'status_code', 200) >= 400
+            self._record(url, method, kwargs, time.time() - started,
+                         response, error)
+
+    def install(self, session):
+        """Start recording the requests of the session."""
+        request = session.request
+
+        def recorded_request(url, method, **kwargs):
+            return self._call(request, url, method, kwargs)
+
+        session.request = recorded_request
+        self._installed.append((session, None))
+
+    def install_class(self, session_class):
+        """Start recording the requests of every session of the class."""
+        request = session_class.request
+
+        def recorded_request(session, url, method, **kwargs):
+            return self._call(functools.partial(request, session), url,
+                              method, kwargs)
+
+        session_class.request = recorded_request
+        self._installed.append((session_class, request))
+
+    def uninstall(self):
+        """Stop recording, restoring the request methods."""
+        for target, request in reversed(self._installed):
+            if request is None:
+                del target.request
+            else:
+                target.request = request
+        self._installed = []
+
+    def to_dict(self):
+        with self._lock:
+            endpoints = copy.deepcopy(self.endpoints)
+        for stats in endpoints.values():
+            stats['histogram'] = dict(zip(
+                ['<=%s' % bound for bound in self.BUCKETS] +
+                ['>%s' % self.BUCKETS[-1]], stats['histogram']))
+        return {'buckets': list(self.BUCKETS), 'endpoints': endpoints,
+                'calls': dict(self.calls)}
+
+    def report(self):
+        """Table of the recorded endpoints, busiest first."""
+        table = PrettyTable(['Endpoint', 'Calls', 'Errors', 'Total s',
+                             'Mean s', 'Max s', 'Sent', 'Received'])
+        table.align['Endpoint'] = 'l'
+        with self._lock:
+            endpoints = sorted(self.endpoints.items(),
+                               key=lambda item: -item[1]['seconds'])
+            for key, stats in endpoints:
+                table.add_row([key, stats['count'], stats['errors'],
+                               '%.2f' % stats['seconds'],
+                               '%.3f' % (stats['seconds'] / stats['count']),
+                               '%.3f' % stats['max_seconds'],
+                               stats['request_bytes'],
+                               stats['response_bytes']])
+        return table.get_string()
+
+    def emit(self, target):
+        """Write the statistics to a JSON file, or log them if target is -"""
+        if target == '-':
+            sys.stderr.write("API calls:\n%s\n" % self.report())
+            return
+        with open(target, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+
+class PhaseTimer(object):
+    """Wall clock time spent in the named phases of a command
+
+    :param profiler: cProfile.Profile to enable during the phases that are
+        profiled, None not to profile
+    """
+
+    def __init__(self, profiler=None):
+        self.phases = collections.OrderedDict()
+        self.profiler = profiler
+
+    @contextlib.contextmanager
+    def phase(self, name, profile=True):
+        """Time the block as part of the phase, adding up repeated runs
+
+        Phases spent waiting on the servers should set profile to False.
+        """
+        profiling = self.profiler is not None and profile
+        started = time.time()
+        if profiling:
+            self.profiler.enable()
+        try:
+            yield
+        finally:
+            if profiling:
+                self.profiler.disable()
+            self.phases[name] = (self.phases.get(name, 0) +
+                                 time.time() - started)
+
+    def report(self, report_format='table', api_calls=None, yaml_loads=None):
+        """The phase timings, and API call counts if given, as a string
+
+        :param yaml_loads: list of (path, seconds, cached) of the YAML files
+            loaded, as returned by yaml_utils.load_timings()
+        """
+        total = sum(self.phases.values())
+        api_calls = dict(api_calls or {})
+        yaml_loads = list(yaml_loads or [])
+        if report_format == 'json':
+            return json.dumps({
+                'phases': [{'name': name, 'seconds': round(seconds, 3)}
+                           for name, seconds in self.phases.items()],
+                'total_seconds': round(total, 3),
+                'api_calls': api_calls,
+                'yaml_files': [{'path': path, 'seconds': round(seconds, 3),
+                                'cached': cached}
+                               for path, seconds, cached in yaml_loads],
+            }, indent=2, sort_keys=True)
+
+        table = PrettyTable(['Phase', 'Seconds', '%'])
+        table.align['Phase'] = 'l'
+        for name, seconds in self.phases.items():
+            table.add_row([name, '%.1f' % seconds,
+                           '%.0f' % (100.0 * seconds / total if total else 0)])
+        table.add_row(['total', '%.1f' % total, '100'])
+        output = table.get_string()
+        if api_calls:
+            table = PrettyTable(['Service', 'API calls'])
+            table.align['Service'] = 'l'
+            for service, count in sorted(api_calls.items()):
+                table.add_row([service, count])
+            output += '\n' + table.get_string()
+        if yaml_loads:
+            table = PrettyTable(['YAML file', 'Seconds', 'Cached'])
+            table.align['YAML file'] = 'l'
+            for path, seconds, cached in yaml_loads:
+                table.add_row([path, '%.3f' % seconds, cached])
+            output += '\n' + table.get_string()
+        return output
+
+
+def thread_pool(count, concurrency=DEFAULT_CONCURRENCY):
+    """Thread pool for `count` jobs, running up to `concurrency` at once"""
+    return futures.ThreadPoolExecutor(
+        max_workers=max(1, min(concurrency, count)))
+
+
+def concurrent_map(function, items, concurrency=DEFAULT_CONCURRENCY):
+    """Results of `function` for each item, up to `concurrency` at once
+
+    :returns: list of the results, in the order of `items`
+    """
+    items = list(items)
+    if not items:
+        return []
+    with thread_pool(len(items), concurrency) as executor:
+        return list(executor.map(function, items))
+
+
 def nodes_in_states(baremetal_client, states):
     """List the introspectable nodes with the right provision_states."""
     nodes = baremetal_client.node.list(maintenance=False, associated=False)
     return [node for node in nodes if node.provision_state in states]
 
 
+class NodeStatePoller(object):
+    """Share Ironic node listings between provision state waiters
+
+    Instead of every waiter fetching its own node once per loop, the first
+    waiter that needs fresher data lists all nodes in a single request and
+    the result is handed to every other waiter. With many nodes in flight
+    Ironic sees one request per loop instead of one per node and loop.
+
+    Safe to use from several threads at once.
+    """
+
+    # node.list(fields=...) requires this Ironic API version
+    fields_api_version = (1, 8)
+    fields = ('uuid', 'provision_state', 'last_error')
+
+    def __init__(self, baremetal_client):
+        self.client = baremetal_client
+        self._cond = threading.Condition()
+        self._nodes = {}
+        self._generation = 0
+        self._refreshing = False
+
+    @property
+    def generation(self):
+        """Generation of the newest listing which may have started by now
+
+        Only listings newer than this one reflect changes made from now on,
+        such as a provision state transition about to be requested.
+        """
+        with self._cond:
+            return self._generation + (1 if self._refreshing else 0)
+
+    def _supports_fields(self):
+        try:
+            api_version = self.client.http_client.os_ironic_api_version
+            version = tuple(int(part) for part in api_version.split('.'))
+        except (AttributeError, TypeError, ValueError):
+            return False
+        return version >= self.fields_api_version
+
+    def _list_nodes(self):
+        # limit=0 gets all the nodes rather than the first api.max_limit
+        if self._supports_fields():
+            nodes = self.client.node.list(fields=list(self.fields), limit=0)
+        else:
+            nodes = self.client.node.list(detail=True, limit=0)
+        return {node.uuid: node for node in nodes}
+
+    def _get_missing(self, node_uuid):
+        """Fetch a node that is not in the listing, None if it is gone"""
+        try:
+            return self.client.node.get(node_uuid)
+        except ironic_exc.NotFound:
+            return None
+
+    def get(self, node_uuid, generation=0):
+        """Return a node from a listing newer than `generation`
+
+        :returns: tuple (node or None if it is gone, generation of the
+                  listing the node comes from)
+        """
+        with self._cond:
+            while self._generation <= generation and self._refreshing:
+                self._cond.wait()
+            if self._generation > generation:
+                nodes, generation = self._nodes, self._generation
+            else:
+                nodes = None
+                self._refreshing = True
+        if nodes is not None:
+            if node_uuid not in nodes:
+                return self._get_missing(node_uuid), generation
+            return nodes[node_uuid], generation
+
+        nodes = None
+        try:
+            nodes = self._list_nodes()
+        finally:
+            with self._cond:
+                if nodes is not None:
+                    self._nodes = nodes
+                    self._generation += 1
+                self._refreshing = False
+                self._cond.notify_all()
+                generation = self._generation
+        if node_uuid not in nodes:
+            return self._get_missing(node_uuid), generation
+        return nodes[node_uuid], generation
+
+
 def wait_for_provision_state(baremetal_client, node_uuid, provision_state,
-                             loops=10, sleep=1):
+                             loops=10, sleep=1, poller=None, generation=0):
     """Wait for a given Provisioning state in Ironic
 
     Updating the provisioning state is an async operation, we
@@ -313,12 +819,22 @@ def wait_for_provision_state(baremetal_client, node_uuid, provision_state,
     :param sleep: How long to sleep between loops
     :type sleep: int
 
+    :param poller: Shared poller to get the node from instead of fetching it
+    :type poller: NodeStatePoller
+
+    :param generation: Only use listings of `poller` newer than this one,
+                       e.g. its generation before the transition was requested
+    :type generation: int
+
     :raises exceptions.StateTransitionFailed: if node.last_error is set
     """
 
     for _l in range(0, loops):
 
-        node = baremetal_client.node.get(node_uuid)
+        if poller is None:
+            node = baremetal_client.node.get(node_uuid)
+        else:
+            node, generation = poller.get(node_uuid, generation)
 
         if node is None:
             # The node can't be found in ironic, so we don't need to wait for
@@ -390,13 +906,17 @@ def create_environment_file(path="~/overcloud-env.json",
 
 
 def set_nodes_state(baremetal_client, nodes, transition, target_state,
-                    skipped_states=()):
+                    skipped_states=(), concurrency=DEFAULT_CONCURRENCY):
     """Make all nodes available in the baremetal service for a deployment
 
     For each node, make it available unless it is already available or active.
     Available nodes can be used for a deployment and an active node is already
     in use.
 
+    The transitions are all requested first, then up to `concurrency` nodes
+    are waited on at the same time. The UUID of each node is yielded as soon
+    as it is done, so the order may differ from the order of `nodes`.
+
     :param baremetal_client: Instance of Ironic client
     :type  baremetal_client: ironicclient.v1.client.Client
 
@@ -416,11 +936,8 @@ def set_nodes_state(baremetal_client, nodes, transition, target_state,
                            changed.
     :type  skipped_states: iterable of strings
 
-    :param error_states: Node states treated as error for this transition
-    :type error_states: collection of strings
-
-    :param error_message: Optional message to append to an error message
-    :param error_message: str
+    :param concurrency: Maximum number of nodes waited on at the same time
+    :type  concurrency: int
 
     :raises exceptions.StateTransitionFailed: if a node enters any of the
                                               states in error_states
@@ -430,25 +947,37 @@ def set_nodes_state(baremetal_client, nodes, transition, target_state,
 
     log = logging.getLogger(__name__ + ".set_nodes_state")
 
-    for node in nodes:
-
-        if node.provision_state in skipped_states:
-            continue
+    nodes = [node for node in nodes
+             if node.provision_state not in skipped_states]
 
+    for node in nodes:
         log.debug(
             "Setting provision state from '{0}' to '{1}' for Node {2}"
             .format(node.provision_state, transition, node.uuid))
 
         baremetal_client.node.set_provision_state(node.uuid, transition)
+
+    poller = NodeStatePoller(baremetal_client)
+
+    def _wait(node_uuid):
         try:
-            wait_for_provision_state(baremetal_client, node.uuid, target_state)
+            wait_for_provision_state(baremetal_client, node_uuid,
+                                     target_state, poller=poller)
         except exceptions.StateTransitionFailed as e:
             log.error("FAIL: State transition failed for Node {0}. {1}"
-                      .format(node.uuid, e))
+                      .format(node_uuid, e))
         except exceptions.Timeout as e:
             log.error("FAIL: Timeout waiting for Node {0}. {1}"
-                      .format(node.uuid, e))
-        yield node.uuid
+                      .format(node_uuid, e))
+        return node_uuid
+
+    if not nodes:
+        return
+
+    with thread_pool(len(nodes), concurrency) as executor:
+        waits = [executor.submit(_wait, node.uuid) for node in nodes]
+        for done in futures.as_completed(waits):
+            yield done.result()
 
 
 def get_hiera_key(key_name):
@@ -558,32 +1087,727 @@ def run_shell(cmd):
     return subprocess.call([cmd], shell=True)
 
 
+def run_command(args, timeout=None, env=None):
+    """Run a command from a list of arguments, without a shell
+
+    :param args: the command and its arguments
+    :param timeout: seconds after which the command is killed
+    :param env: environment of the command, the current one by default
+    :returns: (exit status, combined stdout and stderr) tuple
+    :raises exceptions.Timeout: if the command was killed after `timeout`
+    """
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env)
+    killed = []
+
+    def kill():
+        try:
+            process.kill()
+        except OSError:
+            # the command exited in the meantime
+            return
+        killed.append(True)
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer is not None:
+        timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if killed and process.returncode < 0:
+        raise exceptions.Timeout("%s did not finish within %s seconds"
+                                 % (args[0], timeout))
+    return process.returncode, output.decode('utf-8', 'replace')
+
+
 def all_unique(x):
     """Return True if the collection has no duplications."""
     return len(set(x)) == len(x)
 
 
-def file_checksum(filepath):
+def file_digests(filepath, algorithms=('md5',),
+                 chunk_size=_CHECKSUM_CHUNK_SIZE):
+    """Calculate several checksums of a file in a single pass
+
+    The file is read in large chunks into a single reused buffer, which
+    is fed to every requested hash.
+
+    :param filepath: Full path to file (e.g. /home/stack/image.qcow2)
+    :type  filepath: string
+    :param algorithms: names of hashlib algorithms (e.g. md5, sha256)
+    :type  algorithms: iterable
+    :param chunk_size: size of the reads, in bytes
+    :type  chunk_size: int
+    :returns: dict algorithm name -> hex digest
+
+    """
+    if not os.path.isfile(filepath):
+        raise ValueError("The given file {0} is not a regular "
+                         "file".format(filepath))
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with io.open(filepath, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buf)
+            if not size:
+                break
+            for _name, checksum in hashes:
+                checksum.update(view[:size])
+    return {name: checksum.hexdigest() for name, checksum in hashes}
+
+
+def file_checksum(filepath, cache=None):
     """Calculate md5 checksum on file
 
     :param filepath: Full path to file (e.g. /home/stack/image.qcow2)
     :type  filepath: string
+    :param cache: ChecksumCache to look the checksum up in and to record it
+    :type  cache: ChecksumCache
 
     """
     if not os.path.isfile(filepath):
         raise ValueError("The given file {0} is not a regular "
                          "file".format(filepath))
-    checksum = hashlib.md5()
-    with open(filepath, 'rb') as f:
+    if cache is not None:
+        return cache.checksum(filepath)
+    return file_digests(filepath)['md5']
+
+
+def _copy_file_data(fsrc, fdst):
+    """Copy the contents of fsrc into fdst, in the kernel when possible."""
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    for name in ('copy_file_range', 'sendfile'):
+        copy = getattr(os, name, None)
+        if copy is None:
+            continue
+        try:
+            while offset < size:
+                if name == 'sendfile':
+                    sent = copy(fdst.fileno(), fsrc.fileno(), offset,
+                                size - offset)
+                else:
+                    sent = copy(fsrc.fileno(), fdst.fileno(), size - offset,
+                                offset)
+                if not sent:
+                    break
+                offset += sent
+            break
+        except OSError:
+            # not supported between these files, nothing was copied yet
+            if offset:
+                raise
+    # copy what the kernel did not, if it stopped early or is unsupported
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    shutil.copyfileobj(fsrc, fdst, _CHECKSUM_CHUNK_SIZE)
+    if fdst.tell() < size:
+        raise IOError('Short copy of %s: %d of %d bytes' %
+                      (fsrc.name, fdst.tell(), size))
+
+
+def atomic_copy_file(src, dest):
+    """Copy a file so that readers never see a partially written dest
+
+    The data is copied without going through user space where the system
+    allows it, into a temporary file next to `dest` which is then renamed
+    over it. Permissions and timestamps of `src` are preserved.
+
+    :param src: file to copy
+    :param dest: path of the copy
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(dest)),
+        prefix='.%s.' % os.path.basename(dest))
+    try:
+        with os.fdopen(fd, 'wb') as fdst:
+            with open(src, 'rb') as fsrc:
+                _copy_file_data(fsrc, fdst)
+        shutil.copystat(src, tmp_path)
+        os.rename(tmp_path, dest)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_file(path, data, dir_mode=0o700):
+    """Write a file so that readers never see it partially written
+
+    The data is written to a temporary file of its own next to `path`, which
+    is then renamed over it, so that threads and processes saving the same
+    file at the same time never write to the same temporary file.
+
+    :param path: file to write
+    :param data: bytes to write
+    :param dir_mode: permissions of the directory of `path` if it is created
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, dir_mode)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_stat_key(st):
+    """[device, inode, size, mtime in nanoseconds] of an os.stat() result"""
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1e9)
+    return [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+
+
+def is_racy(st, interval=RACY_INTERVAL):
+    """Whether a file was modified too recently for its stat to be cached"""
+    return st.st_mtime > time.time() - interval
+
+
+def _remote_size(url, response, timeout):
+    """Size of the file at `url` according to the server, or None"""
+    # a 416 response should carry "Content-Range: bytes */<size>"
+    content_range = response.headers.get('Content-Range', '')
+    if content_range.startswith('bytes */'):
+        try:
+            return int(content_range[len('bytes */'):])
+        except ValueError:
+            pass
+    length = requests.head(url, allow_redirects=True,
+                           timeout=timeout).headers.get('Content-Length')
+    return int(length) if length is not None else None
+
+
+def download_file(url, path, checksum=None, algorithm='sha256',
+                  chunk_size=_CHECKSUM_CHUNK_SIZE, timeout=60):
+    """Download a file, resuming an earlier interrupted download
+
+    The data is streamed in chunks to `path`.part, so memory use does not
+    depend on the size of the file. If that file already exists, only the
+    rest of the data is requested. It is renamed to `path` once complete
+    and verified: its size must match the one announced by the server, and
+    its digest `checksum` when given.
+
+    :param url: URL of the file
+    :param path: where to save the file
+    :param checksum: expected hex digest of the file, if known
+    :param algorithm: hashlib algorithm of `checksum`
+    :param chunk_size: size of the chunks written, in bytes
+    :param timeout: seconds to wait for the server to respond
+    :raises: exceptions.DownloadError if the file could not be downloaded
+             completely or does not match the checksum
+    """
+    log = logging.getLogger(__name__ + ".download_file")
+    part = path + '.part'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+    try:
+        response = requests.get(url, headers=headers, stream=True,
+                                timeout=timeout)
+        # the server answers 416 when there is nothing left to download
+        if offset and response.status_code == 416:
+            size = _remote_size(url, response, timeout)
+            if size != offset:
+                # the partial file does not belong to this URL any more
+                os.unlink(part)
+                raise exceptions.DownloadError(
+                    "The partial download of %s has %d bytes, the server "
+                    "announces %s. Run the command again to restart the "
+                    "download." % (url, offset, size))
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            else:
+                log.info("Resuming download of %s at byte %d", url, offset)
+
+            with open(part, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+
+            length = response.headers.get('Content-Length')
+            if length is not None and (os.path.getsize(part) !=
+                                       offset + int(length)):
+                raise exceptions.DownloadError(
+                    "Download of %s is incomplete, run the command again to "
+                    "resume it" % url)
+    except requests.exceptions.RequestException as e:
+        raise exceptions.DownloadError(
+            "Failed to download %s: %s. Run the command again to resume the "
+            "download." % (url, e))
+
+    if checksum is not None:
+        actual = file_digests(part, (algorithm,))[algorithm]
+        if actual != checksum.lower():
+            os.unlink(part)
+            raise exceptions.DownloadError(
+                "The %s checksum of %s is %s, expected %s" %
+                (algorithm, url, actual, checksum))
+    os.rename(part, path)
+
+
+class ChecksumCache(object):
+    """Persistent cache of file checksums
+
+    Checksums are stored by real path along with the device, inode, size
+    and modification time of the file, and are only used while all of
+    these still match. A file modified while being checksummed, or so
+    recently that a later change might not update its modification time,
+    is not cached.
+
+    :param path: cache file, ~/.cache/tripleoclient/checksums by default
+    """
+
+    racy_interval = RACY_INTERVAL
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.cache',
+                                         'tripleoclient', 'checksums')
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        try:
+            atomic_write_file(self.path,
+                              json.dumps(self._entries).encode('utf-8'))
+        except (IOError, OSError) as e:
+            logging.getLogger(__name__ + ".ChecksumCache").debug(
+                "Could not save the checksum cache %s: %s", self.path, e)
+
+    def get(self, filepath):
+        """Cached checksum of the file, or None if unknown or outdated."""
+        key = file_stat_key(os.stat(filepath))
+        with self._lock:
+            entry = self._load().get(os.path.realpath(filepath))
+        if entry and entry[:4] == key:
+            return entry[4]
+
+    def set(self, filepath, checksum, st):
+        """Record the checksum of the file as it was when `st` was taken."""
+        current = os.stat(filepath)
+        if (file_stat_key(current) != file_stat_key(st) or
+                is_racy(current, self.racy_interval)):
+            return
+        with self._lock:
+            self._load()[os.path.realpath(filepath)] = (
+                file_stat_key(st) + [checksum])
+            self._save()
+
+    def checksum(self, filepath):
+        """Checksum of the file, computed only if not cached yet."""
+        checksum = self.get(filepath)
+        if checksum is None:
+            st = os.stat(filepath)
+            checksum = file_checksum(filepath)
+            self.set(filepath, checksum, st)
+        return checksum
+
+
+class ChecksumFile(object):
+    """File object wrapper computing the md5 checksum of the data read
+
+    Lets the checksum of a file be known once it has been streamed, e.g. to
+    glance, without reading it a second time.
+
+    :param fileobj: file object opened in binary mode
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._checksum = hashlib.md5()
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._checksum.update(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # clients may rewind to find out the size before reading
+        if offset == 0 and whence == os.SEEK_SET:
+            self._checksum = hashlib.md5()
+        return self._file.seek(offset, whence)
+
+    def hexdigest(self):
+        return self._checksum.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class TemplateCache(object):
+    """Persistent cache of processed Heat templates and environments
+
+    Keeps the parsed template or environment of a file along with the files
+    dict of everything it references, so that tripleo-heat-templates are not
+    read and parsed again on every deploy. An entry is used while every file
+    it was built from still has the same size and modification time, or
+    failing that the same content. Entries built from files modified too
+    recently to be trusted, such as the generated parameter environments,
+    are only kept in memory.
+
+    :param path: cache directory, ~/.cache/tripleoclient/templates by default
+    """
+
+    racy_interval = RACY_INTERVAL
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.cache',
+                                         'tripleoclient', 'templates')
+        self._entries = {}
+        self.log = logging.getLogger(__name__ + ".TemplateCache")
+
+    @staticmethod
+    def _url_path(url):
+        if url.startswith('file://'):
+            return urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+
+    @staticmethod
+    def _fingerprint(filepath):
+        st = os.stat(filepath)
+        with open(filepath, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return [st.st_size, file_stat_key(st)[3], digest]
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, '%s.json' % hashlib.sha1(
+            json.dumps(key).encode('utf-8')).hexdigest())
+
+    def _load(self, key):
+        if key not in self._entries:
+            try:
+                with open(self._entry_path(key)) as f:
+                    entry = json.load(f)
+                if entry['key'] == list(key):
+                    self._entries[key] = entry
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        return self._entries.get(key)
+
+    def _save(self, key, entry):
+        path = self._entry_path(key)
+        try:
+            atomic_write_file(path, json.dumps(entry).encode('utf-8'))
+        except (IOError, OSError, TypeError, ValueError) as e:
+            self.log.debug("Could not save the template cache entry %s: %s",
+                           path, e)
+
+    @staticmethod
+    def _encode_files(files):
+        # get_file contents may be bytes, which JSON cannot hold
+        encoded = {}
+        for url, content in files.items():
+            if isinstance(content, bytes):
+                content = {'base64': base64.b64encode(content).decode('ascii')}
+            encoded[url] = content
+        return encoded
+
+    @staticmethod
+    def _decode_files(files):
+        decoded = {}
+        for url, content in files.items():
+            if isinstance(content, dict):
+                content = base64.b64decode(content['base64'])
+            decoded[url] = content
+        return decoded
+
+    def _valid(self, entry):
+        for filepath, (size, mtime_ns, digest) in entry['deps'].items():
+            try:
+                st = os.stat(filepath)
+                if st.st_size != size:
+                    return False
+                if (file_stat_key(st)[3] != mtime_ns and
+                        self._fingerprint(filepath)[2] != digest):
+                    return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def _cached(self, kind, filepath, process):
+        """Result of `process`, a (files, document) tuple, for the file"""
+        filepath = os.path.abspath(filepath)
+        key = (kind, filepath)
+        entry = self._load(key)
+        if entry is not None and self._valid(entry):
+            self.log.debug("Using cached %s %s", kind, filepath)
+            return (self._decode_files(entry['files']),
+                    copy.deepcopy(entry['doc']))
+
+        files, doc = process()
+        try:
+            deps = {filepath: self._fingerprint(filepath)}
+            for url in files:
+                path = self._url_path(url)
+                if path is None:
+                    # only local files can be checked for changes
+                    return files, doc
+                deps[path] = self._fingerprint(path)
+        except (IOError, OSError):
+            return files, doc
+
+        entry = {'key': list(key), 'deps': deps,
+                 'files': self._encode_files(files),
+                 'doc': copy.deepcopy(doc)}
+        self._entries[key] = entry
+        recent = time.time() - self.racy_interval
+        if not all(mtime_ns / 1e9 < recent
+                   for _, mtime_ns, _ in deps.values()):
+            return files, doc
+        # JSON turns non-string mapping keys, such as {1: 'one'} in YAML,
+        # into strings; such documents are only kept in memory
+        if json.loads(json.dumps(doc)) != doc:
+            self.log.debug("Not saving %s %s to the cache, it does not "
+                           "survive JSON", kind, filepath)
+            return files, doc
+        self._save(key, entry)
+        return files, doc
+
+    def get_template_contents(self, template_path):
+        """Like template_utils.get_template_contents, from the cache"""
+        return self._cached(
+            'template', template_path,
+            lambda: template_utils.get_template_contents(template_path))
+
+    def process_environments(self, env_paths):
+        """Like process_multiple_environments_and_files, from the cache"""
+        merged_files = {}
+        merged_env = {}
+        for env_path in env_paths:
+            files, env = self._cached(
+                'environment', env_path,
+                lambda: template_utils.process_multiple_environments_and_files(
+                    [env_path]))
+            merged_files.update(files)
+            merged_env = template_utils.deep_update(merged_env, env)
+        return merged_files, merged_env
+
+
+def list_introspection_statuses(inspector_client):
+    """Fetch all statuses from the bulk endpoint, when it is available
+
+    :returns: dict of the introspection statuses by node UUID, empty if
+              ironic-inspector can't list them
+    """
+    log = logging.getLogger(__name__ + ".list_introspection_statuses")
+    list_statuses = getattr(inspector_client, 'list_statuses', None)
+    if list_statuses is None:
+        return {}
+
+    statuses = {}
+    marker = None
+    try:
         while True:
-            fragment = f.read(65536)
-            if not fragment:
+            page = list_statuses(marker=marker)
+            if not page or page[-1]['uuid'] in statuses:
                 break
-            checksum.update(fragment)
-    return checksum.hexdigest()
+            for status in page:
+                statuses[status['uuid']] = status
+            marker = page[-1]['uuid']
+    except (ironic_inspector_client.ClientError,
+            ironic_inspector_client.VersionNotSupported) as e:
+        log.debug("Listing introspection statuses is not supported, "
+                  "falling back to per-node calls: %s", e)
+        return {}
+    return statuses
+
+
+class IntrospectionDataCache(object):
+    """Local cache of the introspection data of the nodes
+
+    The data of each node is kept gzip compressed in its own file, along
+    with the time its introspection finished. It is downloaded again from
+    ironic-inspector only once the node has been introspected again. In
+    offline mode ironic-inspector is not contacted at all, and only the data
+    already in the cache can be read.
+
+    The data returned is shared by all the callers and must not be modified.
+
+    :param inspector_client: ironic-inspector client instance
+    :param path: cache directory, ~/.cache/tripleoclient/introspection by
+                 default
+    :param offline: only read the data already in the cache
+    """
+
+    def __init__(self, inspector_client, path=None, offline=False):
+        self.inspector_client = inspector_client
+        self.path = path or os.path.join(os.path.expanduser('~'), '.cache',
+                                         'tripleoclient', 'introspection')
+        self.offline = offline
+        self._entries = {}
+        self._statuses = {}
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__ + ".IntrospectionDataCache")
+
+    def _entry_path(self, node_uuid):
+        return os.path.join(self.path, '%s.json.gz' % node_uuid)
+
+    def _load(self, node_uuid):
+        with self._lock:
+            entry = self._entries.get(node_uuid)
+        if entry is None:
+            try:
+                with gzip.open(self._entry_path(node_uuid), 'rb') as f:
+                    entry = json.loads(f.read().decode('utf-8'))
+                entry = {'finished_at': entry['finished_at'],
+                         'data': entry['data']}
+            except (IOError, OSError, EOFError, ValueError, KeyError,
+                    TypeError, zlib.error):
+                return None
+            with self._lock:
+                self._entries.setdefault(node_uuid, entry)
+        return entry
+
+    def _save(self, node_uuid, entry):
+        path = self._entry_path(node_uuid)
+        try:
+            data = io.BytesIO()
+            with gzip.GzipFile(fileobj=data, mode='wb') as f:
+                f.write(json.dumps(entry).encode('utf-8'))
+            atomic_write_file(path, data.getvalue())
+        except (IOError, OSError, TypeError, ValueError) as e:
+            self.log.debug("Could not save the introspection data cache "
+                           "entry %s: %s", path, e)
+
+    def get_data(self, node_uuid, status=None):
+        """Introspection data of a node, from the cache while still current
+
+        :param node_uuid: UUID of the node
+        :param status: introspection status of the node. By default the one
+                       seen by prefetch() is used, or it is fetched from
+                       ironic-inspector.
+        :raises exceptions.NotFound: in offline mode, if the data of the
+                                     node is not in the cache
+        """
+        entry = self._load(node_uuid)
+        if self.offline:
+            if entry is None:
+                raise exceptions.NotFound(
+                    "Introspection data of node %s is not cached" % node_uuid)
+            return entry['data']
+
+        if status is None:
+            with self._lock:
+                status = self._statuses.get(node_uuid)
+        if status is None:
+            status = self.inspector_client.get_status(node_uuid)
+            with self._lock:
+                self._statuses[node_uuid] = status
+        finished_at = status.get('finished_at')
+        if (entry is not None and finished_at and
+                entry['finished_at'] == finished_at):
+            self.log.debug("Using cached introspection data of node %s",
+                           node_uuid)
+            return entry['data']
+
+        entry = {'finished_at': finished_at,
+                 'data': self.inspector_client.get_data(node_uuid)}
+        with self._lock:
+            self._entries[node_uuid] = entry
+        if finished_at:
+            # without the finish time the data can't be known to be current
+            self._save(node_uuid, entry)
+        return entry['data']
+
+    def prefetch(self, node_uuids, concurrency=DEFAULT_CONCURRENCY):
+        """Bring the cached data of the given nodes up to date
+
+        The statuses of all nodes are listed in one call when ironic-inspector
+        supports it, then the data that is missing or outdated is downloaded
+        for up to `concurrency` nodes at the same time. Nodes whose data can't
+        be fetched are skipped, the error is raised when the data is read.
+        """
+        node_uuids = list(node_uuids)
+        if self.offline or not node_uuids:
+            return
+        statuses = list_introspection_statuses(self.inspector_client)
+        with self._lock:
+            self._statuses.update(statuses)
+
+        def fetch(node_uuid):
+            try:
+                self.get_data(node_uuid)
+            except (ironic_inspector_client.ClientError,
+                    AttributeError) as e:
+                self.log.debug("Could not prefetch the introspection data "
+                               "of node %s: %s", node_uuid, e)
+
+        concurrent_map(fetch, node_uuids, concurrency)
+
+
+class NodeInventory(object):
+    """Snapshot of all ironic nodes, shared by several validations.
+
+    Nodes are listed once with their details and their capabilities parsed
+    once, so that checks run one after another do not each list the whole
+    fleet again.
+
+    :param bm_client: ironic client instance
+    """
 
+    def __init__(self, bm_client):
+        # limit=0 gets all the nodes rather than the first api.max_limit
+        self.nodes = collections.OrderedDict(
+            (node.uuid, node)
+            for node in bm_client.node.list(detail=True, limit=0))
+        self.capabilities = {uu: node_get_capabilities(node)
+                             for uu, node in self.nodes.items()}
+
+    def list(self, maintenance=None, associated=None, provision_states=None):
+        """Nodes matching the given filters, like ironic's node list."""
+        return [node for node in self.nodes.values()
+                if (maintenance is None or
+                    bool(node.maintenance) == maintenance) and
+                (associated is None or
+                 (node.instance_uuid is not None) == associated) and
+                (provision_states is None or
+                 node.provision_state in provision_states)]
+
+
+def list_nodes(bm_client, fields, **filters):
+    """List the nodes with the given fields in a single call
+
+    Only the fields asked for are returned if the client and the API support
+    it (API version 1.8), otherwise the nodes are listed with all details.
+    """
+    try:
+        return bm_client.node.list(fields=fields, **filters)
+    except (TypeError, ironic_exc.BadRequest, ironic_exc.NotAcceptable,
+            ironic_exc.UnsupportedVersion):
+        return bm_client.node.list(detail=True, **filters)
+
+
+def get_nodes(bm_client, node_uuids, concurrency=DEFAULT_CONCURRENCY):
+    """Fetch the given nodes, up to `concurrency` at the same time
+
+    :returns: dict of the nodes by UUID
+    """
+    node_uuids = list(node_uuids)
+    return dict(zip(node_uuids, concurrent_map(bm_client.node.get,
+                                               node_uuids, concurrency)))
 
-def check_nodes_count(baremetal_client, stack, parameters, defaults):
+
+def check_nodes_count(baremetal_client, stack, parameters, defaults,
+                      inventory=None):
     """Check if there are enough available nodes for creating/scaling stack"""
     count = 0
     if stack:
@@ -603,9 +1827,13 @@ def check_nodes_count(baremetal_client, stack, parameters, defaults):
     # (not in maintenance mode).
     # Assumption is that associated nodes are part of the stack (only
     # one overcloud is supported).
-    associated = len(baremetal_client.node.list(associated=True))
-    available = len(baremetal_client.node.list(associated=False,
-                                               maintenance=False))
+    if inventory is not None:
+        associated = len(inventory.list(associated=True))
+        available = len(inventory.list(associated=False, maintenance=False))
+    else:
+        associated = len(baremetal_client.node.list(associated=True))
+        available = len(baremetal_client.node.list(associated=False,
+                                                   maintenance=False))
     ironic_nodes_count = associated + available
 
     if count > ironic_nodes_count:
@@ -646,15 +1874,118 @@ def node_add_capabilities(bm_client, node, **updated):
     caps = node_get_capabilities(node)
     caps.update(updated)
     converted_caps = dict_to_capabilities(caps)
-    node.properties['capabilities'] = converted_caps
     bm_client.node.update(node.uuid, [{'op': 'add',
                                        'path': '/properties/capabilities',
                                        'value': converted_caps}])
+    node.properties['capabilities'] = converted_caps
     return caps
 
 
+def update_nodes_capabilities(bm_client, updates,
+                              concurrency=DEFAULT_CONCURRENCY,
+                              retries=5, retry_delay=2):
+    """Add or replace capabilities on several nodes concurrently.
+
+    Updates rejected with a conflict, which ironic returns while a node is
+    locked by a conductor, are retried after `retry_delay` seconds.
+
+    :param bm_client: ironic client instance
+    :param updates: list of (node, dict of capabilities to set) tuples
+    :param concurrency: how many updates to send at the same time
+    :param retries: how many times to retry an update on conflict
+    :param retry_delay: seconds to wait before retrying
+    :returns: map node UUID -> None on success, or the error on failure
+    """
+    def _update(node, updated):
+        for attempt in range(retries + 1):
+            try:
+                node_add_capabilities(bm_client, node, **updated)
+                return None
+            except ironic_exc.Conflict as e:
+                if attempt == retries:
+                    return e
+                time.sleep(retry_delay)
+            except ironic_exc.ClientException as e:
+                return e
+
+    if not updates:
+        return {}
+
+    with thread_pool(len(updates), concurrency) as executor:
+        jobs = {executor.submit(_update, node, updated): node.uuid
+                for node, updated in updates}
+        return {jobs[job]: job.result()
+                for job in futures.as_completed(jobs)}
+
+
+class ProfileIndex(object):
+    """Index of ironic nodes by profile, used for matching nodes to flavors.
+
+    Capabilities of every node are parsed once, and nodes are indexed both
+    by their ``profile`` capability and by each ``<profile>_profile``
+    capability set to a true value, so that each flavor only looks at the
+    nodes relevant to it. Nodes taken for one flavor are not offered again.
+
+    :param nodes: ironic nodes to index
+    :param sort_nodes: offer nodes ordered by UUID instead of in the order
+                       they were listed
+    :param capabilities: already parsed capabilities, map node UUID -> dict
+    """
+
+    def __init__(self, nodes, sort_nodes=False, capabilities=None):
+        if sort_nodes:
+            nodes = sorted(nodes, key=lambda node: node.uuid)
+        self.nodes = collections.OrderedDict((node.uuid, node)
+                                             for node in nodes)
+        self.caps = {}
+        self._by_profile = collections.defaultdict(list)
+        self._by_capability = collections.defaultdict(list)
+        self._free = set(self.nodes)
+
+        for uu, node in self.nodes.items():
+            if capabilities is not None:
+                caps = self.caps[uu] = capabilities[uu]
+            else:
+                caps = self.caps[uu] = node_get_capabilities(node)
+            profile = caps.get('profile')
+            self._by_profile[profile].append(uu)
+            if not profile and node.provision_state == 'available':
+                # profiles are only ever assigned to available nodes
+                for key, value in caps.items():
+                    if (key.endswith('_profile') and
+                            value.lower() in ('1', 'true')):
+                        self._by_capability[key[:-len('_profile')]].append(
+                            uu)
+
+    def with_profile(self, profile):
+        """Free nodes that have the given profile (None for no profile)."""
+        return [uu for uu in self._by_profile.get(profile, ())
+                if uu in self._free]
+
+    def candidates(self, profile, count):
+        """Up to `count` free nodes that may be assigned the given profile."""
+        result = []
+        for uu in self._by_capability.get(profile, ()):
+            if len(result) >= count:
+                break
+            if uu in self._free:
+                result.append(uu)
+        return result
+
+    def take(self, uu):
+        """Remove a node from the pool and return its capabilities."""
+        self._free.discard(uu)
+        return self.caps[uu]
+
+    def without_profile(self):
+        """Free nodes that have no profile assigned."""
+        return [uu for uu in self.nodes
+                if uu in self._free and not self.caps[uu].get('profile')]
+
+
 def assign_and_verify_profiles(bm_client, flavors,
-                               assign_profiles=False, dry_run=False):
+                               assign_profiles=False, dry_run=False,
+                               deterministic=False, inventory=None):
     """Assign and verify profiles for given flavors.
 
     :param bm_client: ironic client instance
@@ -662,6 +1993,9 @@ def assign_and_verify_profiles(bm_client, flavors,
     :param assign_profiles: whether to allow assigning profiles to nodes
     :param dry_run: whether to skip applying actual changes (only makes sense
                     if assign_profiles is True)
+    :param deterministic: process flavors ordered by name and nodes ordered
+                          by UUID, so that repeated runs pick the same nodes
+    :param inventory: NodeInventory to use instead of listing nodes
     :returns: tuple (errors count, warnings count)
     """
     log = logging.getLogger(__name__ + ".assign_and_verify_profiles")
@@ -669,18 +2003,28 @@ def assign_and_verify_profiles(bm_client, flavors,
     predeploy_warnings = 0
 
     # nodes available for deployment and scaling (including active)
-    bm_nodes = {node.uuid: node
-                for node in bm_client.node.list(maintenance=False,
-                                                detail=True)
-                if node.provision_state in ('available', 'active')}
-    # create a pool of unprocessed nodes and record their capabilities
-    free_node_caps = {uu: node_get_capabilities(node)
-                      for uu, node in bm_nodes.items()}
+    if inventory is not None:
+        index = ProfileIndex(
+            inventory.list(maintenance=False,
+                           provision_states=('available', 'active')),
+            sort_nodes=deterministic, capabilities=inventory.capabilities)
+    else:
+        index = ProfileIndex(
+            (node for node in bm_client.node.list(maintenance=False,
+                                                  detail=True)
+             if node.provision_state in ('available', 'active')),
+            sort_nodes=deterministic)
+
+    flavor_items = list(flavors.items())
+    if deterministic:
+        flavor_items.sort(key=lambda item: item[0])
 
     # TODO(dtantsur): use command-line arguments to specify the order in
     # which profiles are processed (might matter for assigning profiles)
     profile_flavor_used = False
-    for flavor_name, (flavor, scale) in flavors.items():
+    # profiles to save are collected first and written in one batch
+    new_profiles = []
+    for flavor_name, (flavor, scale) in flavor_items:
         if not scale:
             log.debug("Skipping verification of flavor %s because "
                       "none will be deployed", flavor_name)
@@ -702,8 +2046,7 @@ def assign_and_verify_profiles(bm_client, flavors,
         profile_flavor_used = True
 
         # first collect nodes with known profiles
-        assigned_nodes = [uu for uu, caps in free_node_caps.items()
-                          if caps.get('profile') == profile]
+        assigned_nodes = index.with_profile(profile)
         required_count = scale - len(assigned_nodes)
 
         if required_count < 0:
@@ -714,28 +2057,21 @@ def assign_and_verify_profiles(bm_client, flavors,
         elif required_count > 0 and assign_profiles:
             # find more nodes by checking XXX_profile capabilities that are
             # set by ironic-inspector or manually
-            capability = '%s_profile' % profile
-            more_nodes = [
-                uu for uu, caps in free_node_caps.items()
-                # use only nodes without a know profile
-                if not caps.get('profile') and
-                caps.get(capability, '').lower() in ('1', 'true') and
-                # do not assign profiles for active nodes
-                bm_nodes[uu].provision_state == 'available'
-            ][:required_count]
+            more_nodes = index.candidates(profile, required_count)
             assigned_nodes.extend(more_nodes)
             required_count -= len(more_nodes)
 
         for uu in assigned_nodes:
             # make sure these nodes are not reused for other profiles
-            node_caps = free_node_caps.pop(uu)
+            node_caps = index.take(uu)
             # save profile for newly assigned nodes, but only if we
             # succeeded in finding enough of them
             if not required_count and not node_caps.get('profile'):
-                node = bm_nodes[uu]
-                if not dry_run:
-                    node_add_capabilities(bm_client, node, profile=profile)
-                log.info('Node %s was assigned profile %s', uu, profile)
+                if dry_run:
+                    log.info('Node %s was assigned profile %s', uu, profile)
+                else:
+                    new_profiles.append((index.nodes[uu],
+                                         {'profile': profile}))
             else:
                 log.debug('Node %s has profile %s', uu, profile)
 
@@ -751,8 +2087,23 @@ def assign_and_verify_profiles(bm_client, flavors,
                 "boot_option:local", profile)
             predeploy_errors += 1
 
-    nodes_without_profile = [uu for uu, caps in free_node_caps.items()
-                             if not caps.get('profile')]
+    if new_profiles:
+        results = update_nodes_capabilities(bm_client, new_profiles)
+        table = PrettyTable(['Node UUID', 'Profile', 'Result'])
+        for node, updated in new_profiles:
+            error = results[node.uuid]
+            if error is None:
+                log.info('Node %s was assigned profile %s',
+                         node.uuid, updated['profile'])
+            else:
+                log.error('Error: failed to assign profile %s to node %s: '
+                          '%s', updated['profile'], node.uuid, error)
+                predeploy_errors += 1
+            table.add_row([node.uuid, updated['profile'],
+                           'assigned' if error is None else 'failed'])
+        log.info('Profile assignment summary:\n%s', table)
+
+    nodes_without_profile = index.without_profile()
     if nodes_without_profile and profile_flavor_used:
         predeploy_warnings += 1
         log.warning(
@@ -764,6 +2115,18 @@ def assign_and_verify_profiles(bm_client, flavors,
     return predeploy_errors, predeploy_warnings
 
 
+def positive_int(value):
+    """argparse type for the options that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            _('%s is not a positive integer') % value)
+    return number
+
+
 def add_deployment_plan_arguments(parser):
     """Add deployment plan arguments (flavors and scales) to a parser"""
     parser.add_argument('--control-scale', type=int,
@@ -16,22 +16,26 @@
 from __future__ import print_function
 
 import argparse
+import collections
 import csv
 import json
 import logging
+import os
 import time
-import yaml
 
 from cliff import command
 from cliff import lister
+from concurrent import futures
 import ironic_inspector_client
 from openstackclient.common import utils as osc_utils
 from openstackclient.i18n import _
 from oslo_utils import units
+from prettytable import PrettyTable
 from tripleo_common.utils import nodes
 
 from tripleoclient import exceptions
 from tripleoclient import utils
+from tripleoclient import yaml_utils
 
 
 def _csv_to_nodes_dict(nodes_csv):
@@ -72,8 +76,52 @@ class ValidateInstackEnv(command.Command):
             '-f', '--file', dest='instackenv',
             help="Path to the instackenv.json file.",
             default='instackenv.json')
+        parser.add_argument(
+            '--concurrency', type=utils.positive_int,
+            default=utils.DEFAULT_CONCURRENCY,
+            help=_('Check at most this many BMCs at the same time.'))
+        parser.add_argument(
+            '--bmc-timeout', type=utils.positive_int, default=30,
+            help=_('Seconds after which a BMC that did not answer is '
+                   'reported as failed.'))
         return parser
 
+    def _check_bmc(self, node, timeout):
+        """Query the chassis status of a node with ipmitool
+
+        :returns: (seconds, error or None) tuple
+        """
+        # NOTE: the password is passed in the environment (-E) so that it
+        # does not show in the process list
+        cmd = ['ipmitool', '-R', '1', '-I', 'lanplus', '-H', node['pm_addr'],
+               '-U', node['pm_user'], '-E', 'chassis', 'status']
+        env = dict(os.environ, IPMI_PASSWORD=node['pm_password'])
+        self.log.debug("Executing: %s", ' '.join(cmd))
+
+        started = time.time()
+        try:
+            status, output = utils.run_command(cmd, timeout=timeout, env=env)
+        except exceptions.Timeout:
+            error = 'no answer within %d seconds' % timeout
+        except OSError as e:
+            error = 'ipmitool could not be run: %s' % e
+        else:
+            lines = output.strip().splitlines()
+            error = None
+            if status != 0:
+                error = lines[-1] if lines else 'exit status %d' % status
+        return time.time() - started, error
+
+    def _check_bmcs(self, nodes, concurrency, timeout):
+        """Check the BMCs of the nodes, up to `concurrency` at the same time
+
+        :returns: list of (pm_addr, seconds, error or None) in node order
+        """
+        results = utils.concurrent_map(
+            lambda node: self._check_bmc(node, timeout), nodes, concurrency)
+        return [(node['pm_addr'], seconds, error)
+                for node, (seconds, error) in zip(nodes, results)]
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
@@ -82,10 +130,14 @@ class ValidateInstackEnv(command.Command):
         with open(parsed_args.instackenv, 'r') as net_file:
             env_data = json.load(net_file)
 
+        # The structural checks of all the nodes come first, they only take
+        # a moment, and the BMCs are contacted afterwards.
         maclist = []
         baremetal_ips = []
+        ipmi_nodes = []
         for node in env_data['nodes']:
             self.log.info("Checking node %s" % node['pm_addr'])
+            errors_before = self.error_count
 
             try:
                 if len(node['pm_password']) == 0:
@@ -101,6 +153,7 @@ class ValidateInstackEnv(command.Command):
             except Exception as e:
                 self.log.error('ERROR: User does not exist: %s', e)
                 self.error_count += 1
+            credentials_valid = self.error_count == errors_before
             try:
                 if len(node['mac']) == 0:
                     self.log.error('ERROR: MAC address 0 length.')
@@ -115,16 +168,9 @@ class ValidateInstackEnv(command.Command):
 
             if node['pm_type'] == "pxe_ipmitool":
                 self.log.debug("Identified baremetal node")
-
-                cmd = ('ipmitool -R 1 -I lanplus -H %s -U %s -P %s chassis '
-                       'status' % (node['pm_addr'], node['pm_user'],
-                                   node['pm_password']))
-                self.log.debug("Executing: %s", cmd)
-                status = utils.run_shell(cmd)
-                if status != 0:
-                    self.log.error('ERROR: ipmitool failed')
-                    self.error_count += 1
                 baremetal_ips.append(node['pm_addr'])
+                if credentials_valid:
+                    ipmi_nodes.append(node)
 
         if not utils.all_unique(baremetal_ips):
             self.log.error('ERROR: Baremetals IPs are not all unique.')
@@ -138,6 +184,18 @@ class ValidateInstackEnv(command.Command):
         else:
             self.log.debug('MAC addresses are all unique.')
 
+        results = self._check_bmcs(ipmi_nodes, parsed_args.concurrency,
+                                   parsed_args.bmc_timeout)
+        if results:
+            table = PrettyTable(['BMC', 'Result', 'Time (s)'])
+            for pm_addr, seconds, error in results:
+                if error is not None:
+                    self.log.error('ERROR: ipmitool failed for %s: %s',
+                                   pm_addr, error)
+                    self.error_count += 1
+                table.add_row([pm_addr, error or 'OK', '%.1f' % seconds])
+            print(table)
+
         if self.error_count == 0:
             print('SUCCESS: found 0 errors')
         else:
@@ -191,7 +249,7 @@ class ImportBaremetal(command.Command):
         elif parsed_args.csv or parsed_args.file_in.name.endswith('.csv'):
             nodes_config = _csv_to_nodes_dict(parsed_args.file_in)
         elif parsed_args.file_in.name.endswith('.yaml'):
-            nodes_config = yaml.safe_load(parsed_args.file_in)
+            nodes_config = yaml_utils.load(parsed_args.file_in)
         else:
             raise exceptions.InvalidConfiguration(
                 _("Invalid file extension for %s, must be json, yaml or csv") %
@@ -243,6 +301,82 @@ class StartBaremetalIntrospectionBulk(command.Command):
 
     log = logging.getLogger(__name__ + ".StartBaremetalIntrospectionBulk")
 
+    def get_parser(self, prog_name):
+        parser = super(StartBaremetalIntrospectionBulk,
+                       self).get_parser(prog_name)
+        parser.add_argument('--concurrency', type=utils.positive_int,
+                            help=_('Introspect at most this many nodes at '
+                                   'the same time, and make each node '
+                                   'available as soon as its own '
+                                   'introspection finishes. By default all '
+                                   'nodes are introspected at once.'))
+        return parser
+
+    def _introspect_node(self, node, poller, timings):
+        client = self.app.client_manager.baremetal
+        inspector_client = self.app.client_manager.baremetal_introspection
+
+        started = time.time()
+        print("Starting introspection of node: {0}".format(node.uuid))
+        inspector_client.introspect(node.uuid)
+        status = inspector_client.wait_for_finish([node.uuid])[node.uuid]
+        timings['introspection'].append(time.time() - started)
+
+        if status['error'] is not None:
+            print("Introspection for UUID {0} finished with error: {1}"
+                  .format(node.uuid, status['error']))
+            return "%s: %s" % (node.uuid, status['error'])
+        print("Introspection for UUID {0} finished successfully."
+              .format(node.uuid))
+
+        started = time.time()
+        # listings taken before the transition may hold a stale state
+        generation = poller.generation
+        client.node.set_provision_state(node.uuid, 'provide')
+        try:
+            utils.wait_for_provision_state(client, node.uuid, 'available',
+                                           poller=poller,
+                                           generation=generation)
+        except exceptions.StateTransitionFailed as e:
+            self.log.error("FAIL: State transition failed for Node {0}. {1}"
+                           .format(node.uuid, e))
+        except exceptions.Timeout as e:
+            self.log.error("FAIL: Timeout waiting for Node {0}. {1}"
+                           .format(node.uuid, e))
+        else:
+            print("Node {0} has been set to available.".format(node.uuid))
+        timings['provide'].append(time.time() - started)
+
+    def _introspect_pipelined(self, nodes, concurrency):
+        """Keep up to `concurrency` nodes between introspection and provide"""
+        poller = utils.NodeStatePoller(self.app.client_manager.baremetal)
+        timings = {'introspection': [], 'provide': []}
+        errors = []
+
+        started = time.time()
+        with utils.thread_pool(len(nodes), concurrency) as executor:
+            jobs = [executor.submit(self._introspect_node, node, poller,
+                                    timings)
+                    for node in nodes]
+            for job in futures.as_completed(jobs):
+                error = job.result()
+                if error:
+                    errors.append(error)
+        elapsed = time.time() - started
+
+        print("Introspection pipeline finished in {0:.1f} seconds."
+              .format(elapsed))
+        for stage in ('introspection', 'provide'):
+            durations = timings[stage]
+            if not durations:
+                continue
+            print("  {0}: {1} nodes, {2:.1f}s average, {3:.1f}s longest, "
+                  "{4:.1f} nodes/minute".format(
+                      stage, len(durations),
+                      sum(durations) / len(durations), max(durations),
+                      len(durations) * 60.0 / max(elapsed, 1e-3)))
+        return errors
+
     def take_action(self, parsed_args):
 
         self.log.debug("take_action(%s)" % parsed_args)
@@ -260,6 +394,17 @@ class StartBaremetalIntrospectionBulk(command.Command):
             self.log.debug("Node {0} has been set to manageable.".format(uuid))
 
         manageable_nodes = utils.nodes_in_states(client, ("manageable",))
+
+        if parsed_args.concurrency is not None:
+            errors = self._introspect_pipelined(manageable_nodes,
+                                                parsed_args.concurrency)
+            if errors:
+                raise exceptions.IntrospectionError(
+                    "Introspection completed with errors:\n%s"
+                    % '\n'.join(sorted(errors)))
+            print("Introspection completed.")
+            return
+
         for node in manageable_nodes:
             node_uuids.append(node.uuid)
 
@@ -301,6 +446,30 @@ class StatusBaremetalIntrospectionBulk(lister.Lister):
     """Get the status of all baremetal nodes"""
 
     log = logging.getLogger(__name__ + ".StatusBaremetalIntrospectionBulk")
+    concurrency = utils.DEFAULT_CONCURRENCY
+    watch_interval = 10
+
+    def get_parser(self, prog_name):
+        parser = super(StatusBaremetalIntrospectionBulk,
+                       self).get_parser(prog_name)
+        parser.add_argument('--watch', action='store_true',
+                            help=_('Keep refreshing until introspection of '
+                                   'every node has finished, printing only '
+                                   'the nodes whose status changed.'))
+        return parser
+
+    def _get_statuses(self, inspector_client, node_uuids):
+        statuses = utils.list_introspection_statuses(inspector_client)
+
+        missing = [uuid for uuid in node_uuids if uuid not in statuses]
+        if missing:
+            self.log.debug("Getting introspection status of Ironic nodes {0}"
+                           .format(', '.join(missing)))
+            statuses.update(zip(missing, utils.concurrent_map(
+                inspector_client.get_status, missing, self.concurrency)))
+
+        return [(uuid, statuses[uuid]['finished'], statuses[uuid]['error'])
+                for uuid in node_uuids]
 
     def take_action(self, parsed_args):
 
@@ -308,19 +477,23 @@ class StatusBaremetalIntrospectionBulk(lister.Lister):
         client = self.app.client_manager.baremetal
         inspector_client = self.app.client_manager.baremetal_introspection
 
-        statuses = []
-
-        for node in client.node.list():
-            self.log.debug("Getting introspection status of Ironic node {0}"
-                           .format(node.uuid))
+        node_uuids = [node.uuid for node in client.node.list()]
+        rows = self._get_statuses(inspector_client, node_uuids)
 
-            statuses.append((node.uuid,
-                             inspector_client.get_status(node.uuid)))
+        if parsed_args.watch:
+            shown = {}
+            # the last refresh is only shown in the final table
+            while not all(row[1] for row in rows):
+                for row in rows:
+                    if shown.get(row[0]) != row:
+                        print("{0}: finished={1}, error={2}".format(*row))
+                        shown[row[0]] = row
+                time.sleep(self.watch_interval)
+                rows = self._get_statuses(inspector_client, node_uuids)
 
         return (
             ("Node UUID", "Finished", "Error"),
-            list((node_uuid, status['finished'], status['error'])
-                 for (node_uuid, status) in statuses)
+            rows
         )
 
 
@@ -330,53 +503,108 @@ class ConfigureReadyState(command.Command):
     log = logging.getLogger(__name__ + ".ConfigureReadyState")
     sleep_time = 15
     loops = 120
+    concurrency = utils.DEFAULT_CONCURRENCY
+    _progress = None
+    _printed_progress = None
+
+    def _record(self, node, state):
+        if self._progress is None:
+            self._progress = collections.OrderedDict()
+        self._progress[node.uuid] = state
+
+    def _print_progress(self):
+        """Print the state of every node, when it changed since last time"""
+        if not self._progress or self._progress == self._printed_progress:
+            return
+        table = PrettyTable(['Node', 'State'])
+        for uuid, state in self._progress.items():
+            table.add_row([uuid, state])
+        print(table)
+        self._printed_progress = dict(self._progress)
 
     def _configure_bios(self, nodes):
         nodes_with_reboot_request = set()
+        nodes = [(node, profile) for node, profile in nodes
+                 if (profile in self.ready_state_config and
+                     'bios_settings' in self.ready_state_config[profile])]
+
+        def configure(node_profile):
+            node, profile = node_profile
+            print("Configuring BIOS for node {0}".format(node.uuid))
+            settings = self.ready_state_config[profile]['bios_settings']
+            resp = self.bm_client.node.vendor_passthru(
+                node.uuid, 'set_bios_config', http_method='POST',
+                args=settings)
+
+            if resp.commit_required:
+                self.bm_client.node.vendor_passthru(
+                    node.uuid, 'commit_bios_config', http_method='POST')
+            return resp.commit_required
+
+        commits = utils.concurrent_map(configure, nodes, self.concurrency)
+        for (node, _profile), commit_required in zip(nodes, commits):
+            if commit_required:
+                nodes_with_reboot_request.add(node)
+                self._record(node, 'BIOS config committed')
+            else:
+                self._record(node, 'BIOS config unchanged')
+        self._print_progress()
 
-        for node, profile in nodes:
-            if (profile in self.ready_state_config and
-                    'bios_settings' in self.ready_state_config[profile]):
-
-                print("Configuring BIOS for node {0}".format(node.uuid))
-                settings = self.ready_state_config[profile]['bios_settings']
-                resp = self.bm_client.node.vendor_passthru(
-                    node.uuid, 'set_bios_config', http_method='POST',
-                    args=settings)
-
-                if resp.commit_required:
-                    nodes_with_reboot_request.add(node)
-                    self.bm_client.node.vendor_passthru(
-                        node.uuid, 'commit_bios_config', http_method='POST')
-
-        # NOTE(ifarkas): give the DRAC card some time to process the job
-        time.sleep(self.sleep_time)
+        if nodes_with_reboot_request:
+            # NOTE(ifarkas): give the DRAC card some time to process the job
+            time.sleep(self.sleep_time)
 
         return nodes_with_reboot_request
 
     def _wait_for_drac_config_jobs(self, nodes):
-        for node in nodes:
+        """Poll the unfinished jobs of all the nodes together"""
+        pending = list(nodes)
+        for node in pending:
             print("Waiting for DRAC config jobs to finish on node {0}"
                   .format(node.uuid))
 
-            for _r in range(self.loops):
-                resp = self.bm_client.node.vendor_passthru(
-                    node.uuid, 'list_unfinished_jobs', http_method='GET')
-                if not resp.unfinished_jobs:
-                    break
+        def unfinished_jobs(node):
+            return self.bm_client.node.vendor_passthru(
+                node.uuid, 'list_unfinished_jobs',
+                http_method='GET').unfinished_jobs
+
+        for _r in range(self.loops):
+            still_pending = []
+            for node, jobs in zip(pending, utils.concurrent_map(
+                    unfinished_jobs, pending, self.concurrency)):
+                if jobs:
+                    still_pending.append(node)
+                    self._record(node, 'waiting for {0} config job(s)'
+                                 .format(len(jobs)))
+                else:
+                    self._record(node, 'config jobs finished')
+            pending = still_pending
+            self._print_progress()
+            if not pending:
+                break
 
-                time.sleep(self.sleep_time)
-            else:
-                msg = ("Timed out waiting for DRAC config jobs on node {0}"
-                       .format(node.uuid))
-                raise exceptions.Timeout(msg)
+            time.sleep(self.sleep_time)
+        else:
+            for node in pending:
+                self._record(node, 'timed out')
+            self._print_progress()
+            msg = ("Timed out waiting for DRAC config jobs on nodes {0}"
+                   .format(', '.join(node.uuid for node in pending)))
+            raise exceptions.Timeout(msg)
 
     def _change_power_state(self, nodes, target_power_state):
-        for node in nodes:
+        nodes = list(nodes)
+
+        def change(node):
             print("Changing power state on "
                   "node {0} to {1}".format(node.uuid, target_power_state))
             self.bm_client.node.set_power_state(node.uuid, target_power_state)
 
+        utils.concurrent_map(change, nodes, self.concurrency)
+        for node in nodes:
+            self._record(node, 'power {0} requested'
+                         .format(target_power_state))
+
     def _apply_changes(self, nodes):
         self._change_power_state(nodes, 'reboot')
         self._wait_for_drac_config_jobs(nodes)
@@ -411,6 +639,7 @@ class ConfigureReadyState(command.Command):
         self._apply_changes(changed_nodes)
 
         self._change_power_state([node for node, profile in drac_nodes], 'off')
+        self._print_progress()
 
 
 class ConfigureBaremetalBoot(command.Command):
@@ -419,6 +648,7 @@ class ConfigureBaremetalBoot(command.Command):
     log = logging.getLogger(__name__ + ".ConfigureBaremetalBoot")
     loops = 12
     sleep_time = 10
+    _introspection_data = None
 
     def get_parser(self, prog_name):
         parser = super(ConfigureBaremetalBoot, self).get_parser(prog_name)
@@ -442,6 +672,20 @@ class ConfigureBaremetalBoot(command.Command):
                             action='store_true',
                             help='Whether to overwrite existing root device '
                             'hints when --detect-root-device is used.')
+        parser.add_argument('--concurrency', type=utils.positive_int,
+                            default=utils.DEFAULT_CONCURRENCY,
+                            help=_('Configure at most this many nodes at '
+                                   'the same time.'))
+        parser.add_argument('--no-introspection-cache',
+                            action='store_true',
+                            help=_('Always download the introspection data '
+                                   'used by --root-device instead of using '
+                                   'the local copy from a previous run.'))
+        parser.add_argument('--offline-introspection-data',
+                            action='store_true',
+                            help=_('Only use the introspection data in the '
+                                   'local cache for --root-device, without '
+                                   'contacting ironic-inspector.'))
         return parser
 
     def take_action(self, parsed_args):
@@ -472,63 +716,122 @@ class ConfigureBaremetalBoot(command.Command):
         self.log.debug("Using kernel ID: {0} and ramdisk ID: {1}".format(
             kernel_id, ramdisk_id))
 
-        for node in bm_client.node.list(maintenance=False):
-            # NOTE(bnemec): Ironic won't let us update the node while the
-            # power_state is transitioning.
-            # Make sure we have the current node state, and not a cached one
-            # from the list call above, which may have happened minutes ago.
-            node_detail = bm_client.node.get(node.uuid)
-            if node_detail.power_state is None:
-                self.log.warning('Node %s power state is in transition. '
-                                 'Waiting up to %d seconds for it to '
-                                 'complete.',
-                                 node_detail.uuid,
-                                 self.loops * self.sleep_time)
-                for _r in range(self.loops):
-                    time.sleep(self.sleep_time)
-                    node_detail = bm_client.node.get(node.uuid)
-                    if node_detail.power_state is not None:
-                        break
-                else:
-                    msg = ('Timed out waiting for node %s power state.' %
-                           node.uuid)
-                    raise exceptions.Timeout(msg)
-
-            # Get the full node info
-            capabilities = node_detail.properties.get('capabilities', None)
+        nodes = utils.list_nodes(bm_client,
+                                 ['uuid', 'power_state', 'properties'],
+                                 maintenance=False)
 
-            # Only update capabilities to add boot_option if it doesn't exist.
-            if capabilities:
-                if 'boot_option' not in capabilities:
-                    capabilities = "boot_option:local,%s" % capabilities
+        if parsed_args.root_device:
+            inspector_client = self.app.client_manager.baremetal_introspection
+            if parsed_args.no_introspection_cache:
+                self._introspection_data = inspector_client
             else:
-                capabilities = "boot_option:local"
-
-            self.log.debug("Configuring boot for Node {0}".format(
-                node.uuid))
-
-            bm_client.node.update(node.uuid, [
-                {
-                    'op': 'add',
-                    'path': '/properties/capabilities',
-                    'value': capabilities,
-                },
-                {
-                    'op': 'add',
-                    'path': '/driver_info/deploy_ramdisk',
-                    'value': ramdisk_id,
-                },
-                {
-                    'op': 'add',
-                    'path': '/driver_info/deploy_kernel',
-                    'value': kernel_id,
-                },
-            ])
-
-            self._apply_root_device_strategy(
-                node_detail, parsed_args.root_device,
-                parsed_args.root_device_minimum_size,
-                parsed_args.overwrite_root_device_hints)
+                self._introspection_data = utils.IntrospectionDataCache(
+                    inspector_client,
+                    offline=parsed_args.offline_introspection_data)
+                self._introspection_data.prefetch(
+                    [node.uuid for node in nodes
+                     if parsed_args.overwrite_root_device_hints or
+                     not node.properties.get('root_device')],
+                    parsed_args.concurrency)
+
+        def configure(node):
+            self._configure_node(node, kernel_id, ramdisk_id, parsed_args)
+
+        self._configure_nodes(bm_client, nodes, configure,
+                              parsed_args.concurrency)
+
+    def _configure_node(self, node, kernel_id, ramdisk_id, parsed_args):
+        bm_client = self.app.client_manager.baremetal
+        capabilities = node.properties.get('capabilities', None)
+
+        # Only update capabilities to add boot_option if it doesn't exist.
+        if capabilities:
+            if 'boot_option' not in capabilities:
+                capabilities = "boot_option:local,%s" % capabilities
+        else:
+            capabilities = "boot_option:local"
+
+        self.log.debug("Configuring boot for Node {0}".format(
+            node.uuid))
+
+        bm_client.node.update(node.uuid, [
+            {
+                'op': 'add',
+                'path': '/properties/capabilities',
+                'value': capabilities,
+            },
+            {
+                'op': 'add',
+                'path': '/driver_info/deploy_ramdisk',
+                'value': ramdisk_id,
+            },
+            {
+                'op': 'add',
+                'path': '/driver_info/deploy_kernel',
+                'value': kernel_id,
+            },
+        ])
+
+        self._apply_root_device_strategy(
+            node, parsed_args.root_device,
+            parsed_args.root_device_minimum_size,
+            parsed_args.overwrite_root_device_hints)
+
+    def _configure_nodes(self, bm_client, nodes, configure, concurrency):
+        """Call `configure` for every node on a pool of workers
+
+        Nodes listed with a power state in transition are parked on a
+        re-check queue, fetched again every `sleep_time` seconds and handed
+        to the workers as soon as their power state is known, so that one
+        slow BMC does not hold up the other nodes.
+
+        Every node is attempted. The error of the first node that failed is
+        raised once all of them are done.
+        """
+        nodes = list(nodes)
+        jobs = {}
+        # NOTE(bnemec): Ironic won't let us update the node while the
+        # power_state is transitioning.
+        parked = [node.uuid for node in nodes if node.power_state is None]
+
+        with utils.thread_pool(len(nodes), concurrency) as executor:
+            for node in nodes:
+                if node.power_state is not None:
+                    jobs[node.uuid] = executor.submit(configure, node)
+
+            for check in range(self.loops + 1):
+                if not parked:
+                    break
+                if check:
+                    time.sleep(self.sleep_time)
+                refreshed = utils.get_nodes(bm_client, parked)
+                waiting = []
+                for uuid in parked:
+                    if refreshed[uuid].power_state is None:
+                        waiting.append(uuid)
+                    else:
+                        jobs[uuid] = executor.submit(configure,
+                                                     refreshed[uuid])
+                if waiting and not check:
+                    self.log.warning(
+                        'Power state of nodes %s is in transition. Waiting '
+                        'up to %d seconds for it to complete.',
+                        ', '.join(waiting), self.loops * self.sleep_time)
+                parked = waiting
+
+        failed = []
+        for node in nodes:
+            job = jobs.get(node.uuid)
+            if job is not None and job.exception() is not None:
+                self.log.error('Failed to configure boot for node %s: %s',
+                               node.uuid, job.exception())
+                failed.append(job)
+        if failed:
+            failed[0].result()
+        if parked:
+            raise exceptions.Timeout(
+                'Timed out waiting for power state of nodes %s.' %
+                ', '.join(parked))
 
     def _apply_root_device_strategy(self, node, strategy, minimum_size,
                                     overwrite=False):
@@ -548,10 +851,9 @@ class ConfigureBaremetalBoot(command.Command):
                              node.uuid)
             return
 
-        inspector_client = self.app.client_manager.baremetal_introspection
         try:
-            data = inspector_client.get_data(node.uuid)
-        except ironic_inspector_client.ClientError:
+            data = self._introspection_data.get_data(node.uuid)
+        except (ironic_inspector_client.ClientError, exceptions.NotFound):
             raise exceptions.RootDeviceDetectionError(
                 'No introspection data found for node %s, '
                 'root device cannot be detected' % node.uuid)
@@ -637,8 +939,7 @@ class ShowNodeCapabilities(lister.Lister):
                          'get the list of all nodes and their profiles')
         bm_client = self.app.client_manager.baremetal
         rows = []
-        for node in bm_client.node.list():
-            node_detail = bm_client.node.get(node.uuid)
-            capabilities = node_detail.properties.get('capabilities')
+        for node in utils.list_nodes(bm_client, ['uuid', 'properties']):
+            capabilities = node.properties.get('capabilities')
             rows.append((node.uuid, capabilities))
         return (("Node UUID", "Node Capabilities"), rows, )
@@ -15,6 +15,8 @@
 from __future__ import print_function
 
 import argparse
+import contextlib
+import cProfile
 import glob
 import json
 import logging
@@ -24,7 +26,6 @@ import six
 import tempfile
 import time
 import uuid
-import yaml
 
 from cliff import command
 from heatclient.common import event_utils
@@ -41,6 +42,7 @@ from tripleo_common import update
 from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import utils
+from tripleoclient import yaml_utils
 
 
 class DeployOvercloud(command.Command):
@@ -49,6 +51,8 @@ class DeployOvercloud(command.Command):
     log = logging.getLogger(__name__ + ".DeployOvercloud")
     predeploy_errors = 0
     predeploy_warnings = 0
+    _template_cache = None
+    _phases = None
 
     def set_overcloud_passwords(self, stack_is_new, parameters):
         """Add passwords to the parameters dictionary
@@ -116,8 +120,7 @@ class DeployOvercloud(command.Command):
 
         # Update parameters from answers file:
         if args.answers_file is not None:
-            with open(args.answers_file, 'r') as answers_file:
-                answers = yaml.load(answers_file)
+            answers = yaml_utils.load_file(args.answers_file)
 
             if args.templates is None:
                 args.templates = answers['templates']
@@ -251,16 +254,25 @@ class DeployOvercloud(command.Command):
                      environments, timeout):
         """Verify the Baremetal nodes are available and do a stack update"""
 
-        self.log.debug("Processing environment files")
-        env_files, env = (
-            template_utils.process_multiple_environments_and_files(
-                environments))
-        if stack:
-            update.add_breakpoints_cleanup_into_env(env)
-
-        self.log.debug("Getting template contents")
-        template_files, template = template_utils.get_template_contents(
-            template_path)
+        with self._phase('template processing'):
+            self.log.debug("Processing environment files")
+            if self._template_cache is not None:
+                env_files, env = self._template_cache.process_environments(
+                    environments)
+            else:
+                env_files, env = (
+                    template_utils.process_multiple_environments_and_files(
+                        environments))
+            if stack:
+                update.add_breakpoints_cleanup_into_env(env)
+
+            self.log.debug("Getting template contents")
+            if self._template_cache is not None:
+                template_files, template = (
+                    self._template_cache.get_template_contents(template_path))
+            else:
+                template_files, template = (
+                    template_utils.get_template_contents(template_path))
 
         files = dict(list(template_files.items()) + list(env_files.items()))
 
@@ -284,28 +296,30 @@ class DeployOvercloud(command.Command):
         if timeout:
             stack_args['timeout_mins'] = timeout
 
-        if stack is None:
-            self.log.info("Performing Heat stack create")
-            action = 'CREATE'
-            marker = None
-            orchestration_client.stacks.create(**stack_args)
-        else:
-            self.log.info("Performing Heat stack update")
-            # Make sure existing parameters for stack are reused
-            stack_args['existing'] = 'true'
-            # Find the last top-level event to use for the first marker
-            events = event_utils.get_events(orchestration_client,
-                                            stack_id=stack_name,
-                                            event_args={'sort_dir': 'desc',
-                                                        'limit': 1})
-            marker = events[0].id if events else None
-            action = 'UPDATE'
-
-            orchestration_client.stacks.update(stack.id, **stack_args)
+        with self._phase('stack create/update'):
+            if stack is None:
+                self.log.info("Performing Heat stack create")
+                action = 'CREATE'
+                marker = None
+                orchestration_client.stacks.create(**stack_args)
+            else:
+                self.log.info("Performing Heat stack update")
+                # Make sure existing parameters for stack are reused
+                stack_args['existing'] = 'true'
+                # Find the last top-level event to use for the first marker
+                events = event_utils.get_events(
+                    orchestration_client, stack_id=stack_name,
+                    event_args={'sort_dir': 'desc', 'limit': 1})
+                marker = events[0].id if events else None
+                action = 'UPDATE'
+
+                orchestration_client.stacks.update(stack.id, **stack_args)
 
         verbose_events = self.app_args.verbose_level > 0
-        create_result = utils.wait_for_stack_ready(
-            orchestration_client, stack_name, marker, action, verbose_events)
+        with self._phase('stack wait', profile=False):
+            create_result = utils.wait_for_stack_ready(
+                orchestration_client, stack_name, marker, action,
+                verbose_events)
         if not create_result:
             if stack is None:
                 raise exceptions.DeploymentError("Heat Stack create failed.")
@@ -331,49 +345,51 @@ class DeployOvercloud(command.Command):
         clients = self.app.client_manager
         network_client = clients.network
 
-        parameters = self._update_parameters(
-            parsed_args, network_client, stack)
+        with self._phase('parameter generation'):
+            parameters = self._update_parameters(
+                parsed_args, network_client, stack)
 
         tht_root = parsed_args.templates
 
         print("Deploying templates in the directory {0}".format(
             os.path.abspath(tht_root)))
 
-        self.log.debug("Creating Environment file")
-        # TODO(jprovazn): env file generated by create_environment_file()
-        # is not very usable any more, scale params are included in
-        # parameters and keystone cert is generated on create only
-        env_path = utils.create_environment_file()
-        environments = []
-        add_registry = False
-
-        if stack is None:
-            self.log.debug("Creating Keystone certificates")
-            keystone_pki.generate_certs_into_json(env_path, False)
-            environments.append(env_path)
-            add_registry = True
+        with self._phase('environment files'):
+            self.log.debug("Creating Environment file")
+            # TODO(jprovazn): env file generated by create_environment_file()
+            # is not very usable any more, scale params are included in
+            # parameters and keystone cert is generated on create only
+            env_path = utils.create_environment_file()
+            environments = []
+            add_registry = False
 
-        if parsed_args.environment_directories:
-            environments.extend(self._load_environment_directories(
-                parsed_args.environment_directories))
-
-        environments.extend(self._create_parameters_env(parameters))
-        if parsed_args.rhel_reg:
-            reg_env = self._create_registration_env(parsed_args)
-            environments.extend(reg_env)
-            add_registry = True
-        if parsed_args.environment_files:
-            environments.extend(parsed_args.environment_files)
-            add_registry = True
-
-        if add_registry:
-            # default resource registry file should be passed only
-            # when creating a new stack, or when custom environments are
-            # specified, otherwise it might overwrite
-            # resource_registries in existing stack
-            resource_registry_path = os.path.join(
-                tht_root, constants.RESOURCE_REGISTRY_NAME)
-            environments.insert(0, resource_registry_path)
+            if stack is None:
+                self.log.debug("Creating Keystone certificates")
+                keystone_pki.generate_certs_into_json(env_path, False)
+                environments.append(env_path)
+                add_registry = True
+
+            if parsed_args.environment_directories:
+                environments.extend(self._load_environment_directories(
+                    parsed_args.environment_directories))
+
+            environments.extend(self._create_parameters_env(parameters))
+            if parsed_args.rhel_reg:
+                reg_env = self._create_registration_env(parsed_args)
+                environments.extend(reg_env)
+                add_registry = True
+            if parsed_args.environment_files:
+                environments.extend(parsed_args.environment_files)
+                add_registry = True
+
+            if add_registry:
+                # default resource registry file should be passed only
+                # when creating a new stack, or when custom environments are
+                # specified, otherwise it might overwrite
+                # resource_registries in existing stack
+                resource_registry_path = os.path.join(
+                    tht_root, constants.RESOURCE_REGISTRY_NAME)
+                environments.insert(0, resource_registry_path)
 
         self._try_overcloud_deploy_with_compat_yaml(
             tht_root, stack, parsed_args.stack, parameters, environments,
@@ -382,17 +398,19 @@ class DeployOvercloud(command.Command):
     def _try_overcloud_deploy_with_compat_yaml(self, tht_root, stack,
                                                stack_name, parameters,
                                                environments, timeout):
-        messages = ['The following errors occurred:']
-        for overcloud_yaml_name in constants.OVERCLOUD_YAML_NAMES:
-            overcloud_yaml = os.path.join(tht_root, overcloud_yaml_name)
-            try:
-                self._heat_deploy(stack, stack_name, overcloud_yaml,
-                                  parameters, environments, timeout)
-            except six.moves.urllib.error.URLError as e:
-                messages.append(str(e.reason))
-            else:
-                return
-        raise ValueError('\n'.join(messages))
+        # Look for the root template in the tree once, rather than process
+        # all the environments again for every name that turns out missing.
+        candidates = [os.path.join(tht_root, name)
+                      for name in constants.OVERCLOUD_YAML_NAMES]
+        overcloud_yaml = next(
+            (path for path in candidates if os.path.isfile(path)),
+            candidates[0])
+        self.log.debug("Using root template %s", overcloud_yaml)
+        try:
+            self._heat_deploy(stack, stack_name, overcloud_yaml,
+                              parameters, environments, timeout)
+        except six.moves.urllib.error.URLError as e:
+            raise ValueError('The following errors occurred:\n%s' % e.reason)
 
     def _is_tls_enabled(self, overcloud_endpoint):
         return overcloud_endpoint.startswith('https')
@@ -592,12 +610,16 @@ class DeployOvercloud(command.Command):
 
         flavors = self._collect_flavors(parsed_args)
 
-        self._check_ironic_boot_configuration(bm_client)
+        # all the checks below look at the same snapshot of ironic nodes
+        inventory = utils.NodeInventory(bm_client)
+
+        self._check_ironic_boot_configuration(bm_client, inventory)
 
         errors, warnings = utils.assign_and_verify_profiles(
             bm_client, flavors,
             assign_profiles=False,
-            dry_run=parsed_args.dry_run
+            dry_run=parsed_args.dry_run,
+            inventory=inventory
         )
         self.predeploy_errors += errors
         self.predeploy_warnings += warnings
@@ -620,7 +642,8 @@ class DeployOvercloud(command.Command):
                 'ObjectStorageCount': 0,
                 'BlockStorageCount': 0,
                 'CephStorageCount': 0,
-            }
+            },
+            inventory=inventory
         )
         if not enough_nodes:
             self.log.error(
@@ -730,8 +753,12 @@ class DeployOvercloud(command.Command):
 
         return result
 
-    def _check_ironic_boot_configuration(self, bm_client):
-        for node in bm_client.node.list(detail=True, maintenance=False):
+    def _check_ironic_boot_configuration(self, bm_client, inventory=None):
+        if inventory is not None:
+            nodes = inventory.list(maintenance=False)
+        else:
+            nodes = bm_client.node.list(detail=True, maintenance=False)
+        for node in nodes:
             self.log.debug("Checking config for Node {0}".format(node.uuid))
             self._check_node_boot_configuration(node)
 
@@ -927,23 +954,80 @@ class DeployOvercloud(command.Command):
             '--answers-file',
             help=_('Path to a YAML file with arguments and parameters.')
         )
+        parser.add_argument(
+            '--timing-report',
+            choices=['json', 'table'],
+            help=_('Print how long each phase of the deployment took and '
+                   'how many API calls were made to each service.')
+        )
+        parser.add_argument(
+            '--profile',
+            metavar='<file>',
+            help=_('Write a cProfile dump of the client side phases of the '
+                   'deployment, excluding the wait for the stack, to this '
+                   'file.')
+        )
+        parser.add_argument(
+            '--no-template-cache',
+            action='store_true',
+            help=_('Read and parse all templates and environments again '
+                   'instead of reusing the ones processed by earlier '
+                   'deployments.')
+        )
 
         return parser
 
+    @contextlib.contextmanager
+    def _phase(self, name, profile=True):
+        if self._phases is None:
+            yield
+        else:
+            with self._phases.phase(name, profile):
+                yield
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
-        self._validate_args(parsed_args)
+        profiler = cProfile.Profile() if parsed_args.profile else None
+        self._phases = utils.PhaseTimer(profiler)
+        # only the YAML files loaded by this deployment are reported
+        yaml_loads_before = len(yaml_utils.load_timings())
+        api_calls = None
+        session = getattr(self.app.client_manager, 'session', None)
+        if parsed_args.timing_report and session is not None:
+            api_calls = utils.ApiCallRecorder()
+            api_calls.install(session)
+
+        try:
+            self._deploy_overcloud(parsed_args)
+        finally:
+            if api_calls is not None:
+                api_calls.uninstall()
+            if profiler is not None:
+                profiler.dump_stats(parsed_args.profile)
+                self.log.info("Profile of the deployment written to %s",
+                              parsed_args.profile)
+            if parsed_args.timing_report:
+                print(self._phases.report(
+                    parsed_args.timing_report,
+                    api_calls.calls if api_calls is not None else None,
+                    yaml_utils.load_timings()[yaml_loads_before:]))
+
+    def _deploy_overcloud(self, parsed_args):
+        with self._phase('argument validation'):
+            self._validate_args(parsed_args)
 
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
 
-        stack = utils.get_stack(orchestration_client, parsed_args.stack)
-        parameters = self._update_parameters(
-            parsed_args, clients.network, stack)
+        with self._phase('parameter generation'):
+            stack = utils.get_stack(orchestration_client, parsed_args.stack)
+            parameters = self._update_parameters(
+                parsed_args, clients.network, stack)
 
-        errors, warnings = self._predeploy_verify_capabilities(
-            stack, parameters, parsed_args)
+        with self._phase('pre-deploy verification'):
+            errors, warnings = self._predeploy_verify_capabilities(
+                stack, parameters, parsed_args)
         if errors > 0:
             self.log.error(
                 "Configuration has %d errors, fix them before proceeding. "
@@ -991,19 +1075,23 @@ class DeployOvercloud(command.Command):
             print("Validation Finished")
             return
 
+        if not parsed_args.no_template_cache:
+            self._template_cache = utils.TemplateCache()
         self._deploy_tripleo_heat_templates(stack, parsed_args)
 
-        # Get a new copy of the stack after stack update/create. If it was
-        # a create then the previous stack object would be None.
-        stack = utils.get_stack(orchestration_client, parsed_args.stack)
-        # Force fetching of attributes
-        stack.get()
+        with self._phase('overcloudrc generation'):
+            # Get a new copy of the stack after stack update/create. If it
+            # was a create then the previous stack object would be None.
+            stack = utils.get_stack(orchestration_client, parsed_args.stack)
+            # Force fetching of attributes
+            stack.get()
 
-        utils.create_overcloudrc(stack, parsed_args.no_proxy)
-        utils.create_tempest_deployer_input()
+            utils.create_overcloudrc(stack, parsed_args.no_proxy)
+            utils.create_tempest_deployer_input()
 
         if stack_create and not parsed_args.skip_postconfig:
-            self._deploy_postconfig(stack, parsed_args)
+            with self._phase('keystone postconfig'):
+                self._deploy_postconfig(stack, parsed_args)
 
         overcloud_endpoint = utils.get_overcloud_endpoint(stack)
         print("Overcloud Endpoint: {0}".format(overcloud_endpoint))
@@ -16,16 +16,20 @@
 from __future__ import print_function
 
 import abc
+import collections
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import platform
 import re
-import requests
 import shutil
 import six
 import stat
 import subprocess
 import sys
+import threading
 import time
 
 from cliff import command
@@ -35,6 +39,23 @@ from prettytable import PrettyTable
 from tripleoclient import utils as plugin_utils
 
 
+# Output of builds running in parallel is prefixed with the image name
+_build_output = threading.local()
+_build_output_lock = threading.Lock()
+
+
+def _available_memory_gib():
+    """Memory available for new tmpfs mounts, in GiB, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.0 / 1024.0
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
 @six.add_metaclass(abc.ABCMeta)
 class ImageBuilder(object):
     """Base representation of an image building method"""
@@ -67,12 +88,28 @@ class DibImageBuilder(ImageBuilder):
 
     _min_tmpfs = 5
 
+    def _run(self, cmd):
+        prefix = getattr(_build_output, 'prefix', None)
+        if prefix is None:
+            subprocess.check_call(cmd, shell=True)
+            return
+
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        for line in iter(process.stdout.readline, b''):
+            with _build_output_lock:
+                sys.stdout.write('[%s] %s' % (
+                    prefix, line.decode('utf-8', 'replace')))
+                sys.stdout.flush()
+        process.stdout.close()
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
     def _disk_image_create(self, args):
-        subprocess.check_call('disk-image-create {0}'.format(args), shell=True)
+        self._run('disk-image-create {0}'.format(args))
 
     def _ramdisk_image_create(self, args):
-        subprocess.check_call('ramdisk-image-create {0}'.format(args),
-                              shell=True)
+        self._run('ramdisk-image-create {0}'.format(args))
 
     def build_ramdisk(self, parsed_args, ramdisk_type):
         deprecation_message = (
@@ -212,6 +249,19 @@ class BuildOvercloudImage(command.Command):
         'dib',
     ]
 
+    # CPUs a single disk-image-create run keeps busy
+    _CPUS_PER_BUILD = 2
+
+    BUILD_CACHE_DIR = '~/.cache/tripleoclient/images'
+    # download cache of diskimage-builder
+    IMAGE_CACHE_DIR = '~/.cache/image-create'
+    FEDORA_USER_URL = 'http://cloud.fedoraproject.org/fedora-21.x86_64.qcow2'
+    # variables inherited by disk-image-create that change what it builds
+    _BUILD_ENV_PREFIXES = ('DIB_', 'DELOREAN_', 'REG_')
+    _BUILD_ENV_VARS = ('ARCH', 'ELEMENTS_PATH', 'FS_TYPE', 'PACKAGES', 'RHOS')
+    # cached builds kept for each image type
+    _BUILD_CACHE_KEEP = 3
+
     def get_parser(self, prog_name):
         parser = super(BuildOvercloudImage, self).get_parser(prog_name)
         image_group = parser.add_mutually_exclusive_group(required=True)
@@ -336,6 +386,13 @@ class BuildOvercloudImage(command.Command):
             default=os.environ.get('FEDORA_USER_NAME', 'fedora-user'),
             help="Name of Fedora user image",
         )
+        parser.add_argument(
+            "--fedora-user-checksum",
+            dest="fedora_user_checksum",
+            default=os.environ.get('FEDORA_USER_CHECKSUM'),
+            help="SHA-256 checksum the downloaded Fedora user image must "
+                 "match",
+        )
         parser.add_argument(
             "--agent-name",
             dest="agent_name",
@@ -372,6 +429,29 @@ class BuildOvercloudImage(command.Command):
             default='',
             help="Extra arguments for the image builder",
         )
+        parser.add_argument(
+            "--no-build-cache",
+            dest="no_build_cache",
+            action="store_true",
+            help="Do not reuse images built earlier from the same inputs, "
+                 "only skip images whose files already exist.",
+        )
+        parser.add_argument(
+            "--replace-stale-images",
+            dest="replace_stale_images",
+            action="store_true",
+            help="Replace existing image files that were not built from the "
+                 "current inputs, or that differ from the cached build of "
+                 "them, instead of only warning about them.",
+        )
+        parser.add_argument(
+            "--max-parallel-builds",
+            dest="max_parallel_builds",
+            type=plugin_utils.positive_int,
+            help="Build at most this many images at the same time. By "
+                 "default it depends on the number of CPUs and on the "
+                 "memory available for tmpfs.",
+        )
         image_group.add_argument(
             "--builder",
             dest="builder",
@@ -454,26 +534,213 @@ class BuildOvercloudImage(command.Command):
         parsed_args.dib_common_elements = " ".join(dib_common_elements)
         parsed_args.dib_env_vars = env_vars
 
+    def _build_env(self, parsed_args):
+        """Variables of the environment that disk-image-create sees"""
+        env = dict((name, value) for name, value in os.environ.items()
+                   if name.startswith(self._BUILD_ENV_PREFIXES) or
+                   name in self._BUILD_ENV_VARS)
+        env.update(parsed_args.dib_env_vars)
+        return env
+
+    def _build_inputs(self, parsed_args, image_type, elements, outputs):
+        """Everything a build of `outputs` depends on, and its hash"""
+        inputs = {
+            'image_type': image_type,
+            'outputs': outputs,
+            'builder': parsed_args.builder,
+            'elements': elements,
+            'dib_common_elements': parsed_args.dib_common_elements,
+            'dib_env_vars': parsed_args.dib_env_vars,
+            'node_dist': parsed_args.node_dist,
+            'node_arch': parsed_args.node_arch,
+            'builder_extra_args': parsed_args.builder_extra_args,
+        }
+        checksum = hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode('utf-8'))
+
+        # The inherited environment, e.g. DIB_LOCAL_IMAGE or
+        # DIB_YUM_REPO_CONF, and the files it points to. Only the names are
+        # kept in the manifest, the values may hold credentials.
+        env = self._build_env(parsed_args)
+        inputs['build_env'] = sorted(env)
+        checksum_cache = parsed_args._checksum_cache
+        for name in sorted(env):
+            checksum.update(('%s=%s\n' % (name, env[name])).encode('utf-8'))
+            for value in env[name].split():
+                try:
+                    if not stat.S_ISREG(os.stat(value).st_mode):
+                        continue
+                except OSError:
+                    continue
+                checksum.update(
+                    checksum_cache.checksum(value).encode('utf-8'))
+
+        elements_path = parsed_args.dib_env_vars.get(
+            'ELEMENTS_PATH', parsed_args.elements_path)
+        for elements_dir in elements_path.split(os.pathsep):
+            for root, dirs, files in os.walk(elements_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    checksum.update(os.path.relpath(
+                        path, elements_dir).encode('utf-8'))
+                    if os.path.islink(path):
+                        checksum.update(os.readlink(path).encode('utf-8'))
+                        continue
+                    try:
+                        with open(path, 'rb') as f:
+                            checksum.update(f.read())
+                    except (IOError, OSError):
+                        # e.g. dangling links, they do not change the build
+                        pass
+        return inputs, checksum.hexdigest()
+
+    @staticmethod
+    def _same_file(path1, path2):
+        try:
+            st1, st2 = os.stat(path1), os.stat(path2)
+        except OSError:
+            return False
+        return (st1.st_size == st2.st_size and
+                int(st1.st_mtime) == int(st2.st_mtime))
+
+    def _prune_build_cache(self, image_type):
+        builds = []
+        build_cache_dir = os.path.expanduser(self.BUILD_CACHE_DIR)
+        for key in os.listdir(build_cache_dir):
+            manifest = os.path.join(build_cache_dir, key, 'inputs.json')
+            try:
+                with open(manifest) as f:
+                    if json.load(f)['image_type'] == image_type:
+                        builds.append((os.stat(manifest).st_mtime, key))
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+        for mtime, key in sorted(builds)[:-self._BUILD_CACHE_KEEP]:
+            self.log.debug("Removing old cached build %s" % key)
+            shutil.rmtree(os.path.join(build_cache_dir, key),
+                          ignore_errors=True)
+
+    def _restore_cached(self, parsed_args, cache_dir, outputs):
+        """Copy the outputs of a cached build which differ from the files"""
+        manifest = os.path.join(cache_dir, 'inputs.json')
+        with open(manifest) as f:
+            cached = json.load(f)['cached_outputs']
+        changed = [output for output in cached
+                   if not self._same_file(
+                       output, os.path.join(cache_dir, output))]
+        if not changed:
+            print('Image "%s" is up-to-date, skipping.' % outputs[0])
+        for output in changed:
+            if (os.path.exists(output) and
+                    not parsed_args.replace_stale_images):
+                # images are often customised in place after the build
+                self.log.warning(
+                    'Image file "%s" differs from the one built from '
+                    'the current inputs, leaving it alone. Use '
+                    '--replace-stale-images to replace it.' % output)
+                continue
+            print('Restoring image file "%s" built from the same inputs.'
+                  % output)
+            plugin_utils.atomic_copy_file(
+                os.path.join(cache_dir, output), output)
+        os.utime(manifest, None)
+
+    def _build_cached(self, parsed_args, image_type, elements, outputs,
+                      build, optional_outputs=()):
+        """Run `build` unless the build cache has outputs of the same inputs
+
+        :param image_type: name of the kind of image, e.g. agent-ramdisk
+        :param elements: image specific elements and arguments
+        :param outputs: files the build creates in the current directory
+        :param build: function building the image
+        :param optional_outputs: files the build may create, which are
+                                 cached along with the others
+        """
+        if parsed_args.no_build_cache:
+            if not all(os.path.isfile(output) for output in outputs):
+                build()
+            return
+
+        required = list(outputs)
+        outputs = required + list(optional_outputs)
+        inputs, key = self._build_inputs(parsed_args, image_type, elements,
+                                         outputs)
+        cache_dir = os.path.join(os.path.expanduser(self.BUILD_CACHE_DIR),
+                                 key)
+        manifest = os.path.join(cache_dir, 'inputs.json')
+
+        if os.path.exists(manifest):
+            try:
+                self._restore_cached(parsed_args, cache_dir, outputs)
+                return
+            except (IOError, OSError, ValueError, KeyError) as e:
+                # e.g. a file of the cached build was removed
+                self.log.warning('Cached build of "%s" is unusable, '
+                                 'ignoring it: %s' % (outputs[0], e))
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
+        existing = [output for output in outputs if os.path.exists(output)]
+        if existing:
+            if (not parsed_args.replace_stale_images and
+                    all(os.path.isfile(output) for output in required)):
+                self.log.warning(
+                    'Image file "%s" was not built from the current inputs, '
+                    'leaving it alone. Use --replace-stale-images to '
+                    'rebuild it.' % existing[0])
+                return
+            print('Image file "%s" was not built from the current '
+                  'inputs, rebuilding it.' % existing[0])
+        build()
+
+        cached = [output for output in outputs if os.path.exists(output)]
+        if not cached:
+            return
+        try:
+            tmp_dir = cache_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for output in cached:
+                plugin_utils.atomic_copy_file(
+                    output, os.path.join(tmp_dir, output))
+            inputs['cached_outputs'] = cached
+            with open(os.path.join(tmp_dir, 'inputs.json'), 'w') as f:
+                json.dump(inputs, f, indent=2, sort_keys=True)
+            os.rename(tmp_dir, cache_dir)
+            self._prune_build_cache(image_type)
+        except (IOError, OSError) as e:
+            self.log.warning('Could not cache the build of "%s": %s'
+                             % (outputs[0], e))
+
     def _build_image_ramdisk(self, parsed_args, ramdisk_type):
         image_name = vars(parsed_args)["%s_name" % ramdisk_type]
-        if (not os.path.isfile("%s.initramfs" % image_name) or
-           not os.path.isfile("%s.kernel" % image_name)):
-            parsed_args._builder.build_ramdisk(parsed_args, ramdisk_type)
+        self._build_cached(
+            parsed_args, '%s-ramdisk' % ramdisk_type,
+            vars(parsed_args)["%s_image_element" % ramdisk_type],
+            ["%s.initramfs" % image_name, "%s.kernel" % image_name],
+            lambda: parsed_args._builder.build_ramdisk(parsed_args,
+                                                       ramdisk_type))
 
     def _build_image_ramdisk_agent(self, parsed_args):
         image_name = vars(parsed_args)["agent_name"]
-        if (not os.path.isfile("%s.initramfs" % image_name) or
-           not os.path.isfile("%s.kernel" % image_name)):
-            parsed_args._builder.build_ramdisk_agent(parsed_args)
+        self._build_cached(
+            parsed_args, 'agent-ramdisk',
+            [parsed_args.agent_image_element,
+             parsed_args.agent_dib_extra_args],
+            ["%s.initramfs" % image_name, "%s.kernel" % image_name],
+            lambda: parsed_args._builder.build_ramdisk_agent(parsed_args))
 
     def _build_image_ramdisk_deploy(self, parsed_args):
         self._build_image_ramdisk(parsed_args, 'deploy')
 
     def _build_image_overcloud(self, parsed_args, node_type):
-        image_name = "%s.qcow2" % vars(parsed_args)['overcloud_%s_name' %
-                                                    node_type]
-        if not os.path.isfile(image_name):
-            parsed_args._builder.build_image(parsed_args, node_type)
+        image_name = vars(parsed_args)['overcloud_%s_name' % node_type]
+        self._build_cached(
+            parsed_args, 'overcloud-%s' % node_type,
+            vars(parsed_args)["overcloud_%s_dib_extra_args" % node_type],
+            ["%s.qcow2" % image_name],
+            lambda: parsed_args._builder.build_image(parsed_args, node_type),
+            optional_outputs=["%s.vmlinuz" % image_name,
+                              "%s.initrd" % image_name])
 
     def _build_image_overcloud_full(self, parsed_args):
         self._build_image_overcloud(parsed_args, 'full')
@@ -481,24 +748,89 @@ class BuildOvercloudImage(command.Command):
     def _build_image_fedora_user(self, parsed_args):
         image_name = "%s.qcow2" % parsed_args.fedora_user_name
         if not os.path.isfile(image_name):
-            if os.path.isfile('~/.cache/image-create/fedora-21.x86_64.qcow2'):
-                # Just copy the already downloaded Fedora cloud image as
-                # fedora-user.qcow2
-                shutil.copy2(
-                    '~/.cache/image-create/fedora-21.x86_64.qcow2',
-                    image_name)
-            else:
-                # Download the image
-                r = requests.get(
-                    'http://cloud.fedoraproject.org/fedora-21.x86_64.qcow2')
-                with open(image_name, 'wb') as f:
-                    f.write(r.content)
+            cache_dir = os.path.expanduser(self.IMAGE_CACHE_DIR)
+            cached_image = os.path.join(cache_dir,
+                                        os.path.basename(self.FEDORA_USER_URL))
+            checksum = parsed_args.fedora_user_checksum
+            if checksum and os.path.isfile(cached_image):
+                # the cache is shared with diskimage-builder, which may have
+                # left an interrupted or outdated image there
+                actual = plugin_utils.file_digests(
+                    cached_image, ('sha256',))['sha256']
+                if actual != checksum.lower():
+                    self.log.warning(
+                        "Cached image %s does not match the expected "
+                        "checksum, downloading it again", cached_image)
+                    os.unlink(cached_image)
+            if not os.path.isfile(cached_image):
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                # Download the image into the cache shared with
+                # diskimage-builder, resuming an interrupted download
+                plugin_utils.download_file(
+                    self.FEDORA_USER_URL, cached_image, checksum=checksum)
+            # Just copy the downloaded Fedora cloud image as
+            # fedora-user.qcow2
+            shutil.copy2(cached_image, image_name)
             # The perms always seem to be wrong when copying out of the cache,
             # so fix them
             os.chmod(
                 image_name,
                 stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
 
+    def _build_concurrency(self, parsed_args, count):
+        if parsed_args.max_parallel_builds:
+            limit = parsed_args.max_parallel_builds
+        else:
+            limit = multiprocessing.cpu_count() // self._CPUS_PER_BUILD
+            memory = _available_memory_gib()
+            if memory is not None:
+                # every build wants its own tmpfs
+                limit = min(limit, int(memory // DibImageBuilder._min_tmpfs))
+        return max(1, min(limit, count))
+
+    def _run_builds(self, parsed_args, builds):
+        """Run image builds, several at once if resources allow it
+
+        :param builds: list of (image type, build function) tuples
+        """
+        concurrency = self._build_concurrency(parsed_args, len(builds))
+        if concurrency == 1:
+            for image_type, build in builds:
+                build(parsed_args)
+            return
+
+        results = collections.OrderedDict(
+            (image_type, None) for image_type, build in builds)
+
+        def _build(image_type, build):
+            _build_output.prefix = image_type
+            started = time.time()
+            try:
+                build(parsed_args)
+            except Exception as e:
+                self.log.error('Building %s failed: %s' % (image_type, e))
+                results[image_type] = (e, time.time() - started)
+            else:
+                results[image_type] = (None, time.time() - started)
+            finally:
+                _build_output.prefix = None
+
+        self.log.debug("Building %d images at a time" % concurrency)
+        with plugin_utils.thread_pool(len(builds), concurrency) as executor:
+            for image_type, build in builds:
+                executor.submit(_build, image_type, build)
+
+        table = PrettyTable(['Image', 'Result', 'Time (s)'])
+        for image_type, (error, elapsed) in results.items():
+            table.add_row([image_type, 'failed' if error else 'built',
+                           '%.0f' % elapsed])
+        print(table, file=sys.stdout)
+
+        for error, elapsed in results.values():
+            if error is not None:
+                raise error
+
     def _create_builder(self, builder):
         if builder == 'dib':
             return DibImageBuilder()
@@ -510,28 +842,36 @@ class BuildOvercloudImage(command.Command):
         self.log.debug("take_action(%s)" % parsed_args)
 
         parsed_args._builder = self._create_builder(parsed_args.builder)
+        # shared by the builds, which may run at the same time
+        parsed_args._checksum_cache = plugin_utils.ChecksumCache()
 
         self._prepare_env_variables(parsed_args)
         parsed_args._builder.preprocess_parsed_args(parsed_args)
         self.log.debug("Environment: %s" % parsed_args.dib_env_vars)
 
+        build_functions = {
+            'agent-ramdisk': self._build_image_ramdisk_agent,
+            'deploy-ramdisk': self._build_image_ramdisk_deploy,
+            'fedora-user': self._build_image_fedora_user,
+            'overcloud-full': self._build_image_overcloud_full,
+        }
         if parsed_args.all:
-            self._build_image_ramdisk_agent(parsed_args)
-            self._build_image_overcloud_full(parsed_args)
+            image_types = ['agent-ramdisk', 'overcloud-full']
         else:
+            image_types = []
             for image_type in parsed_args.image_types:
-                {
-                    'agent-ramdisk': self._build_image_ramdisk_agent,
-                    'deploy-ramdisk': self._build_image_ramdisk_deploy,
-                    'fedora-user': self._build_image_fedora_user,
-                    'overcloud-full': self._build_image_overcloud_full,
-                }[image_type](parsed_args)
+                if image_type not in image_types:
+                    image_types.append(image_type)
+        self._run_builds(parsed_args,
+                         [(image_type, build_functions[image_type])
+                          for image_type in image_types])
 
 
 class UploadOvercloudImage(command.Command):
     """Create overcloud glance images from existing image files."""
     auth_required = False
     log = logging.getLogger(__name__ + ".UploadOvercloudImage")
+    _checksum_cache = None
 
     def _env_variable_or_set(self, key_name, default_value):
         os.environ[key_name] = os.environ.get(key_name, default_value)
@@ -565,7 +905,8 @@ class UploadOvercloudImage(command.Command):
     def _image_changed(self, name, filename):
         image = utils.find_resource(self.app.client_manager.image.images,
                                     name)
-        return image.checksum != plugin_utils.file_checksum(filename)
+        return image.checksum != plugin_utils.file_checksum(
+            filename, cache=self._checksum_cache)
 
     def _check_file_exists(self, file_path):
         if not os.path.isfile(file_path):
@@ -579,8 +920,29 @@ class UploadOvercloudImage(command.Command):
         return open(filepath, 'rb')
 
     def _copy_file(self, src, dest):
-        subprocess.check_call('sudo cp -f "{0}" "{1}"'.format(src, dest),
-                              shell=True)
+        dest_dir = os.path.dirname(os.path.abspath(dest))
+        if os.access(dest_dir, os.W_OK):
+            plugin_utils.atomic_copy_file(src, dest)
+        else:
+            # Copy as root next to the destination, then rename it into
+            # place so that PXE clients never get a partial file.
+            tmp_dest = os.path.join(dest_dir,
+                                    '.%s.tmp' % os.path.basename(dest))
+            subprocess.check_call(['sudo', 'cp', '-f',
+                                   '--preserve=mode,timestamps',
+                                   src, tmp_dest])
+            subprocess.check_call(['sudo', 'mv', '-f', tmp_dest, dest])
+
+        # The copy keeps the timestamps of the source, so its checksum, if
+        # already known, is valid for the destination too.
+        if self._checksum_cache is not None:
+            try:
+                checksum = self._checksum_cache.get(src)
+                if checksum is not None:
+                    self._checksum_cache.set(dest, checksum, os.stat(dest))
+            except OSError as e:
+                self.log.debug('Could not cache the checksum of "%s": %s'
+                               % (dest, e))
 
     def _image_try_update(self, image_name, image_file, parsed_args):
         image = self._get_image(image_name)
@@ -605,8 +967,10 @@ class UploadOvercloudImage(command.Command):
             return None
 
     def _files_changed(self, filepath1, filepath2):
-        return (plugin_utils.file_checksum(filepath1) !=
-                plugin_utils.file_checksum(filepath2))
+        return (plugin_utils.file_checksum(filepath1,
+                                           cache=self._checksum_cache) !=
+                plugin_utils.file_checksum(filepath2,
+                                           cache=self._checksum_cache))
 
     def _file_create_or_update(self, src_file, dest_file, update_existing):
         if os.path.isfile(dest_file):
@@ -628,11 +992,42 @@ class UploadOvercloudImage(command.Command):
         print(table, file=sys.stdout)
 
     def _upload_image(self, *args, **kwargs):
+        data = kwargs.get('data')
+        st = None
+        if hasattr(data, 'read'):
+            # checksum the data while it is streamed to glance
+            if hasattr(data, 'name') and hasattr(data, 'fileno'):
+                st = os.fstat(data.fileno())
+            data = kwargs['data'] = plugin_utils.ChecksumFile(data)
         image = self.app.client_manager.image.images.create(*args, **kwargs)
+        if isinstance(data, plugin_utils.ChecksumFile) and image.checksum:
+            if image.checksum != data.hexdigest():
+                # do not leave a corrupt image for other images to link to
+                try:
+                    self.app.client_manager.image.images.delete(image.id)
+                except Exception as e:
+                    self.log.error('Could not delete the corrupt image '
+                                   '"%s": %s' % (image.name, e))
+                raise exceptions.CommandError(
+                    'Checksum of the uploaded image "%s" (%s) does not match '
+                    'the local file (%s).' % (image.name, image.checksum,
+                                              data.hexdigest()))
+            elif st is not None and self._checksum_cache is not None:
+                self._checksum_cache.set(data.name, data.hexdigest(), st)
         print('Image "%s" was uploaded.' % image.name, file=sys.stdout)
         self._print_image_info(image)
         return image
 
+    def _image_try_update_or_upload(self, name, filename, parsed_args,
+                                    **kwargs):
+        return (self._image_try_update(name, filename, parsed_args) or
+                self._upload_image(
+                    name=name,
+                    is_public=True,
+                    data=self._read_image_file_pointer(
+                        parsed_args.image_path, filename),
+                    **kwargs))
+
     def get_parser(self, prog_name):
         parser = super(UploadOvercloudImage, self).get_parser(prog_name)
         parser.add_argument(
@@ -662,6 +1057,7 @@ class UploadOvercloudImage(command.Command):
         self.log.debug("take_action(%s)" % parsed_args)
 
         self._env_variable_or_set('AGENT_NAME', 'ironic-python-agent')
+        self._checksum_cache = plugin_utils.ChecksumCache()
 
         self.log.debug("checking if image files exist")
 
@@ -681,44 +1077,48 @@ class UploadOvercloudImage(command.Command):
 
         oc_vmlinuz_name = '%s-vmlinuz' % image_name
         oc_vmlinuz_file = '%s.vmlinuz' % image_name
-        kernel = (self._image_try_update(oc_vmlinuz_name,
-                                         oc_vmlinuz_file,
-                                         parsed_args) or
-                  self._upload_image(
-                      name=oc_vmlinuz_name,
-                      is_public=True,
-                      disk_format='aki',
-                      data=self._read_image_file_pointer(
-                          parsed_args.image_path, oc_vmlinuz_file)
-        ))
-
         oc_initrd_name = '%s-initrd' % image_name
         oc_initrd_file = '%s.initrd' % image_name
-        ramdisk = (self._image_try_update(oc_initrd_name,
-                                          oc_initrd_file,
-                                          parsed_args) or
-                   self._upload_image(
-                       name=oc_initrd_name,
-                       is_public=True,
-                       disk_format='ari',
-                       data=self._read_image_file_pointer(
-                           parsed_args.image_path, oc_initrd_file)
-        ))
-
         oc_name = image_name
         oc_file = '%s.qcow2' % image_name
-        overcloud_image = (self._image_try_update(oc_name, oc_file,
-                                                  parsed_args) or
-                           self._upload_image(
-                               name=oc_name,
-                               is_public=True,
-                               disk_format='qcow2',
-                               container_format='bare',
-                               properties={'kernel_id': kernel.id,
-                                           'ramdisk_id': ramdisk.id},
-                               data=self._read_image_file_pointer(
-                                   parsed_args.image_path, oc_file)
-        ))
+        deploy_kernel_name = 'bm-deploy-kernel'
+        deploy_kernel_file = '%s.kernel' % os.environ['AGENT_NAME']
+        deploy_ramdisk_name = 'bm-deploy-ramdisk'
+        deploy_ramdisk_file = '%s.initramfs' % os.environ['AGENT_NAME']
+
+        # create the client before it is shared between the uploads
+        self.app.client_manager.image
+
+        # Images are uploaded concurrently, except for the overcloud image
+        # which needs the IDs of its kernel and ramdisk.
+        with plugin_utils.thread_pool(4) as executor:
+            kernel_job = executor.submit(
+                self._image_try_update_or_upload, oc_vmlinuz_name,
+                oc_vmlinuz_file, parsed_args, disk_format='aki')
+            ramdisk_job = executor.submit(
+                self._image_try_update_or_upload, oc_initrd_name,
+                oc_initrd_file, parsed_args, disk_format='ari')
+            self.log.debug("uploading bm images to glance")
+            deploy_jobs = [
+                executor.submit(
+                    self._image_try_update_or_upload, deploy_kernel_name,
+                    deploy_kernel_file, parsed_args, disk_format='aki'),
+                executor.submit(
+                    self._image_try_update_or_upload, deploy_ramdisk_name,
+                    deploy_ramdisk_file, parsed_args, disk_format='ari'),
+            ]
+
+            kernel = kernel_job.result()
+            ramdisk = ramdisk_job.result()
+            overcloud_image = self._image_try_update_or_upload(
+                oc_name, oc_file, parsed_args,
+                disk_format='qcow2',
+                container_format='bare',
+                properties={'kernel_id': kernel.id,
+                            'ramdisk_id': ramdisk.id})
+
+            for job in deploy_jobs:
+                job.result()
 
         # check overcloud image links
         if (overcloud_image.properties['kernel_id'] != kernel.id or
@@ -727,31 +1127,6 @@ class UploadOvercloudImage(command.Command):
                            ' images is MISSING OR leads to OLD image.'
                            ' You can keep it or fix it manually.')
 
-        self.log.debug("uploading bm images to glance")
-
-        deploy_kernel_name = 'bm-deploy-kernel'
-        deploy_kernel_file = '%s.kernel' % os.environ['AGENT_NAME']
-        self._image_try_update(deploy_kernel_name, deploy_kernel_file,
-                               parsed_args) or self._upload_image(
-            name=deploy_kernel_name,
-            is_public=True,
-            disk_format='aki',
-            data=self._read_image_file_pointer(
-                parsed_args.image_path,
-                deploy_kernel_file)
-        )
-
-        deploy_ramdisk_name = 'bm-deploy-ramdisk'
-        deploy_ramdisk_file = '%s.initramfs' % os.environ['AGENT_NAME']
-        self._image_try_update(deploy_ramdisk_name, deploy_ramdisk_file,
-                               parsed_args) or self._upload_image(
-            name=deploy_ramdisk_name,
-            is_public=True,
-            disk_format='ari',
-            data=self._read_image_file_pointer(parsed_args.image_path,
-                                               deploy_ramdisk_file)
-        )
-
         self.log.debug("copy agent images to HTTP BOOT dir")
 
         self._file_create_or_update(
@@ -21,7 +21,8 @@ import os
 from cliff import command
 import ipaddress
 import six
-import yaml
+
+from tripleoclient import yaml_utils
 
 
 class ValidateOvercloudNetenv(command.Command):
@@ -41,8 +42,7 @@ class ValidateOvercloudNetenv(command.Command):
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
-        with open(parsed_args.netenv, 'r') as net_file:
-            network_data = yaml.load(net_file)
+        network_data = yaml_utils.load_file(parsed_args.netenv)
 
         cidrinfo = {}
         poolsinfo = {}
@@ -160,8 +160,7 @@ class ValidateOvercloudNetenv(command.Command):
 
     def NIC_validate(self, resource, path):
         try:
-            with open(path, 'r') as nic_file:
-                nic_data = yaml.load(nic_file)
+            nic_data = yaml_utils.load_file(path)
         except IOError:
             self.log.error(
                 'The resource "%s" reference file does not exist: "%s"',
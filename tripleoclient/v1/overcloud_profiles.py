@@ -35,6 +35,14 @@ class MatchProfiles(command.Command):
             default=False,
             help=_('Only run validations, but do not apply any changes.')
         )
+        parser.add_argument(
+            '--deterministic',
+            action='store_true',
+            default=False,
+            help=_('Process flavors ordered by name and nodes ordered by '
+                   'UUID, so that repeated runs assign profiles to the same '
+                   'nodes.')
+        )
         utils.add_deployment_plan_arguments(parser)
         return parser
 
@@ -47,7 +55,8 @@ class MatchProfiles(command.Command):
         errors, warnings = utils.assign_and_verify_profiles(
             bm_client, flavors,
             assign_profiles=True,
-            dry_run=parsed_args.dry_run
+            dry_run=parsed_args.dry_run,
+            deterministic=parsed_args.deterministic
         )
         if errors:
             raise exceptions.ProfileMatchingError(
@@ -14,7 +14,6 @@
 #
 
 import logging
-import yaml
 
 from cliff import command
 from openstackclient.common import exceptions as oscexc
@@ -23,6 +22,7 @@ from openstackclient.i18n import _
 from tripleo_common import update
 
 from tripleoclient import constants
+from tripleoclient import yaml_utils
 
 
 class UpdateOvercloud(command.Command):
@@ -64,16 +64,15 @@ class UpdateOvercloud(command.Command):
                 "You must specify either --templates or --answers-file")
 
         if parsed_args.answers_file is not None:
-            with open(parsed_args.answers_file, 'r') as answers_file:
-                answers = yaml.load(answers_file)
+            answers = yaml_utils.load_file(parsed_args.answers_file)
 
-                if parsed_args.templates is None:
-                    parsed_args.templates = answers['templates']
-                if 'environments' in answers:
-                    if parsed_args.environment_files is not None:
-                        answers.environments.extend(
-                            parsed_args.environment_files)
-                    parsed_args.environment_files = answers['environments']
+            if parsed_args.templates is None:
+                parsed_args.templates = answers['templates']
+            if 'environments' in answers:
+                if parsed_args.environment_files is not None:
+                    answers['environments'].extend(
+                        parsed_args.environment_files)
+                parsed_args.environment_files = answers['environments']
 
         self.log.debug("take_action(%s)" % parsed_args)
         clients = self.app.client_manager
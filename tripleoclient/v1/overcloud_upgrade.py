@@ -14,7 +14,6 @@
 #
 
 import logging
-import yaml
 
 from cliff import command
 from openstackclient.common import utils
@@ -22,6 +21,7 @@ from openstackclient.i18n import _
 from tripleo_common import upgrade
 
 from tripleoclient import constants
+from tripleoclient import yaml_utils
 
 
 class UpgradeOvercloud(command.Command):
@@ -66,17 +66,16 @@ class UpgradeOvercloud(command.Command):
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
         if parsed_args.answers_file is not None:
-            with open(parsed_args.answers_file, 'r') as answers_file:
-                answers = yaml.load(answers_file)
+            answers = yaml_utils.load_file(parsed_args.answers_file)
 
-                parsed_args.templates = (constants.TRIPLEO_HEAT_TEMPLATES if
-                                         answers.get('templates') is None else
-                                         answers.get('templates'))
-                if 'environments' in answers:
-                    if parsed_args.environment_files is not None:
-                        answers.environments.extend(
-                            parsed_args.environment_files)
-                    parsed_args.environment_files = answers['environments']
+            parsed_args.templates = (constants.TRIPLEO_HEAT_TEMPLATES if
+                                     answers.get('templates') is None else
+                                     answers.get('templates'))
+            if 'environments' in answers:
+                if parsed_args.environment_files is not None:
+                    answers['environments'].extend(
+                        parsed_args.environment_files)
+                parsed_args.environment_files = answers['environments']
 
         clients = self.app.client_manager
 
@@ -0,0 +1,93 @@
+#   Copyright 2016 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Safe YAML loading shared by the commands
+
+Documents are parsed with the libyaml based CSafeLoader when PyYAML was
+built with it, which is several times faster than the pure Python loader,
+and never with a loader able to construct arbitrary Python objects.
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from tripleoclient import utils
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+LOG = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_documents = {}
+_timings = []
+
+
+def load(stream):
+    """Parse a YAML document from a string or a file object"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if utils.is_racy(st):
+        return None
+    return (os.path.realpath(path),) + tuple(utils.file_stat_key(st))
+
+
+def load_file(path):
+    """Parse a YAML file, reusing the document parsed earlier if unchanged
+
+    Documents are memoized for the life of the process by path, size and
+    modification time. The caller gets its own copy and may modify it.
+    """
+    key = _file_key(path)
+    started = time.time()
+    with _lock:
+        document = _documents.get(key) if key else None
+    cached = document is not None
+    if not cached:
+        with open(path, 'r') as f:
+            document = load(f)
+        if key:
+            with _lock:
+                _documents[key] = document
+    elapsed = time.time() - started
+
+    with _lock:
+        _timings.append((path, elapsed, cached))
+    LOG.debug("Loaded %s in %.3fs%s", path, elapsed,
+              " (cached)" if cached else "")
+    return copy.deepcopy(document) if key else document
+
+
+def load_timings():
+    """List of (path, seconds, cached) for every file loaded so far"""
+    with _lock:
+        return list(_timings)
+
+
+def clear_cache():
+    """Forget the memoized documents and the recorded timings"""
+    with _lock:
+        _documents.clear()
+        del _timings[:]